@@ -32,6 +32,9 @@ utils.declare('outfox.Factory', null, {
         this.tokens = [];
         // dictionary mapping service names to ServerProxy instances
         this.services = {};
+        // dictionary mapping names of failed services to the ServerProxy 
+        // still hosting other services, until their pages let go
+        this.failed = {};
         // dictionary mapping page ids to PageController instances
         this.controllers = {};
         // per origin (scheme, host, port) white/black list for outfox access
@@ -80,10 +83,10 @@ utils.declare('outfox.Factory', null, {
             var pt = this.page_tokens[key];
             utils.disconnect(pt);
         }
-        // shutdown all services
+        // shutdown all services, once per proxy even if it hosts several
         for(var key in this.services) {
             var sv = this.services[key];
-            sv.shutdown();
+            if(sv.socket) sv.shutdown();
         }
         // shutdown access api
         this.access.shutdown();
@@ -234,21 +237,44 @@ utils.declare('outfox.Factory', null, {
     
     /**
      * Called when a service fails after its launch by a ServerProxy. Removes
-     * all references to the service from this factory.
+     * the references to the failed service from this factory, and shuts down
+     * the proxy once none of the services it hosts are left.
      *
+     * @param proxy ServerProxy instance reporting the failure
      * @param json JSON encoded failed service response object
      */
-    _onFailedService: function(json) {
+    _onFailedService: function(proxy, json) {
         // decode to a response object
         var resp = utils.fromJson(json);
-        // get the proxy for the service
-        var proxy = this.services[resp.service];
-        // do nothing if we don't have a proxy for the service
-        if(!proxy) return;
+        // do nothing unless the service runs on the reporting proxy
+        if(this.services[resp.service] !== proxy) return;
+        // pages of the failed service still stop it through the proxy
+        delete this.services[resp.service];
+        this.failed[resp.service] = proxy;
+        for(var i=0; i < proxy.hosted.length; i++) {
+            // other services keep the process
+            if(this.services[proxy.hosted[i]] === proxy) return;
+        }
         // shutdown service proxy object
+        this._removeService(proxy);
+    },
+
+    /**
+     * Shuts down a service proxy and removes references to it for every
+     * service hosted by its process.
+     *
+     * @param proxy ServerProxy instance
+     */
+    _removeService: function(proxy) {
         proxy.shutdown();
-        // remove reference to the proxy
-        delete this.services[resp.service];
+        for(var i=0; i < proxy.hosted.length; i++) {
+            if(this.services[proxy.hosted[i]] === proxy) {
+                delete this.services[proxy.hosted[i]];
+            }
+            if(this.failed[proxy.hosted[i]] === proxy) {
+                delete this.failed[proxy.hosted[i]];
+            }
+        }
     },
 
     /**
@@ -269,9 +295,16 @@ utils.declare('outfox.Factory', null, {
             proxy = new outfox.ServerProxy(service);
             // register our fail service method as an observer for the
             // special all pages * id
-            proxy.addObserver('*', utils.bind(this, this._onFailedService));
-            // store the proxy for future requests
-            this.services[service] = proxy;
+            proxy.addObserver('*', utils.bind(this, this._onFailedService, 
+                [proxy]));
+            // store the proxy for future requests to any service it hosts
+            // that is not already running elsewhere
+            for(var i=0; i < proxy.hosted.length; i++) {
+                if(!this.services[proxy.hosted[i]]) {
+                    this.services[proxy.hosted[i]] = proxy;
+                }
+            }
+            delete this.failed[service];
         }
         // add the requester as an observer
         proxy.addObserver(page_id, ob);
@@ -288,8 +321,8 @@ utils.declare('outfox.Factory', null, {
      */
     stopService: function(page_id, service) {
         logit('Factory: stopping service', page_id, service);
-        // check if the service started
-        var proxy = this.services[service];
+        // check if the service started, or failed on a proxy still in use
+        var proxy = this.services[service] || this.failed[service];
         // ignore stops if the service is not started or has already failed
         // and was removed
         logit('proxy', proxy);
@@ -299,10 +332,8 @@ utils.declare('outfox.Factory', null, {
         logit('count', count);
         if(count <= 1) {
             logit('Factory: shutting down service');
-            // shutdown the proxy
-            proxy.shutdown();
-            // remove reference to the proxy
-            delete this.services[service];
+            // shutdown the proxy and remove references to it
+            this._removeService(proxy);
         }
     },
 
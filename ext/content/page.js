@@ -153,9 +153,11 @@ utils.declare('outfox.PageController', null, {
      */
     _onResponse: function(json) {
         var cmd = utils.fromJson(json);
-        if(cmd.action == 'stopped-service' || cmd.action == 'failed-service') {
+        if((cmd.action == 'stopped-service' || cmd.action == 'failed-service')
+            && this.services[cmd.service]) {
             // inform the factory that this page is no longer interested in
-            // the service that failed or stopped
+            // the service that failed or stopped; a shared process reports
+            // failures of services this page never started too
             this.factory.stopService(this.id, cmd.service)
             delete this.services[cmd.service];
         }
@@ -14,6 +14,11 @@
 * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 * */
 const DELIMITER = '\3';
+// framing names negotiated with the service
+const DELIMITED_FRAMING = 'delimited';
+const LENGTH_FRAMING = 'length';
+// bytes in a length prefixed frame header: JSON size, attachment size
+const FRAME_HEADER_SIZE = 8;
 
 /**
  * Manages a single socket connection to an external service process.
@@ -36,12 +41,23 @@ utils.declare('outfox.ServerProxy', null, {
         this.observers = {};
         // number of observers (a reference count)
         this.observer_count = 0;
+        // dictionary mapping page ids to the number of services each page 
+        // started through this proxy
+        this.refs = {};
         // incoming stream buffer
         this.in_buff = '';
         // outgoing stream buffer
         this.out_buff = [];
+        // framing of messages from and to the service; both start delimited
+        // and switch when either side announces length framing
+        this.in_framing = DELIMITED_FRAMING;
+        this.out_framing = DELIMITED_FRAMING;
+        // whether length framing has been offered on this connection
+        this.offered = false;
         // string service name
         this.name = name;
+        // array of service names served by the launched process
+        this.hosted = [name];
 
         // encode all outgoing unicode as utf-8
         // decode all incoming to unicode from utf-8
@@ -70,7 +86,11 @@ utils.declare('outfox.ServerProxy', null, {
         this.socket = null;
         this.out_buff = [];
         this.in_buff = '';
+        this.in_framing = DELIMITED_FRAMING;
+        this.out_framing = DELIMITED_FRAMING;
+        this.offered = false;
         this.observers = [];
+        this.refs = {};
         logit('ServerProxy: shutdown');
     },
 
@@ -84,6 +104,8 @@ utils.declare('outfox.ServerProxy', null, {
      */
     addObserver: function(page_id, ob) {
         this.observers[page_id] = ob;
+        // a page may start several services hosted by one process
+        this.refs[page_id] = (this.refs[page_id] || 0) + 1;
         this.observer_count += 1;
         return this.observer_count;
     },
@@ -94,7 +116,11 @@ utils.declare('outfox.ServerProxy', null, {
      * @param page_id Page id of the observer
      */    
     removeObserver: function(page_id) {
-        delete this.observers[page_id];
+        this.refs[page_id] -= 1;
+        if(!(this.refs[page_id] > 0)) {
+            delete this.observers[page_id];
+            delete this.refs[page_id];
+        }
         this.observer_count -= 1;
         return this.observer_count;
     },
@@ -104,20 +130,24 @@ utils.declare('outfox.ServerProxy', null, {
      * it.
      *
      * @param description Description of the failure
+     * @param service Name of the failed service
      * @return Failure response object
      */
-    _buildFailure: function(description) {
+    _buildFailure: function(description, service) {
         var resp = {};
         resp.action = 'failed-service';
         resp.description = description;
-        resp.service = this.name;
+        resp.service = service;
         return utils.toJson(resp);
     },
     
     /**
      * Reads the services XML file to find information about the service
-     * managed by this proxy. Throws exceptions if the file is not readable,
-     * parseable, or does not contain info about the named service.
+     * managed by this proxy. Prefers a host serving several services in one
+     * process on this OS, if one lists the named service and the user turned
+     * on its preference. Throws exceptions
+     * if the file is not readable, parseable, or does not contain info about
+     * the named service.
      *
      * @param name Name of the service
      */
@@ -146,6 +176,27 @@ utils.declare('outfox.ServerProxy', null, {
             throw new Error('Could not parse services DOM.');
         }
         
+        // look for a shared host process on this OS the user opted into 
+        // first
+        var os = Components.classes["@mozilla.org/xre/app-info;1"].getService(Components.interfaces.nsIXULRuntime).OS;
+        var prefs = Components.classes["@mozilla.org/preferences-service;1"].getService(Components.interfaces.nsIPrefBranch);
+        var hosts = doc.getElementsByTagName('host');
+        for(var i=0; i < hosts.length; i++) {
+            var host = hosts[i];
+            var names = host.getAttribute('services').split(' ');
+            var enabled = false;
+            try {
+                enabled = prefs.getBoolPref(host.getAttribute('pref'));
+            } catch(e) {
+                // unset preferences leave the host off
+            }
+            if(enabled && host.getAttribute('os') == os && 
+                names.indexOf(name) != -1) {
+                this.hosted = names;
+                return host;
+            }
+        }
+
         // pull all services sections; doc.getElementById not implemented
         // for generic xml:id ...
         var service = null;
@@ -270,31 +321,122 @@ utils.declare('outfox.ServerProxy', null, {
      *
      * @param page_id ID of the page sending the command
      * @param json Command for service
+     * @param data Optional binary string to attach; requires length framing
      */
-    send: function(page_id, json) {
+    send: function(page_id, json, data) {
         if(!this.out_str) {
             // connection not ready, queue
-            this.out_buff.push([page_id, json]);
+            this.out_buff.push([page_id, json, data]);
             return;
         }
         // convert unicode to utf-8
         json = this.codec.ConvertFromUnicode(json) + this.codec.Finish();
 
-        // include page id and null character delimiter
-        var msg = '{"page_id" : '+page_id+', "cmd" : '+json+'}'+DELIMITER;
-        var size = msg.length;
-        var written = 0;
-        // @todo: are we supposed to loop in a callback? delay with a timeout?
-        while(written < size) {
-            written += this.out_str.write(msg, msg.length);
-            if(written < size) {
-                // avoid doing slice if we don't need it
-                msg = msg.slice(written);
-            }
+        // include page id in the envelope
+        var msg = '{"page_id" : '+page_id+', "cmd" : '+json;
+        if(!this.offered) {
+            // the first message on a connection is always a start-service;
+            // offer length framing along with it
+            msg += ', "framing_offer" : "'+LENGTH_FRAMING+'"';
+            this.offered = true;
+        }
+        msg += '}';
+        this._write(this._frame(msg, data));
+        logit('ServerProxy: sent message');
+    },
+
+    /**
+     * Frames a message for the current outgoing framing.
+     *
+     * @param msg UTF-8 encoded JSON string
+     * @param data Optional binary string to attach
+     * @return Binary string to write
+     */
+    _frame: function(msg, data) {
+        data = data || '';
+        if(this.out_framing == LENGTH_FRAMING) {
+            return (this._packSize(msg.length) + this._packSize(data.length) +
+                msg + data);
         }
+        if(data.length) {
+            throw new Error('Attachments require length framing.');
+        }
+        // include delimiter
+        return msg+DELIMITER;
+    },
+
+    /**
+     * Packs a size as a 32-bit big endian binary string.
+     *
+     * @param size Integer size
+     * @return Four character binary string
+     */
+    _packSize: function(size) {
+        return String.fromCharCode((size >>> 24) & 0xff, (size >>> 16) & 0xff,
+            (size >>> 8) & 0xff, size & 0xff);
+    },
+
+    /**
+     * Unpacks a 32-bit big endian size from a binary string.
+     *
+     * @param str Binary string
+     * @param offset Offset of the size in the string
+     * @return Integer size
+     */
+    _unpackSize: function(str, offset) {
+        return (((str.charCodeAt(offset) << 24) >>> 0) +
+            (str.charCodeAt(offset+1) << 16) +
+            (str.charCodeAt(offset+2) << 8) +
+            str.charCodeAt(offset+3));
+    },
+
+    /**
+     * Writes a binary string to the service.
+     *
+     * @param msg Binary string
+     */
+    _write: function(msg) {
+        // binary stream so NULs in frame headers survive
+        this.bin_out.writeBytes(msg, msg.length);
         // make sure we send when a complete command is ready
         this.out_str.flush();
-        logit('ServerProxy: sent message');
+    },
+
+    /**
+     * Handles one message from the service.
+     *
+     * @param msg UTF-8 encoded JSON string
+     * @param data Binary string attached to the message, possibly empty
+     */
+    _dispatch: function(msg, data) {
+        // convert utf-8 to unicode
+        msg = this.codec.ConvertToUnicode(msg) + this.codec.Finish();
+        // @todo: could use a hack to avoid decode/encode of json
+        var dec = utils.fromJson(msg);
+        if(dec.framing) {
+            // the service frames everything after this message anew; 
+            // answer in kind so it knows where our framing changes too
+            this.in_framing = dec.framing;
+            if(this.out_framing != dec.framing) {
+                this._write(this._frame(utils.toJson({framing : dec.framing})));
+                this.out_framing = dec.framing;
+            }
+            return;
+        }
+        if(dec.page_id === undefined && dec.length !== undefined) {
+            // responses batched by the service in one main loop tick; not
+            // instanceof Array since nsIJSON may decode in another scope
+            for(var i=0; i < dec.length; i++) {
+                this._notify(dec[i].page_id, utils.toJson(dec[i].cmd));
+            }
+            return;
+        }
+        if(data.length) {
+            // pages only handle text
+            dec.cmd.attachment = btoa(data);
+        }
+        // dispatch remaining json to observer for the given page id
+        this._notify(dec.page_id, utils.toJson(dec.cmd));
     },
 
     /**
@@ -318,10 +460,10 @@ utils.declare('outfox.ServerProxy', null, {
             return;
         }
 
-        // open incoming connection
+        // open incoming connection; binary so NULs in frames survive
         var stream = transport.openInputStream(0,0,0);
-        this.in_str = Components.classes["@mozilla.org/scriptableinputstream;1"].createInstance(Components.interfaces.nsIScriptableInputStream);
-        this.in_str.init(stream);
+        this.in_str = Components.classes["@mozilla.org/binaryinputstream;1"].createInstance(Components.interfaces.nsIBinaryInputStream);
+        this.in_str.setInputStream(stream);
         // set up listener for incoming data
         var pump = Components.classes["@mozilla.org/network/input-stream-pump;1"].createInstance(Components.interfaces.nsIInputStreamPump);
         pump.init(stream, -1, -1, 0, 0, false);
@@ -329,13 +471,15 @@ utils.declare('outfox.ServerProxy', null, {
 
         // open outgoing connection
         this.out_str = transport.openOutputStream(0,0,0);
+        this.bin_out = Components.classes["@mozilla.org/binaryoutputstream;1"].createInstance(Components.interfaces.nsIBinaryOutputStream);
+        this.bin_out.setOutputStream(this.out_str);
 
         logit('ServerProxy: accepted incoming connection');
 
         // send any buffered data
         if(this.out_buff.length) {
             this.out_buff.forEach(function(msg) {
-                this.send(msg[0], msg[1]); 
+                this.send(msg[0], msg[1], msg[2]); 
             }, this);
         }
         // empty the output buffer
@@ -353,7 +497,11 @@ utils.declare('outfox.ServerProxy', null, {
         // close the socket and notify observers of an unexpected failure
         this.socket.close();
         var desc = 'Unexpected service failure.';
-        this._notify('*', this._buildFailure(desc));
+        // every service the process hosted is gone
+        var names = this.hosted.slice();
+        for(var i=0; i < names.length; i++) {
+            this._notify('*', this._buildFailure(desc, names[i]));
+        }
         logit('ServerProxy: stopped listening');  
     },
 
@@ -379,8 +527,12 @@ utils.declare('outfox.ServerProxy', null, {
         this.out_str.close();
         this.in_str = null;
         this.out_str = null;
-        this.in_buff = [];
+        this.bin_out = null;
+        this.in_buff = '';
         this.out_buff = [];
+        this.in_framing = DELIMITED_FRAMING;
+        this.out_framing = DELIMITED_FRAMING;
+        this.offered = false;
         logit('ServerProxy: stopped request');  
     },
 
@@ -395,30 +547,34 @@ utils.declare('outfox.ServerProxy', null, {
     */
     onDataAvailable: function(request, context, in_str, offset, count) {
         if(count <= 0) return;
-        // use scriptable stream, not the one given
-        var data = this.in_str.read(count);
-        // split on delimiter
-        var segs = data.split(DELIMITER);
-        if(segs.length > 1) {
-            // take any leftover data from last receive and prefix it to the
-            // first segment
-            segs[0] = this.in_buff + segs[0];
-            // loop over all commands except the last which can't be complete
-            for(var i=0; i < segs.length-1; i++) {
-                var msg = segs[i];
-                // convert utf-8 to unicode
-                msg = this.codec.ConvertToUnicode(msg) + this.codec.Finish();
-                // @todo: could use a hack to avoid decode/encode of json
-                var dec = utils.fromJson(msg);
-                // dispatch remaining json to observer for the given page id
-                this._notify(dec.page_id, utils.toJson(dec.cmd));
+        // use binary stream, not the one given; take any leftover data from
+        // the last receive as a prefix
+        var buff = this.in_buff + this.in_str.readBytes(count);
+        var start = 0;
+        // framing may change between messages, so take them one at a time
+        while(true) {
+            var msg, data;
+            if(this.in_framing == LENGTH_FRAMING) {
+                if(buff.length - start < FRAME_HEADER_SIZE) break;
+                var size = this._unpackSize(buff, start);
+                var extra = this._unpackSize(buff, start+4);
+                var begin = start + FRAME_HEADER_SIZE;
+                // frame boundary is known without scanning
+                if(buff.length < begin + size + extra) break;
+                msg = buff.substr(begin, size);
+                data = buff.substr(begin + size, extra);
+                start = begin + size + extra;
+            } else {
+                var end = buff.indexOf(DELIMITER, start);
+                if(end < 0) break;
+                msg = buff.substring(start, end);
+                data = '';
+                start = end + 1;
             }
-            // all remaining segment data is prefix for next receive
-            this.in_buff = segs[segs.length-1];
-        } else {
-            // save data for later
-            this.in_buff += data;
+            this._dispatch(msg, data);
         }
+        // all remaining data is prefix for next receive
+        this.in_buff = buff.substr(start);
         logit('ServerProxy: read data');
     }
 });
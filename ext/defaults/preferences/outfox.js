@@ -0,0 +1,4 @@
+// serve several services from one process per window (Linux)
+pref("extensions.outfox.sharedHost", false);
+// serve several services from one daemon process for every window (Linux)
+pref("extensions.outfox.daemon", false);
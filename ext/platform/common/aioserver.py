@@ -0,0 +1,253 @@
+'''
+Asyncio socket server.
+
+Copyright (c) 2008, 2009 Carolina Computer Assistive Technology
+
+Permission to use, copy, modify, and distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+import asyncore
+import errno
+import socket
+import time
+from reactor import Timer
+from server import JSONFraming
+try:
+    import asyncio
+except ImportError:
+    try:
+        # backport for Python 2
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+# socket errors that only mean trying again later
+RETRY_ERRORS = (errno.EWOULDBLOCK, errno.EAGAIN, errno.EINTR)
+
+class AsyncJSONServer(JSONFraming):
+    '''
+    Drop-in replacement for JSONServer that serves its socket with reader
+    and writer callbacks on an asyncio event loop. Receives straight into
+    the framing buffer like JSONServer.
+
+    @ivar port Integer port of the browser extension
+    @ivar loop asyncio event loop serving the connection
+    @ivar sock Non-blocking socket while connected, or None
+    @ivar out_buff bytearray of framed bytes not yet sent
+    @ivar writing Boolean True while a writer callback waits on the socket
+    @ivar observer Object receiving decoded requests
+    '''
+    def __init__(self, port, loop=None):
+        if asyncio is None:
+            raise NotImplementedError('asyncio or trollius is required')
+        self.port = port
+        self.loop = loop or asyncio.get_event_loop()
+        self.sock = None
+        self.out_buff = bytearray()
+        self.writing = False
+        self.observer = None
+        self._initializeFraming()
+
+    def doConnect(self):
+        try:
+            # the extension listens on this machine, so this is quick
+            sock = socket.create_connection(('127.0.0.1', self.port))
+        except socket.error:
+            # nothing to serve; let the service quit
+            self.observer.shutdown()
+            return
+        sock.setblocking(0)
+        self.sock = sock
+        self.loop.add_reader(sock.fileno(), self._onReadable)
+
+    def setObserver(self, ob):
+        self.observer = ob
+
+    def sendMessage(self, msg, data=None):
+        if self.sock is None:
+            return
+        self.out_buff.extend(self._frameMessage(msg, data))
+        if not self.writing:
+            # most messages fit the socket buffer, so try right away
+            self._onWritable()
+
+    def requestFlush(self):
+        '''
+        Asks for the observer's flushResponses to be called once the 
+        callbacks already ready on the loop have run.
+        '''
+        self.loop.call_soon(self.observer.flushResponses)
+
+    def close(self):
+        '''Stops serving the socket and closes it.'''
+        if self.sock is None:
+            return
+        fd = self.sock.fileno()
+        self.loop.remove_reader(fd)
+        if self.writing:
+            self.loop.remove_writer(fd)
+            self.writing = False
+        self.sock.close()
+        self.sock = None
+
+    def _onReadable(self):
+        try:
+            count = self.sock.recv_into(self._getReadBuffer())
+        except socket.error, e:
+            if e.args[0] in RETRY_ERRORS:
+                return
+            count = 0
+        if not count:
+            # peer closed the connection or it failed
+            self._onClosed()
+            return
+        self.in_len += count
+        self._dispatchFrames()
+        # return control to the service main loop like Reactor.iterate
+        self.loop.stop()
+
+    def _onWritable(self):
+        try:
+            sent = self.sock.send(self.out_buff)
+        except socket.error, e:
+            if e.args[0] not in RETRY_ERRORS:
+                self._onClosed()
+                return
+            sent = 0
+        del self.out_buff[:sent]
+        if self.out_buff and not self.writing:
+            # wait for room in the socket buffer
+            self.loop.add_writer(self.sock.fileno(), self._onWritable)
+            self.writing = True
+        elif not self.out_buff and self.writing:
+            self.loop.remove_writer(self.sock.fileno())
+            self.writing = False
+
+    def _onClosed(self):
+        self.close()
+        self.observer.shutdown()
+        # return control to the service main loop so it can quit
+        self.loop.stop()
+
+class LoopReactor(object):
+    '''
+    Reactor interface on an asyncio event loop so services written against
+    Reactor can run with AsyncJSONServer. Timers, readers, and the
+    asyncore sockets of the handoff listener and shard pool become loop
+    callbacks. iterate() runs the loop until the server receives requests,
+    a reader or socket fires, wake() is called, or the server connection
+    closes, so the service step hooks run after each event as they do with
+    Reactor.
+
+    @ivar loop asyncio event loop
+    @ivar map Dictionary asyncore socket map to serve
+    @ivar registered Dictionary mapping asyncore file descriptors to
+        (reading, writing) tuples of Booleans registered with the loop
+    @ivar signaled Boolean True while a wake is scheduled on the loop
+    '''
+    def __init__(self, loop=None, map=None):
+        if asyncio is None:
+            raise NotImplementedError('asyncio or trollius is required')
+        if map is None:
+            map = asyncore.socket_map
+        self.loop = loop or asyncio.get_event_loop()
+        self.map = map
+        self.registered = {}
+        self.signaled = False
+
+    def callLater(self, delay, func, *args, **kwargs):
+        timer = Timer(time.time() + delay, None, func, args, kwargs)
+        self.loop.call_later(delay, self._onTimer, timer)
+        return timer
+
+    def callEvery(self, interval, func, *args, **kwargs):
+        timer = Timer(time.time() + interval, interval, func, args, kwargs)
+        self.loop.call_later(interval, self._onTimer, timer)
+        return timer
+
+    def addReader(self, fd, func):
+        self.loop.add_reader(fd, self._onReadable, func)
+
+    def removeReader(self, fd):
+        self.loop.remove_reader(fd)
+
+    def wake(self):
+        '''Ends the current or next loop run. Safe from any thread.'''
+        if self.signaled:
+            return
+        self.signaled = True
+        self.loop.call_soon_threadsafe(self._onWake)
+
+    def iterate(self):
+        self._watchSockets()
+        self.loop.run_forever()
+        return True
+
+    def close(self):
+        for fd in self.registered.keys():
+            self._unwatch(fd)
+        self.loop.close()
+
+    def _watchSockets(self):
+        # same interest rules as asyncore.poll2, asked before every run so
+        # dispatchers can change their minds
+        for fd in self.registered.keys():
+            if fd not in self.map:
+                self._unwatch(fd)
+        for fd, obj in self.map.items():
+            reading = bool(obj.readable())
+            writing = bool(obj.writable() and not obj.accepting)
+            old = self.registered.get(fd, (False, False))
+            if reading != old[0]:
+                if reading:
+                    self.loop.add_reader(fd, self._onSocket, fd,
+                        asyncore.read)
+                else:
+                    self.loop.remove_reader(fd)
+            if writing != old[1]:
+                if writing:
+                    self.loop.add_writer(fd, self._onSocket, fd,
+                        asyncore.write)
+                else:
+                    self.loop.remove_writer(fd)
+            self.registered[fd] = (reading, writing)
+
+    def _unwatch(self, fd):
+        reading, writing = self.registered.pop(fd)
+        if reading:
+            self.loop.remove_reader(fd)
+        if writing:
+            self.loop.remove_writer(fd)
+
+    def _onSocket(self, fd, handle):
+        obj = self.map.get(fd)
+        if obj is not None:
+            # reports errors through the dispatcher's handle_error
+            handle(obj)
+        self.loop.stop()
+
+    def _onReadable(self, func):
+        func()
+        self.loop.stop()
+
+    def _onWake(self):
+        self.signaled = False
+        self.loop.stop()
+
+    def _onTimer(self, timer):
+        if not timer.active:
+            return
+        rv = timer.func(*timer.args, **timer.kwargs)
+        if timer.interval is None or rv is False:
+            timer.active = False
+        elif timer.active:
+            self.loop.call_later(timer.interval, self._onTimer, timer)
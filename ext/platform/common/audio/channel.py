@@ -16,10 +16,14 @@ WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
 ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 '''
+import threading
 
 class ChannelBase(object):
     '''
     @cvar toProcess List of channels that need queue processing
+    @cvar toProcessLock Lock guarding toProcess against worker threads
+    @cvar reactor Reactor to wake when work is posted, or None if the main
+        loop polls
     @ivar id Integer channel ID assigned by client
     @ivar observer Object observing channel responses
     @ivar queue Array queue of commands to process
@@ -29,6 +33,8 @@ class ChannelBase(object):
     @ivar name String name of the last command to include in all responses
     '''
     toProcess = []
+    toProcessLock = threading.Lock()
+    reactor = None
     def __init__(self, ch_id):
         # unique id for this channel
         self.id = ch_id
@@ -51,13 +57,36 @@ class ChannelBase(object):
         
     @classmethod
     def processNext(cls, ch, mtd, *args, **kwargs):
-        cls.toProcess.append((ch, mtd, args, kwargs))
+        # may be called from worker threads as well as the main loop
+        cls.toProcessLock.acquire()
+        try:
+            cls.toProcess.append((ch, mtd, args, kwargs))
+        finally:
+            cls.toProcessLock.release()
+        if cls.reactor is not None:
+            cls.reactor.wake()
+
+    @classmethod
+    def processLater(cls, delay, ch, mtd, *args, **kwargs):
+        # main loop only; falls back to the next pass without a reactor
+        if cls.reactor is None:
+            cls.processNext(ch, mtd, *args, **kwargs)
+        else:
+            cls.reactor.callLater(delay, cls.processNext, ch, mtd, *args, 
+                **kwargs)
         
     @classmethod
     def processPending(cls):
+        # swap out the pending list so anything queued while processing waits
+        # for the next pass
+        cls.toProcessLock.acquire()
+        try:
+            pending = cls.toProcess
+            cls.toProcess = []
+        finally:
+            cls.toProcessLock.release()
         [getattr(ch, mtd)(*args, **kwargs) 
-            for ch, mtd, args, kwargs in cls.toProcess]
-        cls.toProcess = []
+            for ch, mtd, args, kwargs in pending]
 
     def _processQueue(self):
         while (not self.busy) and len(self.queue):
@@ -71,7 +100,7 @@ class ChannelBase(object):
                     # store the current request ID
                     self.stalled_id = reqid
                     # and stall the queue for now
-                    return
+                    break
                 else:
                     # set the deferred result action to that of the original
                     result['action'] = cmd['action']
@@ -82,7 +111,9 @@ class ChannelBase(object):
             # remember to pop the command
             cmd = self.queue.pop(0)
             # handle the next command
-            self._handleCommand(cmd)   
+            self._handleCommand(cmd)
+        # work ahead on whatever is still waiting
+        self._prefetchQueue()   
 
     def _notify(self, action, **kwargs):
         msg = {}
@@ -93,6 +124,17 @@ class ChannelBase(object):
         if self.observer is not None:
             self.observer.pushResponse(action, **msg)
 
+    def _notifyTemplate(self, template, *values):
+        '''
+        Sends a fixed-shape response. The template's first two fields must
+        be the channel ID and the optional name.
+
+        @param template codec.ResponseTemplate instance
+        @param values Remaining field values in template order
+        '''
+        if self.observer is not None:
+            self.observer.pushTemplate(template, self.id, self.name, *values)
+
     def _handleCommand(self, cmd):
         action = cmd.get('action')
         if action == 'say':
@@ -128,6 +170,12 @@ class ChannelBase(object):
         elif action == 'stop-service':
             # shutdown this channel
             self.shutdown(cmd)
+        elif action == 'preload':
+            # work ahead in the background without holding up the queue
+            self.preload(cmd)
+        elif action == 'get-stats':
+            # report cache statistics without waiting on the queue
+            self.getStats(cmd)
         else:
             # queue command; slight waste of time if we immediately pull it back
             # out again, but it's clean
@@ -142,6 +190,10 @@ class ChannelBase(object):
         self.config['rate'] = 200
         self.config['loop'] = False
         
+    def _prefetchQueue(self):
+        '''Override to prepare queued commands before they are handled.'''
+        pass
+
     def say(self, cmd):
         '''Override to process a say command.'''
         pass
@@ -150,6 +202,10 @@ class ChannelBase(object):
         '''Override to process a play command.'''
         pass
         
+    def preload(self, cmd):
+        '''Override to prepare sounds and speech before they are used.'''
+        pass
+        
     def setProperty(self, cmd):
         '''Override to process a property change command.'''        
         pass
@@ -157,6 +213,10 @@ class ChannelBase(object):
     def getConfig(self, cmd):
         '''Override to process the initial configuration request command.'''
         pass
+
+    def getStats(self, cmd):
+        '''Override to process a cache statistics request command.'''
+        pass
         
     def reset(self, cmd):
         '''Override to process a reset command for this channel.'''
@@ -0,0 +1,69 @@
+'''
+Splits long speech into sentence sized chunks.
+
+Copyright (c) 2008, 2009 Carolina Computer Assistive Technology
+
+Permission to use, copy, modify, and distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+import re
+
+# end of a sentence, including closing quotes or brackets and the space after
+SENTENCE_END = re.compile(ur'''[.!?;:]+["')\]]*\s+|\n\s*''', re.UNICODE)
+# end of a clause within a long sentence
+CLAUSE_END = re.compile(ur',\s+', re.UNICODE)
+# space between words within a long clause
+WORD_END = re.compile(ur'\s+', re.UNICODE)
+
+def _splitAt(pattern, text, offset, limit):
+    # pieces of text no longer than limit where pattern allows, broken 
+    # further by the next pattern where it doesn't
+    pieces = []
+    start = 0
+    for match in pattern.finditer(text):
+        pieces.append((offset + start, text[start:match.end()]))
+        start = match.end()
+    if start < len(text):
+        pieces.append((offset + start, text[start:]))
+    if pattern is WORD_END:
+        return pieces
+    finer = CLAUSE_END if pattern is SENTENCE_END else WORD_END
+    result = []
+    for pos, piece in pieces:
+        if len(piece) > limit:
+            result.extend(_splitAt(finer, piece, pos, limit))
+        else:
+            result.append((pos, piece))
+    return result
+
+def splitText(text, limit):
+    '''
+    Splits text at sentence ends into chunks of at most limit characters
+    where it can. Sentences longer than the limit are split at clause ends,
+    then spaces. The first chunk is the first sentence alone so speech
+    starts quickly; later chunks gather sentences up to the limit.
+
+    @param text Unicode text
+    @param limit Integer preferred maximum chunk length
+    @return List of (offset in text, chunk text) tuples covering the text
+    '''
+    chunks = []
+    for pos, piece in _splitAt(SENTENCE_END, text, 0, limit):
+        if chunks and (len(chunks) == 1 and chunks[0][1].strip() or
+        len(chunks[-1][1]) + len(piece) > limit) and piece.strip():
+            chunks.append((pos, piece))
+        elif chunks:
+            # gather into the previous chunk
+            chunks[-1] = (chunks[-1][0], chunks[-1][1] + piece)
+        else:
+            chunks.append((pos, piece))
+    return chunks
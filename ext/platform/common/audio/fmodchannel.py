@@ -18,6 +18,9 @@ OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 from ctypes import *
 from utterance import Utterance
 from channel import ChannelBase
+from synthworker import SynthesisJob
+from chunker import splitText
+from soundcache import SoundCache
 
 FMOD_OK = 0
 FMOD_ERR_NOTREADY = 55
@@ -35,6 +38,15 @@ FMOD_CHANNEL_CALLBACKTYPE_END = 0
 FMOD_CHANNEL_CALLBACKTYPE_SYNCPOINT = 2
 FMOD_UNICODE = 0x01000000
 FMOD_TIMEUNIT_PCM  = 0x00000002
+FMOD_DELAYTYPE_DSPCLOCK_START = 1
+# length reported for sounds of unknown length, like internet streams
+FMOD_LENGTH_UNKNOWN = 0xffffffff
+# seconds between checks on a sound opening in the background
+FMOD_OPEN_POLL = 0.02
+# seconds between playback positions sent for speech in timeline mode
+TIMELINE_SYNC_INTERVAL = 0.5
+# seconds to wait before preloading while the channel has other work
+PRELOAD_IDLE_POLL = 0.1
 
 class FMOD_CREATESOUNDEXINFO(Structure):
     _fields_ = [
@@ -69,15 +81,47 @@ class FMOD_CREATESOUNDEXINFO(Structure):
 
 class FMODChannelBase(ChannelBase):
     '''
+    @cvar engine String name of the speech engine for utterance cache keys
+    @cvar lookahead Integer number of queued say commands to synthesize
+        while the current command plays
+    @cvar chunk_chars Integer length of text above which a say is split
+        into sentences synthesized and played one after another
     @ivar fmod FMOD module
     @ivar fsys FMOD system object
     @ivar fch FMOD channel object
     @ivar fchcb FMOD channel callback
     @ivar utterance Object containing speech utterance information
+    @ivar worker SynthesisWorker for background synthesis, or None to
+        synthesize in the main loop
+    @ivar job SynthesisJob waiting on the worker, or None
+    @ivar stream SpeechStream being played as it is synthesized, or None
+    @ivar utterances UtteranceCache shared by all channels, or None
+    @ivar sounds SoundCache of decoded sounds, usually shared by all 
+        channels
+    @ivar sound_key String cache key of the cached sound being played, or
+        None
+    @ivar preloads Array of ('sound', key) and ('text', text) tuples waiting
+        to be preloaded
+    @ivar preloading Boolean True while preloading is under way
+    @ivar preload_job SynthesisJob preloading an utterance, or None
+    @ivar prefetched Dictionary mapping utterance keys to SynthesisJobs
+        started ahead of their say commands
+    @ivar end_clock Long mixer clock when the playing channel ends in 
+        gapless mode, or None if unknown
+    @ivar scheduled Dictionary describing the next command already started
+        on the mixer clock in gapless mode, or None
+    @ivar chunk Tuple of (text offset, first, last) for the part of a long
+        say being output, or None when saying it whole
+    @ivar timeline Boolean True if the client times the words of the 
+        speech being output itself
     @ivar done_action String indicating if current playback is speech or sound
     @ivar config Dictionary of name/value configuration pairs
     '''
-    def __init__(self, ch_id, fmod, fsys):
+    engine = None
+    lookahead = 2
+    chunk_chars = 300
+    def __init__(self, ch_id, fmod, fsys, worker=None, utterances=None,
+    sounds=None):
         # initialize base class
         ChannelBase.__init__(self, ch_id)
         # store fmod library
@@ -94,31 +138,114 @@ class FMODChannelBase(ChannelBase):
         #self.nbcb = cb_factory(self._onFMODNonBlockingCallback)
         # information about the current speech utterance
         self.utterance = None
+        # background synthesis worker shared by all channels, if any
+        self.worker = worker
+        # synthesis job in progress for this channel
+        self.job = None
+        # speech playing while it is synthesized
+        self.stream = None
+        # synthesized speech shared by all channels, if any
+        self.utterances = utterances
+        # speech synthesized ahead of queued say commands
+        self.prefetched = {}
+        # gapless playback state
+        self.end_clock = None
+        self.scheduled = None
+        # part of a long say being output
+        self.chunk = None
+        # whether the client is timing words itself
+        self.timeline = False
         # whether we're playing speech or sound
         self.done_action = None
         # in memory cache of small sounds that ff did not cache on disk
-        self.sound_cache = {}
+        if sounds is None:
+            sounds = SoundCache(fmod)
+        self.sounds = sounds
+        self.sound_key = None
+        # sounds and speech to prepare while idle
+        self.preloads = []
+        self.preloading = False
+        self.preload_job = None
         # whether we're playing a cached sound or not
         self.done_cached = False
 
-    def _synthesizeUtterance(self, text):
+    def _initializeConfig(self):
+        ChannelBase._initializeConfig(self)
+        # start queued output on the mixer clock as the previous output ends
+        self.config['gapless'] = False
+        # send the word table with the start of speech instead of a message
+        # per word
+        self.config['timeline'] = False
+
+    def _synthesizeUtterance(self, text, token=None):
         '''
-        Override to synthesize speech for the given text.
+        Override to synthesize speech for the given text. Engines that can
+        stop part way should do so once the token is cancelled.
 
         @param text String of text to speak
+        @param token SynthesisJob whose cancelled flag says the result is no
+            longer wanted, or None
         @return Utterance instance
         '''
         return Utterance(text)
 
-    def _outputUtterance(self, utterance):
+    def _createStream(self, text):
+        '''
+        Override to play speech while it is synthesized. Only used when
+        synthesizing on a worker.
+
+        @param text String of text to speak
+        @return SpeechStream instance, or None to output whole utterances
+        '''
+        return None
+
+    def _streamUtterance(self, text, stream, token=None):
+        '''
+        Override to synthesize speech for the given text incrementally, 
+        writing samples and words to the stream as they are produced. The 
+        default writes the whole utterance at once.
+
+        @param text String of text to speak
+        @param stream SpeechStream instance
+        @param token SynthesisJob whose cancelled flag says the result is no
+            longer wanted, or None
+        @return Utterance instance
+        '''
+        utter = self._synthesizeUtterance(text, token)
+        stream.write(str(utter.samples))
+        for word in utter.words:
+            stream.addWord(word)
+        return utter
+
+    def _outputUtterance(self, utterance, timeline=False):
         '''
         Override to control how the synthesized speech utterance is output.
 
         @param utterance Utterance instance
+        @param timeline Boolean True if the client times the words itself,
+            so no word events are needed
         @return True on success or False on failure
         '''
         return False
 
+    def _outputStream(self, stream):
+        '''
+        Override to start output of a speech stream.
+
+        @param stream SpeechStream instance
+        @return True on success or False on failure
+        '''
+        return False
+
+    def _addStreamWord(self, stream, word):
+        '''
+        Override to mark a word in a speech stream that is already playing.
+
+        @param stream SpeechStream instance
+        @param word Tuple of (position, length, sample offset)
+        '''
+        pass
+
     def _getVoices(self):
         '''
         Override to provide a list of all available voices.
@@ -143,6 +270,9 @@ class FMODChannelBase(ChannelBase):
         '''
         if self.fch is not None:
             self.fmod.FMOD_Channel_SetVolume(self.fch, c_float(val))
+        if self.scheduled is not None:
+            self.fmod.FMOD_Channel_SetVolume(self.scheduled['fch'], 
+                c_float(val))
 
     def _setVoice(self, val):
         '''
@@ -161,6 +291,10 @@ class FMODChannelBase(ChannelBase):
         if self.done_action != 'finished-say' and self.fch is not None:
             count = -1 if val else 0
             self.fmod.FMOD_Channel_SetLoopCount(self.fch, count)
+            if val:
+                # nothing can follow a looping sound
+                self.end_clock = None
+                self._cancelScheduled(True)
 
     def _onFMODSyncPoint(self, index):
         '''
@@ -168,24 +302,46 @@ class FMODChannelBase(ChannelBase):
 
         @param index Integer sample offset of the sync point
         '''
-        if index == 0:
+        if index == 0 and self._isFirstChunk():
             # notify on output start
             self._notify('started-output')
             
+    def _scheduleUtterance(self, utter, start, timeline=False):
+        '''
+        Override to start an utterance on the mixer clock for gapless mode.
+
+        @param utter Utterance instance
+        @param start Long mixer clock at which output should start
+        @param timeline Boolean True if the client times the words itself
+        @return Tuple of (FMOD channel, end clock) or None if not supported
+        '''
+        return None
+
     def _resetFlags(self):
         self.snd = None
+        self.end_clock = None
         self.utterance = None
+        self.job = None
+        self.stream = None
         self.busy = False
         self.name = None
+        self.chunk = None
+        self.timeline = False
         self.done_action = None
         self.done_cached = False        
+        self.sound_key = None
 
     def _onFMODComplete(self):
-        # notify about end of stream
-        self._notify(self.done_action)
+        # notify about end of stream, or of the whole say once its last part
+        # ends
+        if self.chunk is None or self.chunk[2]:
+            self._notify(self.done_action)
         
         # clean up any previous sound here before handling the next command
-        if self.fch and not self.done_cached:
+        if self.sound_key is not None:
+            # shared with other channels; just let it go
+            self.sounds.release(self.sound_key)
+        elif self.fch and not self.done_cached:
             snd = c_void_p()
             self.fmod.FMOD_Channel_GetCurrentSound(self.fch, byref(snd))
             self.fmod.FMOD_Sound_Release(snd)
@@ -193,10 +349,23 @@ class FMODChannelBase(ChannelBase):
 
         # reset stateful data
         self._resetFlags()
+        if self.scheduled is not None:
+            # next command is already playing
+            self._promoteScheduled()
+            return
         # mark this channel ready for processing
         ChannelBase.processNext(self, '_processQueue')
 
     def _onFMODChannelCallback(self, channel, kind, cmd1, cmd2):
+        if self.scheduled is not None and channel == self.scheduled['fch'].value:
+            if kind == FMOD_CHANNEL_CALLBACKTYPE_SYNCPOINT:
+                # the next command started a hair before this one reported
+                # its end; replay once it's promoted
+                self.scheduled['syncs'].append(cmd1)
+            return FMOD_OK
+        if self.fch is None or channel != self.fch.value:
+            # ignore channels stopped after being scheduled
+            return FMOD_OK
         if kind == FMOD_CHANNEL_CALLBACKTYPE_END:
             self._onFMODComplete()
         elif kind == FMOD_CHANNEL_CALLBACKTYPE_SYNCPOINT:
@@ -225,10 +394,12 @@ class FMODChannelBase(ChannelBase):
         elif state.value != FMOD_OPENSTATE_READY:
             # not ready for sound to start yet; try again later with the same
             # parameters
-            ChannelBase.processNext(self, '_onFMODNonBlockingCallback', snd)
+            ChannelBase.processLater(FMOD_OPEN_POLL, self, 
+                '_onFMODNonBlockingCallback', snd)
             return
 
-        self._execFMODAudio(snd)
+        if self._execFMODAudio(snd):
+            self._scheduleNext()
         
     def _buildFMODAudio(self, cmd, local):
         # default to not caching sound in memory
@@ -277,83 +448,247 @@ class FMODChannelBase(ChannelBase):
         
         if self.done_cached:
             # cache sound in memory if it's small
-            self.sound_cache[uri] = snd
+            self.done_cached = self._cacheSound(self._getSoundKey(cmd), snd)
 
         return snd
-        
-    def _execFMODAudio(self, snd):
-        # set a marker on the first sample so we know when output starts
+
+    def _cacheSound(self, key, snd):
+        '''
+        Gives a fully decoded sound to the cache.
+
+        @param key String cache key
+        @param snd FMOD sound object
+        @return True if cached, False if the caller must release the sound
+        '''
+        # mark the start once for every channel that will play it
         pt = c_void_p()
-        rv = self.fmod.FMOD_Sound_AddSyncPoint(snd, 0, FMOD_TIMEUNIT_PCM, '', 
+        self.fmod.FMOD_Sound_AddSyncPoint(snd, 0, FMOD_TIMEUNIT_PCM, '', 
             byref(pt))
+        return self.sounds.put(key, snd)
+        
+    def _execFMODAudio(self, snd):
+        rv = 0
+        if self.sound_key is None:
+            # set a marker on the first sample so we know when output starts;
+            # cached sounds got theirs when loaded
+            pt = c_void_p()
+            rv = self.fmod.FMOD_Sound_AddSyncPoint(snd, 0, FMOD_TIMEUNIT_PCM, 
+                '', byref(pt))
         if rv:
             self._notify('error', description='Cannot set sound start marker.')
+        else:
+            # play the sound object
+            ch, self.end_clock = self._openFMODChannel(snd, 'sound', 
+                self.config['loop'])
+            if ch is not None:
+                # store a reference to the playing channel
+                self.fch = ch
+                return True
+        if self.sound_key is not None:
+            self.sounds.release(self.sound_key)
+        else:
             self.fmod.FMOD_Sound_Release(snd)
-            self._resetFlags()
-            ChannelBase.processNext(self, '_processQueue')
-            return rv
-        
+        self._resetFlags()
+        ChannelBase.processNext(self, '_processQueue')
+        return False
+
+    def _openFMODChannel(self, snd, kind, loop, start=None):
+        '''
+        Plays a sound on a new FMOD channel. In gapless mode, the start is
+        pinned to the mixer clock so the end of the sound is known exactly.
+        Notifies the client of any error.
+
+        @param snd FMOD sound object
+        @param kind String 'sound' or 'speech' for error descriptions
+        @param loop Boolean looping flag
+        @param start Long mixer clock at which to start, or None for as soon
+            as possible
+        @return Tuple of (FMOD channel, end clock). The channel is None on
+            failure. The end clock is None if not gapless or unknown.
+        '''
         # play the sound object, starting paused
         ch = c_void_p()
-        rv = self.fmod.FMOD_System_PlaySound(self.fsys, FMOD_CHANNEL_FREE, snd,
-            True, byref(ch))
-        if rv:
-            self._notify('error', description='Bad sound format.')
-            self.fmod.FMOD_Sound_Release(snd)
-            self._resetFlags()
-            ChannelBase.processNext(self, '_processQueue')
-            return rv
+        if self.fmod.FMOD_System_PlaySound(self.fsys, FMOD_CHANNEL_FREE, snd,
+            True, byref(ch)):
+            self._notify('error', description='Bad %s format.' % kind)
+            return None, None
 
-        # set channel volume and callback
-        rv = self.fmod.FMOD_Channel_SetCallback(ch, self.fchcb)
-        if rv:
-            self._notify('error', description='Cannot set sound callback.')
-            self.fmod.FMOD_Sound_Release(snd)
-            self._resetFlags()
-            ChannelBase.processNext(self, '_processQueue')
-            return rv
-        rv = self.fmod.FMOD_Channel_SetVolume(ch, c_float(self.config['volume']))
-        if rv:
-            self._notify('error', description='Cannot set sound volume.')
-            self.fmod.FMOD_Sound_Release(snd)
-            self._resetFlags()
-            ChannelBase.processNext(self, '_processQueue')
-            return rv
-        count = -1 if self.config['loop'] else 0
-        rv = self.fmod.FMOD_Channel_SetLoopCount(ch, count)
-        if rv:
-            self._notify('error', description='Cannot set looping.')
-            self.fmod.FMOD_Sound_Release(snd)
-            self._resetFlags()
-            ChannelBase.processNext(self, '_processQueue')
-            return rv
+        # set channel volume, callback, loop
+        if self.fmod.FMOD_Channel_SetCallback(ch, self.fchcb):
+            self._notify('error', description='Cannot set %s callback.' % kind)
+            return None, None
+        if self.fmod.FMOD_Channel_SetVolume(ch, c_float(self.config['volume'])):
+            self._notify('error', description='Cannot set %s volume.' % kind)
+            return None, None
+        count = -1 if loop else 0
+        if self.fmod.FMOD_Channel_SetLoopCount(ch, count):
+            self._notify('error', description='Cannot set %s looping.' % kind)
+            return None, None
+
+        end = None
+        if self._isGapless():
+            if start is None:
+                start = self._getLeadClock()
+            self.fmod.FMOD_Channel_SetDelay(ch, FMOD_DELAYTYPE_DSPCLOCK_START,
+                c_uint(start >> 32), c_uint(start & 0xffffffff))
+            length = self._getMixerLength(snd)
+            if length is not None and not loop:
+                end = start + length
 
         # start the sound playing
-        rv = self.fmod.FMOD_Channel_SetPaused(ch, False)
-        if rv:
-            self._notify('error', description='Cannot start sound.')
-            self.fmod.FMOD_Sound_Release(snd)
-            self._resetFlags()
-            ChannelBase.processNext(self, '_processQueue')
-            return rv
+        if self.fmod.FMOD_Channel_SetPaused(ch, False):
+            self._notify('error', description='Cannot start %s.' % kind)
+            return None, None
+        return ch, end
+
+    def _getLeadClock(self):
+        '''
+        @return Long mixer clock one mix block from now, the earliest start
+            the mixer can honor exactly
+        '''
+        hi = c_uint()
+        lo = c_uint()
+        self.fmod.FMOD_System_GetDSPClock(self.fsys, byref(hi), byref(lo))
+        block = c_uint()
+        count = c_int()
+        self.fmod.FMOD_System_GetDSPBufferSize(self.fsys, byref(block), 
+            byref(count))
+        return ((hi.value << 32) | lo.value) + block.value
+
+    def _getMixerLength(self, snd):
+        '''
+        @param snd FMOD sound object
+        @return Integer length of the sound in mixer samples or None if
+            unknown
+        '''
+        length = c_uint()
+        if self.fmod.FMOD_Sound_GetLength(snd, byref(length), 
+            FMOD_TIMEUNIT_PCM):
+            return None
+        if length.value == FMOD_LENGTH_UNKNOWN:
+            return None
+        freq = c_float()
+        if self.fmod.FMOD_Sound_GetDefaults(snd, byref(freq), None, None, 
+            None):
+            return None
+        rate = c_int()
+        if self.fmod.FMOD_System_GetSoftwareFormat(self.fsys, byref(rate), 
+            None, None, None, None, None):
+            return None
+        return int(round(length.value * rate.value / freq.value))
+
+    def _scheduleNext(self):
+        '''
+        In gapless mode, starts the command at the head of the queue on the
+        mixer clock exactly where the playing one ends, if it can start 
+        without waiting on synthesis, loading, or the browser cache. The 
+        parts of a long say always follow each other this way.
+        '''
+        if (self.end_clock is None or self.scheduled is not None or 
+            not len(self.queue)):
+            return
+        cmd = self.queue[0]
+        if cmd.get('deferred') is not None or cmd.get('invalid'):
+            return
+        if not self._isGapless():
+            return
+        action = cmd.get('action')
+        utter = None
+        sound_key = None
+        if action == 'say' and len(cmd['text']):
+            utter = self._getReadyUtterance(
+                self._getUtteranceKey(cmd['text']))
+            if utter is None:
+                return
+            timeline = self._getTimeline(cmd, utter)
+            rv = self._scheduleUtterance(utter, self.end_clock, 
+                timeline is not None)
+            if rv is None:
+                return
+            ch, end = rv
+            done_action = 'finished-say'
+        elif action == 'play' and not self.config['loop']:
+            sound_key = self._getSoundKey(cmd)
+            if sound_key not in self.sounds:
+                return
+            snd = self.sounds.get(sound_key)
+            ch, end = self._openFMODChannel(snd, 'sound', False, 
+                self.end_clock)
+            timeline = None
+            done_action = 'finished-play'
+        else:
+            return
+        if ch is None:
+            # leave the command queued; it will start the usual way
+            return
+        if sound_key is not None:
+            self.sounds.acquire(sound_key)
+        self.queue.pop(0)
+        self.scheduled = dict(cmd=cmd, fch=ch, end_clock=end, utterance=utter,
+            timeline=timeline, sound_key=sound_key, done_action=done_action, 
+            syncs=[])
+
+    def _promoteScheduled(self):
+        '''Makes the scheduled command the playing one.'''
+        sched = self.scheduled
+        self.scheduled = None
+        self.fch = sched['fch']
+        self.end_clock = sched['end_clock']
+        self.utterance = sched['utterance']
+        self.name = sched['cmd'].get('name')
+        self.chunk = sched['cmd'].get('chunk')
+        self.busy = True
+        self.done_action = sched['done_action']
+        self.sound_key = sched['sound_key']
+        self.done_cached = self.sound_key is not None
+        if self.done_cached:
+            self._notify('started-play')
+        else:
+            self._notifySayStarted(sched['timeline'])
+        # deliver sync points that arrived before promotion
+        [self._onFMODSyncPoint(index) for index in sched['syncs']]
+        # line up whatever comes next
+        self._prefetchQueue()
+
+    def _cancelScheduled(self, requeue):
+        '''
+        Stops a command started on the mixer clock.
 
-        # store a reference to the playing channel
-        self.fch = ch
+        @param requeue Boolean True to put the command back on the queue
+        '''
+        sched = self.scheduled
+        if sched is None:
+            return
+        self.scheduled = None
+        if requeue:
+            self.queue.insert(0, sched['cmd'])
+        snd = c_void_p()
+        self.fmod.FMOD_Channel_GetCurrentSound(sched['fch'], byref(snd))
+        self.fmod.FMOD_Channel_Stop(sched['fch'])
+        if sched['sound_key'] is not None:
+            self.sounds.release(sched['sound_key'])
+        elif sched['done_action'] == 'finished-say':
+            self.fmod.FMOD_Sound_Release(snd)
 
     def reset(self, cmd):
         ChannelBase.reset(self, cmd)
+        # voice and rate may have changed under anything synthesized ahead
+        self._cancelSynthesis(False)
+        self._cancelScheduled(True)
         # reset any playing channel properties
         if self.fch:
             self._setVolume(self.config['volume'])
             self._setLooping(self.config['loop'])
-            # free up sounds in the memory cache
-            [self.fmod.FMOD_Sound_Release(snd) 
-                for snd in self.sound_cache.values()]
-            self.sound_cache = {}
 
     def stop(self, cmd):
         # allow base class to clear
         ChannelBase.stop(self, cmd)
+        # the rest of a long say was dropped with the queue, so report its 
+        # end now
+        self.chunk = None
+        # nobody will hear speech still being synthesized
+        self._cancelSynthesis(True)
+        self._cancelScheduled(False)
         if self.fch:
             # clean up the playing FMOD channel and sound
             snd = c_void_p()
@@ -370,12 +705,266 @@ class FMODChannelBase(ChannelBase):
         # make sure the speech string isn't empty; adhere to protocol of noop
         if not len(cmd['text']):
             return
+        if len(cmd['text']) > self.chunk_chars and 'chunk' not in cmd:
+            # say long text a sentence at a time, prefetching only a few 
+            # sentences ahead
+            chunks = self._splitSay(cmd)
+            self.queue[0:0] = chunks[1:]
+            cmd = chunks[0]
+        # parts of a long say start on the mixer clock, even when streamed
+        self.chunk = cmd.get('chunk')
 
-        # synthesize utterance
-        utter = self._synthesizeUtterance(cmd['text'])
-        # output utterance
-        if not self._outputUtterance(utter):
+        key = self._getUtteranceKey(cmd['text'])
+        utter = self._getReadyUtterance(key)
+        if utter is not None:
+            # synthesized ahead or spoken before; skip synthesis entirely
+            if self._startUtterance(cmd, utter):
+                self._scheduleNext()
+            return
+
+        job = self.prefetched.pop(key, None)
+        if self.worker is None:
+            # synthesize utterance in the main loop
+            utter = self._synthesizeUtterance(cmd['text'])
+            self._cacheUtterance(key, utter)
+            if self._startUtterance(cmd, utter.copy()):
+                self._scheduleNext()
+        elif job is not None and not job.finished:
+            # already synthesizing ahead; hold the queue until it's done
+            self.job = job
+            self.busy = True
+        else:
+            # synthesize in the background; hold the queue until it's done.
+            # the client needs every word up front in timeline mode
+            if not self.config['timeline']:
+                self.stream = self._createStream(cmd['text'])
+            self.job = SynthesisJob(self, cmd, self.stream, key)
+            self.busy = True
+            self.worker.submit(self.job)
+
+    def _splitSay(self, cmd):
+        '''
+        Splits a long say command into commands for its sentences.
+
+        @param cmd Dictionary say command
+        @return Array of say commands, each with a chunk tuple of (offset of
+            its text in the original, first, last)
+        '''
+        chunks = splitText(cmd['text'], self.chunk_chars)
+        last = len(chunks) - 1
+        cmds = []
+        for i, (offset, text) in enumerate(chunks):
+            chunk = dict(cmd, text=text, chunk=(offset, i == 0, i == last))
+            chunk.pop('deferred', None)
+            cmds.append(chunk)
+        return cmds
+
+    def _isFirstChunk(self):
+        '''@return Boolean True unless output is a later part of a long say'''
+        return self.chunk is None or self.chunk[1]
+
+    def _isGapless(self):
+        '''
+        @return Boolean True if output starts on the mixer clock, in gapless
+            mode or while parts of a long say are still to come
+        '''
+        return self.config['gapless'] or (self.chunk is not None and 
+            not self.chunk[2])
+
+    def _getTimeline(self, cmd, utter):
+        '''
+        @param cmd Dictionary say command
+        @param utter Utterance instance about to be output
+        @return Dictionary of the word table and sampling rate to send with
+            the start of the utterance in timeline mode, or None
+        '''
+        if not self.config['timeline']:
+            return None
+        chunk = cmd.get('chunk')
+        offset = chunk[0] if chunk is not None else 0
+        # locations are relative to the whole say, sample offsets to the 
+        # start of this utterance
+        words = [(position + offset, length, sample) 
+            for position, length, sample in utter.words]
+        return dict(words=words, rate=utter.rate)
+
+    def _notifySayStarted(self, timeline):
+        '''
+        Notifies the start of a say, or in timeline mode of each part of a
+        long one.
+
+        @param timeline Dictionary from _getTimeline, or None
+        '''
+        self.timeline = timeline is not None
+        if timeline is None:
+            if self._isFirstChunk():
+                self._notify('started-say')
+        elif self._isFirstChunk():
+            self._notify('started-say', **timeline)
+        else:
+            self._notify('continued-say', **timeline)
+
+    def _onTimelineSync(self, utter):
+        '''
+        Sends the playback position of speech in timeline mode so the client
+        can keep its word timing in step, for as long as the speech plays.
+
+        @param utter Utterance that was playing when the sync was scheduled
+        '''
+        if utter is not self.utterance or self.fch is None:
+            return
+        position = c_uint()
+        if not self.fmod.FMOD_Channel_GetPosition(self.fch, byref(position), 
+            FMOD_TIMEUNIT_PCM):
+            self._notify('synced-output', position=position.value)
+        ChannelBase.processLater(TIMELINE_SYNC_INTERVAL, self, 
+            '_onTimelineSync', utter)
+
+    def _getSynthesisProfile(self):
+        '''@return Tuple of the voice and rate to synthesize with'''
+        return (self.config.get('voice'), self.config['rate'])
+
+    def _getUtteranceKey(self, text):
+        return (text,) + self._getSynthesisProfile() + (self.engine,)
+
+    def _getReadyUtterance(self, key):
+        '''
+        @param key Tuple identifying the utterance
+        @return Utterance that can be output without synthesis, or None
+        '''
+        job = self.prefetched.get(key)
+        if job is not None and job.finished and job.error is None:
+            del self.prefetched[key]
+            return job.utterance.copy()
+        if self.utterances is not None:
+            utter = self.utterances.get(key)
+            if utter is not None:
+                return utter.copy()
+        return None
+
+    def _cacheUtterance(self, key, utter):
+        if self.utterances is not None and utter is not None:
+            self.utterances.put(key, utter)
+
+    def _prefetchQueue(self):
+        if self.worker is None:
+            # nothing to synthesize ahead with, but cached output can still
+            # follow on the mixer clock
+            self._scheduleNext()
+            return
+        count = 0
+        for cmd in self.queue:
+            if count >= self.lookahead:
+                break
+            action = cmd.get('action')
+            if action in ('set-queued', 'reset-queued'):
+                # speech after this point may use another voice or rate
+                break
+            if action != 'say' or not len(cmd['text']):
+                continue
+            count += 1
+            key = self._getUtteranceKey(cmd['text'])
+            if key in self.prefetched or (self.utterances is not None and 
+                key in self.utterances):
+                continue
+            job = SynthesisJob(self, cmd, None, key)
+            self.prefetched[key] = job
+            self.worker.submit(job)
+        self._scheduleNext()
+
+    def _cancelSynthesis(self, current):
+        '''
+        Stops synthesis ahead of the queue and, optionally, of the utterance
+        being said.
+
+        @param current Boolean True to cancel the job for the current say
+        '''
+        for job in self.prefetched.values():
+            job.cancel()
+        self.prefetched = {}
+        if current and self.job is not None:
+            self.job.cancel()
+
+    def _dropStalePrefetches(self):
+        '''
+        Stops synthesis ahead of the queue with a voice or rate the channel
+        no longer uses. Its keys would never match a say again.
+        '''
+        profile = self._getUtteranceKey('')[1:]
+        for key, job in self.prefetched.items():
+            if key[1:] == profile:
+                continue
+            del self.prefetched[key]
+            # a preload still fills the cache for later
+            if job is not self.preload_job:
+                job.cancel()
+
+    def _onSynthesized(self, job):
+        job.finished = True
+        # cancelled jobs may have stopped part way
+        if job.error is None and not job.cancelled:
+            self._cacheUtterance(job.key, job.utterance)
+        if job is self.preload_job:
+            # the cache has it now; don't hold it twice
+            self.preload_job = None
+            if self.prefetched.get(job.key) is job:
+                del self.prefetched[job.key]
+            self._schedulePreload(0)
+        if job is not self.job:
+            # synthesized ahead of its command, or the channel was stopped
+            # while synthesizing
+            self._scheduleNext()
+            return
+        self.job = None
+        if self.stream is not None and self.fch is not None:
+            # already streaming; playback stops itself once drained
+            return
+        self.stream = None
+        if job.error is not None:
+            self._notify('error', description=job.error)
+        elif self._startUtterance(job.cmd, job.utterance.copy()):
+            self._scheduleNext()
             return
+        # nothing is playing so move on to the next command
+        self.busy = False
+        ChannelBase.processNext(self, '_processQueue')
+
+    def _onStreamReady(self, stream):
+        if stream is not self.stream:
+            return
+        if not self._outputStream(stream):
+            # ignore the rest of the stream; job completion moves on
+            self.stream = None
+            return
+        # words are filled in as they stream in
+        self.utterance = Utterance(stream.text, None, stream.rate, 
+            stream.depth, stream.channels)
+        # set flags
+        self.name = self.job.cmd.get('name')
+        self.done_action = 'finished-say'
+        # notify on start
+        if self._isFirstChunk():
+            self._notify('started-say')
+
+    def _onStreamWord(self, stream, word):
+        if stream is not self.stream or self.fch is None:
+            return
+        self._addStreamWord(stream, word)
+        self.utterance.addWord(word)
+
+    def _onStreamDrained(self, stream):
+        if stream is not self.stream or self.fch is None:
+            return
+        # end of the stream is not known to FMOD, so stop it explicitly
+        self.fmod.FMOD_Channel_Stop(self.fch)
+
+    def _startUtterance(self, cmd, utter):
+        # output utterance
+        self.chunk = cmd.get('chunk')
+        timeline = self._getTimeline(cmd, utter)
+        if not self._outputUtterance(utter, timeline is not None):
+            self.chunk = None
+            return False
         # store utterace data
         self.utterance = utter
         
@@ -384,7 +973,8 @@ class FMODChannelBase(ChannelBase):
         self.busy = True
         self.done_action = 'finished-say'
         # notify on start
-        self._notify('started-say')
+        self._notifySayStarted(timeline)
+        return True
 
     def play(self, cmd, local):
         # check if url is already known to be invalid
@@ -392,15 +982,20 @@ class FMODChannelBase(ChannelBase):
             self._notify('error', description='Bad sound URL.', url=cmd['url'])
             return
         
-        try:
-            # try to fetch a sound from the in-memory cache
-            snd = self.sound_cache[cmd['url'].encode('utf-8')]
+        # try to fetch a sound from the in-memory cache
+        key = self._getSoundKey(cmd)
+        snd = self.sounds.get(key)
+        if snd is not None:
             self.done_cached = True
-        except KeyError:
+        else:
             # build a new sound or stream, set done_cached also
             snd = self._buildFMODAudio(cmd, local)
             # leave if sound was not created; method already notified client
             if snd is None: return
+        if self.done_cached:
+            # keep it cached until this channel is done with it
+            self.sound_key = key
+            self.sounds.acquire(key)
 
         # set flags
         self.name = cmd.get('name')
@@ -418,12 +1013,116 @@ class FMODChannelBase(ChannelBase):
         # store the sound for later comparison
         self.snd = snd
 
+    def _getSoundKey(self, cmd):
+        '''
+        @param cmd Dictionary play command
+        @return String key of the command's sound in the cache, the URL 
+            without any fragment or else the local filename
+        '''
+        try:
+            uri = cmd['url'].split('#')[0]
+        except KeyError:
+            uri = cmd.get('filename', u'')
+        # have to encode because FMOD unicode flag doesn't seem to work
+        return uri.encode('utf-8')
+
+    def preload(self, cmd):
+        '''
+        Queues sounds to decode into the sound cache and text to synthesize
+        into the utterance cache with the channel's current voice and rate.
+        Preloading happens one item at a time while the channel has nothing
+        else to do.
+        '''
+        for field in ('urls', 'filenames'):
+            for uri in cmd.get(field) or []:
+                self.preloads.append(('sound', 
+                    self._getSoundKey({field[:-1] : uri})))
+        if self.utterances is not None:
+            # nowhere to keep speech otherwise
+            self.preloads.extend([('text', text) 
+                for text in cmd.get('texts') or [] if len(text)])
+        if not self.preloading:
+            self._schedulePreload(0)
+
+    def _schedulePreload(self, delay):
+        if not self.preloads:
+            self.preloading = False
+            return
+        self.preloading = True
+        ChannelBase.processLater(delay, self, '_preloadNext')
+
+    def _preloadNext(self):
+        if self.observer is None:
+            # shut down
+            self.preloads = []
+            self.preloading = False
+            return
+        if (self.busy or self.job is not None or len(self.queue) or 
+            self.scheduled is not None):
+            # output comes first
+            self._schedulePreload(PRELOAD_IDLE_POLL)
+            return
+        kind, value = self.preloads.pop(0)
+        if kind == 'sound':
+            self._preloadSound(value)
+        else:
+            self._preloadText(value)
+
+    def _preloadSound(self, key):
+        if key in self.sounds:
+            self._schedulePreload(0)
+            return
+        # decode in the background so the main loop keeps going
+        snd = c_void_p()
+        flags = FMOD_SOFTWARE|FMOD_2D|FMOD_LOOP_NORMAL|FMOD_NONBLOCKING
+        if self.fmod.FMOD_System_CreateSound(self.fsys, key, flags, None, 
+            byref(snd)):
+            # bad sounds are reported if they are ever played
+            self._schedulePreload(0)
+            return
+        ChannelBase.processLater(FMOD_OPEN_POLL, self, '_onPreloadOpened', 
+            key, snd)
+
+    def _onPreloadOpened(self, key, snd):
+        state = c_int()
+        self.fmod.FMOD_Sound_GetOpenState(snd, byref(state), None, None)
+        if state.value == FMOD_OPENSTATE_ERROR:
+            self.fmod.FMOD_Sound_Release(snd)
+        elif state.value != FMOD_OPENSTATE_READY:
+            ChannelBase.processLater(FMOD_OPEN_POLL, self, 
+                '_onPreloadOpened', key, snd)
+            return
+        elif key in self.sounds or not self._cacheSound(key, snd):
+            # played while loading, or too big to keep
+            self.fmod.FMOD_Sound_Release(snd)
+        self._schedulePreload(0)
+
+    def _preloadText(self, text):
+        key = self._getUtteranceKey(text)
+        if key in self.prefetched or key in self.utterances:
+            self._schedulePreload(0)
+        elif self.worker is None:
+            self._cacheUtterance(key, self._synthesizeUtterance(text))
+            self._schedulePreload(0)
+        else:
+            # a say of the same text picks up the job while it runs
+            self.preload_job = SynthesisJob(self, dict(action='say', 
+                text=text), None, key)
+            self.prefetched[key] = self.preload_job
+            self.worker.submit(self.preload_job)
+
     def getConfig(self, cmd):
         # add all voice names to config
         cfg = dict(voices=self._getVoices())
         cfg.update(self.config)
         self._notify('set-config', config=cfg)
 
+    def getStats(self, cmd):
+        stats = dict(sounds=self.sounds.getStats())
+        if self.utterances is not None:
+            stats['utterances'] = self.utterances.getStats()
+        self._notify('set-stats', stats=stats)
+
     def setProperty(self, cmd):
         name = cmd['name']
         val = cmd['value']
@@ -435,9 +1134,19 @@ class FMODChannelBase(ChannelBase):
             self._setVoice(val)
         elif name == 'loop':
             self._setLooping(val)
+        elif name == 'gapless':
+            if not val:
+                self._cancelScheduled(True)
+        elif name == 'timeline':
+            # applies from the next utterance output
+            pass
         else:
             return
         # store in config so we can refer to it later
         self.config[name] = val
+        if name in ('rate', 'voice'):
+            # work ahead again with the new voice and rate
+            self._dropStalePrefetches()
+            self._prefetchQueue()
         # notify observer
         self._notify('set-property', name=name, value=val)
\ No newline at end of file
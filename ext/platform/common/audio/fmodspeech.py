@@ -17,22 +17,46 @@ OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 '''
 from ctypes import *
 from fmodchannel import FMODChannelBase, FMOD_CREATESOUNDEXINFO
+from ..codec import ResponseTemplate
 
 FMOD_CHANNEL_FREE = -1
 FMOD_SOUND_FORMAT_PCM8 = 1
 FMOD_SOUND_FORMAT_PCM16 = 2
+FMOD_SOFTWARE = 0x00000040
+FMOD_CREATESTREAM = 0x00000080
+FMOD_OPENUSER = 0x00000400
 FMOD_OPENMEMORY = 0x00000800
 FMOD_OPENRAW = 0x00001000
+FMOD_OPENMEMORY_POINT = 0x10000000
 FMOD_TIMEUNIT_PCM  = 0x00000002
 
+# longest speech stream FMOD is told about; streams stop when drained
+MAX_STREAM_SECONDS = 3600
+# samples FMOD pulls from a speech stream per read
+STREAM_DECODE_SAMPLES = 2048
+
+# sent for every word spoken; the page may name a say with any JSON value
+STARTED_WORD = ResponseTemplate('started-word', [('channel', 'int'), 
+    ('name', 'json'), ('location', 'int'), ('length', 'int')], 
+    optional=['name'])
+
 class FMODSpeechBase(FMODChannelBase):
-    def _outputUtterance(self, utterance):
+    def _createUtteranceSound(self, utterance):
         # do nothing if there are no samples
         if len(utterance.samples) == 0:
-            return False
+            return None
             
-        # pointer to samples
-        buff = c_char_p(utterance.samples)
+        if isinstance(utterance.samples, str):
+            # pointer to samples, copied by FMOD
+            buff = c_char_p(utterance.samples)
+            flags = FMOD_OPENRAW | FMOD_OPENMEMORY
+        else:
+            # samples are synthesized into a buffer or mapped from disk, and 
+            # the utterance is held until the sound is released, so let FMOD
+            # play them in place
+            buff = (c_char * len(utterance.samples)).from_buffer(
+                utterance.samples)
+            flags = FMOD_OPENRAW | FMOD_OPENMEMORY_POINT | FMOD_SOFTWARE
         # create sound info struct
         info = FMOD_CREATESOUNDEXINFO()
         info.cbsize = sizeof(info)
@@ -46,72 +70,105 @@ class FMODSpeechBase(FMODChannelBase):
         
         # create a sound object
         snd = c_void_p()
-        flags = FMOD_OPENRAW | FMOD_OPENMEMORY
         if self.fmod.FMOD_System_CreateSound(self.fsys, buff, flags, 
             byref(info), byref(snd)):
             self._notify('error', description='Bad speech buffer.')
-            return False
-            
-        # set a marker on the first sample so we know when output starts
-        pt = c_void_p()
-        self.fmod.FMOD_Sound_AddSyncPoint(snd, 0, FMOD_TIMEUNIT_PCM, '', 
-            byref(pt))
-            
-        # set word markers on the sound
-        for word in utterance.words:
-            self.fmod.FMOD_Sound_AddSyncPoint(snd, word[2], FMOD_TIMEUNIT_PCM, 
-                '', byref(pt))
+            return None
+        return snd
 
-        # play the sound object, starting paused
-        ch = c_void_p()
-        if self.fmod.FMOD_System_PlaySound(self.fsys, FMOD_CHANNEL_FREE, snd, True, 
-            byref(ch)):
-            self._notify('error', description='Bad speech format.')
-            self.fmod.FMOD_Sound_Release(snd)
+    def _outputUtterance(self, utterance, timeline=False):
+        snd = self._createUtteranceSound(utterance)
+        if snd is None:
             return False
+        return self._playSpeech(snd, () if timeline else utterance.offsets)
 
-        # set channel volume, callback, loop
-        if self.fmod.FMOD_Channel_SetCallback(ch, self.fchcb):
-            self._notify('error', description='Cannot set speech callback.')
-            self.fmod.FMOD_Sound_Release(snd)
-            return False
-        if self.fmod.FMOD_Channel_SetVolume(ch, c_float(self.config['volume'])):
-            self._notify('error', description='Cannot set speech volume.')
+    def _scheduleUtterance(self, utterance, start, timeline=False):
+        snd = self._createUtteranceSound(utterance)
+        if snd is None:
+            return None
+        self._markSpeech(snd, () if timeline else utterance.offsets)
+        ch, end = self._openFMODChannel(snd, 'speech', False, start)
+        if ch is None:
             self.fmod.FMOD_Sound_Release(snd)
+        return ch, end
+
+    def _outputStream(self, stream):
+        # create sound info struct for a user stream of unknown length
+        info = FMOD_CREATESOUNDEXINFO()
+        info.cbsize = sizeof(info)
+        info.numchannels = stream.channels
+        info.defaultfrequency = stream.rate
+        if stream.depth == 8:
+            info.format = FMOD_SOUND_FORMAT_PCM8
+        elif stream.depth == 16:
+            info.format = FMOD_SOUND_FORMAT_PCM16
+        info.length = (MAX_STREAM_SECONDS * stream.rate * stream.channels * 
+            stream.depth / 8)
+        info.decodebuffersize = STREAM_DECODE_SAMPLES
+        info.pcmreadcallback = cast(stream.readcb, c_void_p)
+
+        # create a stream object that pulls samples from the speech stream
+        snd = c_void_p()
+        flags = FMOD_OPENUSER | FMOD_CREATESTREAM
+        if self.fmod.FMOD_System_CreateSound(self.fsys, None, flags, 
+            byref(info), byref(snd)):
+            self._notify('error', description='Bad speech stream.')
             return False
-        if self.fmod.FMOD_Channel_SetLoopCount(ch, 0):
-            self._notify('error', description='Cannot disable speech looping.')
-            self.fmod.FMOD_Sound_Release(snd)
+        if not self._playSpeech(snd, (), False):
             return False
-            
-        # start the sound playing
-        if self.fmod.FMOD_Channel_SetPaused(ch, False):
-            self._notify('error', description='Cannot start speech.')
+        stream.sound = snd
+        return True
+
+    def _addStreamWord(self, stream, word):
+        pt = c_void_p()
+        self.fmod.FMOD_Sound_AddSyncPoint(stream.sound, word[2], 
+            FMOD_TIMEUNIT_PCM, '', byref(pt))
+
+    def _playSpeech(self, snd, offsets, bounded=True):
+        self._markSpeech(snd, offsets)
+        # play the sound object
+        ch, end = self._openFMODChannel(snd, 'speech', False)
+        if ch is None:
             self.fmod.FMOD_Sound_Release(snd)
             return False
-            
-        # store the playing channel
+        # store the playing channel; a stream's end isn't known up front
         self.fch = ch
+        self.end_clock = end if bounded else None
         return True
+
+    def _markSpeech(self, snd, offsets):
+        # set a marker on the first sample so we know when output starts
+        pt = c_void_p()
+        self.fmod.FMOD_Sound_AddSyncPoint(snd, 0, FMOD_TIMEUNIT_PCM, '', 
+            byref(pt))
+            
+        # set word markers on the sound
+        for offset in offsets:
+            self.fmod.FMOD_Sound_AddSyncPoint(snd, offset, FMOD_TIMEUNIT_PCM, 
+                '', byref(pt))
         
     def _onFMODSyncPoint(self, index):
         if index == 0:
             # first marker is to notify about output start
-            self._notify('started-output')
+            if self._isFirstChunk():
+                self._notify('started-output')
+            if self.timeline:
+                # the client times words from here on
+                self._onTimelineSync(self.utterance)
+                return
             if self.utterance is None:
                 return
-            try:
-                if self.utterance.words[0][2] != 0:
-                    # if first word is not on first sample, return; it's just
-                    # the start marker
-                    return
-            except IndexError:
+            word = self.utterance.peekWord()
+            if word is None or word[2] != 0:
+                # if first word is not on first sample, return; it's just
+                # the start marker
                 return
         if self.utterance is None:
             return
-        try:
-            # notify about word info
-            word = self.utterance.words.pop(0)
-            self._notify('started-word', location=word[0], length=word[1])
-        except IndexError:
-            return
\ No newline at end of file
+        # notify about word info
+        word = self.utterance.nextWord()
+        if word is None:
+            return
+        # locations are relative to the part of a long say being output
+        offset = self.chunk[0] if self.chunk is not None else 0
+        self._notifyTemplate(STARTED_WORD, word[0] + offset, word[1])
\ No newline at end of file
@@ -0,0 +1,152 @@
+'''
+Speech sample stream fed by a synthesizer and drained by an FMOD user stream.
+
+Copyright (c) 2008, 2009 Carolina Computer Assistive Technology
+
+Permission to use, copy, modify, and distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+import threading
+from ctypes import *
+from channel import ChannelBase
+
+FMOD_OK = 0
+
+# FMOD_RESULT pcmreadcallback(FMOD_SOUND *sound, void *data, unsigned int len)
+PCMREADCALLBACK = CFUNCTYPE(c_int, c_void_p, c_void_p, c_uint)
+
+class SpeechStream(object):
+    '''
+    Samples and word events are written by the synthesis worker as they are
+    produced and read by FMOD on its stream thread. Everything that touches
+    the channel is posted to the main loop with ChannelBase.processNext.
+
+    @ivar channel Channel playing the stream
+    @ivar text String being synthesized
+    @ivar rate Integer waveform sampling rate in Hz
+    @ivar depth Integer sample bit depth in bits
+    @ivar channels Integer waveform channel count
+    @ivar sound FMOD sound object reading from this stream once output starts
+    @ivar readcb FMOD pcm read callback bound to this stream
+    @ivar chunks Array of sample strings or buffer views not yet read by FMOD
+    @ivar offset Integer bytes already read from the first chunk
+    @ivar padding Integer silent samples FMOD played while synthesis lagged
+    @ivar read Integer synthesized samples already read by FMOD
+    @ivar paddings Array of (sample, padding) tuples giving the total
+        silence played before each synthesized sample offset where FMOD
+        had to wait on synthesis
+    @ivar started Boolean True once the first samples are written
+    @ivar closed Boolean True once synthesis has finished
+    @ivar drained Boolean True once FMOD has read every sample after close
+    @ivar lock Lock guarding the buffer between the worker and FMOD threads
+    '''
+    def __init__(self, channel, text, rate, depth=16, channels=1):
+        self.channel = channel
+        self.text = text
+        self.rate = rate
+        self.depth = depth
+        self.channels = channels
+        self.sound = None
+        self.readcb = PCMREADCALLBACK(self._onPCMRead)
+        self.chunks = []
+        self.offset = 0
+        self.padding = 0
+        self.read = 0
+        self.paddings = []
+        self.started = False
+        self.closed = False
+        self.drained = False
+        self.lock = threading.Lock()
+
+    def write(self, samples):
+        '''
+        Adds synthesized samples to the end of the stream. The first write
+        asks the channel to start output.
+
+        @param samples String or buffer view of raw samples
+        '''
+        if not len(samples):
+            return
+        self.lock.acquire()
+        try:
+            self.chunks.append(samples)
+            start = not self.started
+            self.started = True
+        finally:
+            self.lock.release()
+        if start:
+            ChannelBase.processNext(self.channel, '_onStreamReady', self)
+
+    def addWord(self, word):
+        '''
+        Adds a word event. The sample offset is shifted by the silence FMOD
+        had to play before it while waiting on synthesis so the word stays
+        in sync.
+
+        @param word Tuple of (position, length, sample offset)
+        '''
+        self.lock.acquire()
+        try:
+            shift = 0
+            for sample, padding in self.paddings:
+                if sample > word[2]:
+                    # silence played after the word started
+                    break
+                shift = padding
+        finally:
+            self.lock.release()
+        sample = word[2] + shift
+        ChannelBase.processNext(self.channel, '_onStreamWord', self,
+            (word[0], word[1], sample))
+
+    def close(self):
+        '''Marks the end of synthesis.'''
+        self.lock.acquire()
+        try:
+            self.closed = True
+        finally:
+            self.lock.release()
+
+    def _onPCMRead(self, sound, data, datalen):
+        self.lock.acquire()
+        try:
+            filled = 0
+            while filled < datalen and self.chunks:
+                chunk = self.chunks[0]
+                size = min(len(chunk) - self.offset, datalen - filled)
+                memmove(data + filled, chunk[self.offset:self.offset+size],
+                    size)
+                filled += size
+                self.offset += size
+                if self.offset == len(chunk):
+                    self.chunks.pop(0)
+                    self.offset = 0
+            bps = self.channels * self.depth / 8
+            self.read += filled / bps
+            if filled < datalen:
+                # out of samples; play silence until more arrive or the end
+                memset(data + filled, 0, datalen - filled)
+                if not self.closed:
+                    # the silence comes before the next synthesized sample
+                    self.padding += (datalen - filled) / bps
+                    if self.paddings and self.paddings[-1][0] == self.read:
+                        self.paddings[-1] = (self.read, self.padding)
+                    else:
+                        self.paddings.append((self.read, self.padding))
+                elif not self.drained:
+                    # everything has been played; let the channel stop
+                    self.drained = True
+                    ChannelBase.processNext(self.channel, '_onStreamDrained',
+                        self)
+        finally:
+            self.lock.release()
+        return FMOD_OK
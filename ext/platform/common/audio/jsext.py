@@ -23,6 +23,8 @@ init: function() {
     this.config = {};
     // defaults no default until they come back from the server
     this.defaults = null;
+    // words being timed locally by channel in timeline mode
+    this.timelines = {};
     // listen for audio service events
     outfox.addObserver(outfox.utils.bind(this, this._onResponse), 'audio');
     // send request for default config
@@ -243,6 +245,48 @@ precache: function(urls) {
     return def;
 },
 
+/**
+ * Decodes sounds and synthesizes speech ahead of use so later play and say
+ * calls start right away. The audio service works through the items while
+ * the channel is otherwise idle, using the channel's current voice and rate
+ * for speech. Bad URLs and errors are ignored until the items are used.
+ *
+ * @param items Object with any of urls (relative or absolute sound URLs),
+ *   filenames (local sound files), and texts (strings to speak) arrays
+ * @param channel Channel that will use the items (defaults to 0)
+ */
+preload: function(items, channel) {
+    var args = {};
+    args.channel = channel || 0;
+    args.action = 'preload';
+    args.urls = [];
+    var urls = items.urls || [];
+    for(var i=0; i < urls.length; i++) {
+        args.urls.push(this._relToAbsUrl(urls[i]));
+    }
+    args.filenames = items.filenames || [];
+    args.texts = items.texts || [];
+    this.send(args);
+},
+
+/**
+ * Asks the audio service for statistics about its caches. Observers of the
+ * channel receive them as the stats property of a set-stats message. The
+ * sounds property of the stats holds the hits, misses, evictions, size,
+ * limit, count, and playing counts of the decoded sound cache. The
+ * utterances property, when the service caches speech, holds the hits,
+ * misses, size, limit, and count of the synthesized speech cache, plus the
+ * loads and stored counts of its on-disk store if it has one.
+ *
+ * @param channel Channel to ask (defaults to 0)
+ */
+getStats: function(channel) {
+    var args = {};
+    args.channel = channel || 0;
+    args.action = 'get-stats';
+    this.send(args);
+},
+
 /**
  * Adds a listener for events in a channel. The listener signature should be
  *
@@ -319,10 +363,33 @@ _onResponse: function(of, cmd) {
         this._onSetConfig(cmd);
     } else if(cmd.action == 'set-property') {
         this._onSetProperty(cmd);
+    } else if(cmd.action == 'started-say') {
+        this._startTimeline(cmd);
+        // observers see the same started-say with or without a timeline
+        delete cmd.words;
+        delete cmd.rate;
+    } else if(cmd.action == 'continued-say') {
+        // timeline bookkeeping only; not part of the page API
+        this._startTimeline(cmd);
+        return;
+    } else if(cmd.action == 'synced-output') {
+        this._syncTimeline(cmd.channel, cmd.position);
+        return;
+    } else if(cmd.action == 'finished-say') {
+        this._finishTimeline(cmd.channel);
     }
     // let observers know about the message
     // handling last means any observer registered in the ready callback
     // will also be notified of initial config
+    this._notifyObservers(cmd);
+},
+
+/**
+ * Called to pass a message to the observers of its channel.
+ *
+ * @param cmd Command object
+ */
+_notifyObservers: function(cmd) {
     var obs = this.observers[cmd.channel];
     if(typeof obs != 'undefined') {
         for(var i=0; i < obs.length; i++) {
@@ -340,6 +407,141 @@ _onResponse: function(of, cmd) {
     }
 },
 
+/**
+ * Called to start timing words locally when speech starts in timeline mode.
+ * The server sends the whole word table with the start of speech instead
+ * of a started-word message per word, then reports its playback position
+ * now and then. Observers still receive started-word messages.
+ *
+ * @param cmd Command with action started-say or continued-say
+ */
+_startTimeline: function(cmd) {
+    if(cmd.action == 'continued-say') {
+        // the previous part has played out in full
+        this._finishTimeline(cmd.channel, true);
+    } else {
+        this._stopTimeline(cmd.channel);
+    }
+    if(!cmd.words) return;
+    var tl = {};
+    tl.name = cmd.name;
+    // (location, length, sample offset) of each word
+    tl.words = cmd.words;
+    // samples per second
+    tl.rate = cmd.rate;
+    // index of the next word to announce
+    tl.next = 0;
+    // sample position last reported by the server and when it arrived
+    tl.position = null;
+    tl.time = null;
+    tl.timer = null;
+    this.timelines[cmd.channel] = tl;
+    if(cmd.action == 'continued-say') {
+        // later parts of a long say start as they are announced
+        this._syncTimeline(cmd.channel, 0);
+    }
+},
+
+/**
+ * Called to line up local word timing with the server playback position.
+ *
+ * @param channel Integer channel
+ * @param position Integer samples played
+ */
+_syncTimeline: function(channel, position) {
+    var tl = this.timelines[channel];
+    if(!tl) return;
+    tl.position = position;
+    tl.time = new Date().getTime();
+    this._scheduleTimelineWord(channel);
+},
+
+/**
+ * Called to set a timer for the next word in a timeline.
+ *
+ * @param channel Integer channel
+ */
+_scheduleTimelineWord: function(channel) {
+    var tl = this.timelines[channel];
+    if(tl.timer != null) {
+        clearTimeout(tl.timer);
+        tl.timer = null;
+    }
+    if(tl.next >= tl.words.length) return;
+    var delay = (tl.words[tl.next][2] - this._getTimelinePosition(tl)) * 
+        1000 / tl.rate;
+    tl.timer = setTimeout(outfox.utils.bind(this, this._onTimelineWord, 
+        [channel]), Math.max(0, delay));
+},
+
+/**
+ * Called to estimate how many samples of a timeline have played.
+ *
+ * @param tl Timeline object
+ * @return Number of samples
+ */
+_getTimelinePosition: function(tl) {
+    return tl.position + (new Date().getTime() - tl.time) * tl.rate / 1000;
+},
+
+/**
+ * Called when speech ends to announce any words whose timers have not yet
+ * fired, so observers see them before finished-say, then stops timing.
+ *
+ * @param channel Integer channel
+ * @param complete True if every word played, false to announce only those
+ *   the playback position has passed
+ */
+_finishTimeline: function(channel, complete) {
+    var tl = this.timelines[channel];
+    if(!tl) return;
+    if(complete) {
+        while(tl.next < tl.words.length) {
+            this._onTimelineWord(channel);
+        }
+    } else if(tl.time != null) {
+        var played = this._getTimelinePosition(tl);
+        while(tl.next < tl.words.length && tl.words[tl.next][2] <= played) {
+            this._onTimelineWord(channel);
+        }
+    }
+    this._stopTimeline(channel);
+},
+
+/**
+ * Called when the next word in a timeline is spoken.
+ *
+ * @param channel Integer channel
+ */
+_onTimelineWord: function(channel) {
+    var tl = this.timelines[channel];
+    if(!tl) return;
+    tl.timer = null;
+    var word = tl.words[tl.next++];
+    var cmd = {};
+    cmd.action = 'started-word';
+    cmd.channel = channel;
+    if(typeof tl.name != 'undefined')
+        cmd.name = tl.name;
+    cmd.location = word[0];
+    cmd.length = word[1];
+    this._notifyObservers(cmd);
+    this._scheduleTimelineWord(channel);
+},
+
+/**
+ * Called to stop timing words on a channel.
+ *
+ * @param channel Integer channel
+ */
+_stopTimeline: function(channel) {
+    var tl = this.timelines[channel];
+    if(!tl) return;
+    if(tl.timer != null)
+        clearTimeout(tl.timer);
+    delete this.timelines[channel];
+},
+
 /**
  * Called to store a client copy of channel properties held by the server.
  * Stores the first set received as the default for all future channels.
@@ -0,0 +1,146 @@
+'''
+Decoded sounds shared by all channels.
+
+Copyright (c) 2008, 2009 Carolina Computer Assistive Technology
+
+Permission to use, copy, modify, and distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+from ctypes import c_uint, byref
+
+FMOD_TIMEUNIT_PCMBYTES = 0x00000004
+
+class SoundCache(object):
+    '''
+    Least recently used cache of decoded FMOD sounds bounded by the total 
+    size of their samples. Keys are canonical URLs or filenames. Sounds
+    acquired by a playing channel are never evicted; the cache may run over
+    its limit until they are released. Only used from the main loop.
+
+    @ivar fmod FMOD module
+    @ivar limit Integer maximum bytes of decoded samples to hold
+    @ivar size Integer bytes of decoded samples currently held
+    @ivar entries Dictionary mapping keys to [sound, size, references] lists
+    @ivar order Array of keys from least to most recently used
+    @ivar hits Integer count of lookups that found a sound
+    @ivar misses Integer count of lookups that did not
+    @ivar evictions Integer count of sounds released to fit the limit
+    '''
+    def __init__(self, fmod, limit=32*1024*1024):
+        self.fmod = fmod
+        self.limit = limit
+        self.size = 0
+        self.entries = {}
+        self.order = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        '''
+        Looks up a cached sound and marks it most recently used.
+
+        @param key String canonical URL or filename
+        @return FMOD sound object or None
+        '''
+        try:
+            entry = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.order.remove(key)
+        self.order.append(key)
+        return entry[0]
+
+    def put(self, key, snd):
+        '''
+        Takes ownership of a sound, evicting the least recently used unused
+        sounds until the cache fits its limit. Sounds larger than the limit
+        are not kept, nor are sounds that don't fit beside those in use.
+
+        @param key String canonical URL or filename
+        @param snd FMOD sound object opened fully decoded
+        @return True if the sound was cached, False if the caller still owns 
+            it
+        '''
+        length = c_uint()
+        if self.fmod.FMOD_Sound_GetLength(snd, byref(length), 
+            FMOD_TIMEUNIT_PCMBYTES):
+            return False
+        size = length.value
+        if key in self.entries:
+            return False
+        # sounds in use can't make room
+        held = sum([entry[1] for entry in self.entries.itervalues() 
+            if entry[2]])
+        if held + size > self.limit:
+            return False
+        self.entries[key] = [snd, size, 0]
+        self.order.append(key)
+        self.size += size
+        self._trim()
+        return True
+
+    def acquire(self, key):
+        '''
+        Keeps a sound from being evicted while a channel plays it.
+
+        @param key String canonical URL or filename
+        '''
+        self.entries[key][2] += 1
+
+    def release(self, key):
+        '''
+        Lets a sound be evicted again once no channel plays it.
+
+        @param key String canonical URL or filename
+        '''
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        entry[2] -= 1
+        if entry[2] == 0:
+            # may have been held over the limit
+            self._trim()
+
+    def clear(self):
+        '''Releases all sounds not in use. Statistics are kept.'''
+        for key in list(self.order):
+            if not self.entries[key][2]:
+                self._remove(key)
+
+    def getStats(self):
+        '''
+        @return Dictionary of cache statistics
+        '''
+        return dict(hits=self.hits, misses=self.misses, 
+            evictions=self.evictions, size=self.size, limit=self.limit, 
+            count=len(self.entries), playing=len([entry for entry in 
+                self.entries.itervalues() if entry[2]]))
+
+    def _trim(self):
+        for key in list(self.order):
+            if self.size <= self.limit:
+                break
+            if not self.entries[key][2]:
+                self._remove(key)
+                self.evictions += 1
+
+    def _remove(self, key):
+        snd, size, refs = self.entries.pop(key)
+        self.order.remove(key)
+        self.size -= size
+        self.fmod.FMOD_Sound_Release(snd)
@@ -0,0 +1,307 @@
+'''
+Pool of processes synthesizing speech in parallel.
+
+Copyright (c) 2008, 2009 Carolina Computer Assistive Technology
+
+Permission to use, copy, modify, and distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+import asyncore
+import mmap
+import multiprocessing
+import threading
+from channel import ChannelBase
+from utterance import Utterance
+
+# bytes of samples each process can hand back through shared memory per 
+# utterance; anything longer comes through its pipe
+SHARED_BUFFER_SIZE = 8*1024*1024
+
+class SharedFlag(object):
+    '''
+    Cancellation token for synthesis in a pool process, set by the main 
+    process through a shared byte.
+
+    @ivar flag mmap byte shared with the main process
+    '''
+    def __init__(self, flag):
+        self.flag = flag
+
+    @property
+    def cancelled(self):
+        return self.flag[0] != '\0'
+
+class SharedStream(object):
+    '''
+    Stream-like sink for synthesis in a pool process. Writes samples to the
+    shared buffer and, when the job streams, tells the main process about
+    each write and word as it happens.
+
+    @ivar conn multiprocessing Connection to the main process
+    @ivar shm mmap buffer shared with the main process
+    @ivar streaming Boolean True to report writes and words as they happen
+    @ivar size Integer bytes written to the shared buffer
+    @ivar spill List of sample strings that did not fit the shared buffer
+    '''
+    def __init__(self, conn, shm, streaming):
+        self.conn = conn
+        self.shm = shm
+        self.streaming = streaming
+        self.size = 0
+        self.spill = []
+
+    def write(self, samples):
+        count = len(samples)
+        if not count:
+            return
+        if not self.spill and self.size + count <= len(self.shm):
+            # write takes buffer views as well as strings
+            self.shm.seek(self.size)
+            self.shm.write(samples)
+            if self.streaming:
+                self.conn.send(('samples', self.size, count))
+            self.size += count
+        else:
+            # out of shared memory; keep order by spilling everything after
+            samples = str(samples)
+            self.spill.append(samples)
+            if self.streaming:
+                self.conn.send(('spill', samples))
+
+    def addWord(self, word):
+        if self.streaming:
+            self.conn.send(('word', word))
+
+def _serve(conn, shm, flag, synthesize):
+    # the forked process has no business with the parent's sockets
+    for obj in asyncore.socket_map.values():
+        try:
+            obj.socket.close()
+        except Exception:
+            pass
+    asyncore.socket_map.clear()
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        text, profile, streaming = request
+        stream = SharedStream(conn, shm, streaming)
+        try:
+            utter = synthesize(text, profile, stream, SharedFlag(flag))
+        except Exception, e:
+            conn.send(('error', str(e)))
+            continue
+        conn.send(('done', stream.size, ''.join(stream.spill), utter.rate,
+            utter.depth, utter.channels, utter.words))
+
+class PoolProcess(object):
+    '''
+    One synthesis process and the thread in the main process that feeds it
+    jobs.
+
+    @ivar process multiprocessing.Process running the synthesis engine
+    @ivar conn multiprocessing Connection to the process
+    @ivar child multiprocessing Connection the process reads from
+    @ivar shm mmap buffer shared with the process
+    @ivar flag mmap byte shared with the process, set to cancel its job
+    @ivar profile Last profile the process synthesized with, or None
+    @ivar thread threading.Thread feeding the process
+    '''
+    def __init__(self, synthesize):
+        self.shm = mmap.mmap(-1, SHARED_BUFFER_SIZE)
+        self.flag = mmap.mmap(-1, 1)
+        self.conn, self.child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_serve, 
+            args=(self.child, self.shm, self.flag, synthesize))
+        self.process.daemon = True
+        self.profile = None
+        self.thread = None
+
+    def start(self):
+        self.process.start()
+        # leave the process the only holder of its end, so the pipe reports
+        # EOF if it dies
+        self.child.close()
+
+class SynthesisPool(object):
+    '''
+    Drop-in replacement for SynthesisWorker that synthesizes on several 
+    processes, each with its own instance of a process wide engine, so 
+    channels synthesize in parallel. A job goes to an idle process, 
+    preferring one that last used the same voice and rate. Samples come 
+    back through memory shared with the process and word events through
+    its pipe. Finished jobs are handed back to their channel on the main
+    loop with ChannelBase.processNext.
+
+    @ivar processes List of live PoolProcess instances
+    @ivar jobs List of SynthesisJob instances waiting for a process
+    @ivar cond threading.Condition guarding jobs
+    @ivar running Boolean False once shut down
+    '''
+    def __init__(self, synthesize, count):
+        '''
+        @param synthesize Function called in a pool process with the text,
+            a profile from the channel, a stream-like object taking samples
+            and words as they are produced, and a token whose cancelled 
+            attribute turns True if the job is cancelled; returns an 
+            Utterance
+        @param count Integer number of processes
+        '''
+        self.jobs = []
+        self.cond = threading.Condition()
+        self.running = True
+        # fork before the main process starts any other thread, and each
+        # before the next pipe exists so no process holds another's pipe
+        self.processes = []
+        for i in xrange(count):
+            proc = PoolProcess(synthesize)
+            proc.start()
+            self.processes.append(proc)
+
+    def start(self):
+        for proc in self.processes:
+            proc.thread = threading.Thread(target=self._feed, args=(proc,))
+            proc.thread.setDaemon(True)
+            proc.thread.start()
+
+    def submit(self, job):
+        '''
+        Queues a job for synthesis.
+
+        @param job SynthesisJob instance
+        '''
+        self.cond.acquire()
+        try:
+            alive = bool(self.processes)
+            if alive:
+                self.jobs.append(job)
+                self.cond.notify_all()
+        finally:
+            self.cond.release()
+        if not alive:
+            self._finish(job, 'no synthesis process left')
+
+    def shutdown(self):
+        '''Stops the processes after any jobs already queued.'''
+        self.cond.acquire()
+        try:
+            self.running = False
+            self.cond.notify_all()
+        finally:
+            self.cond.release()
+
+    def _take(self, proc):
+        self.cond.acquire()
+        try:
+            while not self.jobs:
+                if not self.running:
+                    return None
+                self.cond.wait()
+            # avoid switching voices when another job can use this one
+            for i, job in enumerate(self.jobs):
+                if job.profile == proc.profile:
+                    break
+            else:
+                i = 0
+            return self.jobs.pop(i)
+        finally:
+            self.cond.release()
+
+    def _feed(self, proc):
+        while True:
+            job = self._take(proc)
+            if job is None:
+                break
+            proc.profile = job.profile
+            try:
+                if not self._arm(proc, job):
+                    self._runJob(proc, job)
+            except (EOFError, IOError), e:
+                # the process is gone; don't feed it any more jobs
+                self._finish(job, 'synthesis process failed: %s' % e)
+                self._retire(proc)
+                return
+            self._finish(job)
+        try:
+            proc.conn.send(None)
+        except (EOFError, IOError):
+            pass
+
+    def _retire(self, proc):
+        if proc.process.is_alive():
+            proc.process.terminate()
+        self.cond.acquire()
+        try:
+            self.processes.remove(proc)
+            if self.processes:
+                # waiting jobs go to the live processes
+                return
+            # nothing left to synthesize with
+            jobs = self.jobs
+            self.jobs = []
+        finally:
+            self.cond.release()
+        for job in jobs:
+            self._finish(job, 'no synthesis process left')
+
+    def _finish(self, job, error=None):
+        if error is not None:
+            job.error = error
+        job.lock.acquire()
+        try:
+            # the process moves on; later cancels must not reach it
+            job.flag = None
+        finally:
+            job.lock.release()
+        if job.stream is not None:
+            # always end the stream so playback can finish
+            job.stream.close()
+        # let the channel output the result on the main loop
+        ChannelBase.processNext(job.channel, '_onSynthesized', job)
+
+    def _arm(self, proc, job):
+        # let the job reach the process if cancelled while it runs
+        job.lock.acquire()
+        try:
+            proc.flag[0] = '\0'
+            job.flag = proc.flag
+        finally:
+            job.lock.release()
+        # stopped before its turn came
+        return job.cancelled
+
+    def _runJob(self, proc, job):
+        stream = job.stream
+        proc.conn.send((job.cmd['text'], job.profile, stream is not None))
+        while True:
+            msg = proc.conn.recv()
+            kind = msg[0]
+            if kind == 'samples':
+                stream.write(proc.shm[msg[1]:msg[1]+msg[2]])
+            elif kind == 'spill':
+                stream.write(msg[1])
+            elif kind == 'word':
+                stream.addWord(msg[1])
+            elif kind == 'error':
+                job.error = msg[1]
+                return
+            elif kind == 'done':
+                size, spill, rate, depth, channels, words = msg[1:]
+                # copy out before the buffer is reused by the next job
+                samples = bytearray(buffer(proc.shm, 0, size))
+                samples.extend(spill)
+                job.utterance = Utterance(job.cmd['text'], samples, rate, 
+                    depth, channels, words)
+                return
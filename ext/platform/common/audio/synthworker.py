@@ -0,0 +1,117 @@
+'''
+Background speech synthesis worker.
+
+Copyright (c) 2008, 2009 Carolina Computer Assistive Technology
+
+Permission to use, copy, modify, and distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+import threading
+import Queue
+from channel import ChannelBase
+
+class SynthesisJob(object):
+    '''
+    @ivar channel Channel that requested the synthesis
+    @ivar cmd Dictionary say command to synthesize
+    @ivar stream SpeechStream to fill while synthesizing, or None
+    @ivar key Tuple identifying the utterance in a cache, or None
+    @ivar profile Voice and rate in effect when the job was made, which 
+        synthesis uses even if they change while the job waits
+    @ivar utterance Utterance instance once synthesis completes
+    @ivar error String description of a synthesis failure, or None
+    @ivar finished Boolean True once the main loop has the result
+    @ivar cancelled Boolean True once the result is no longer wanted
+    @ivar flag mmap byte shared with the synthesis pool process running the
+        job, or None
+    @ivar lock threading.Lock held while the flag is set, cleared or used,
+        so a cancel never lands on the next job the process runs
+    '''
+    def __init__(self, channel, cmd, stream=None, key=None):
+        self.channel = channel
+        self.cmd = cmd
+        self.stream = stream
+        self.key = key
+        self.profile = channel._getSynthesisProfile()
+        self.utterance = None
+        self.error = None
+        self.finished = False
+        self.cancelled = False
+        self.flag = None
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        '''
+        Asks synthesis to stop as soon as it can. Called on the main loop.
+        '''
+        self.cancelled = True
+        self.lock.acquire()
+        try:
+            if self.flag is not None:
+                # tell the pool process too
+                self.flag[0] = '\1'
+        finally:
+            self.lock.release()
+
+    def run(self):
+        '''Synthesizes the command text. Runs on the worker thread.'''
+        text = self.cmd['text']
+        try:
+            if self.cancelled:
+                # stopped before its turn came
+                pass
+            elif self.stream is None:
+                self.utterance = self.channel._synthesizeUtterance(text, self)
+            else:
+                self.utterance = self.channel._streamUtterance(text, 
+                    self.stream, self)
+        except Exception, e:
+            self.error = str(e)
+        if self.stream is not None:
+            # always end the stream so playback can finish
+            self.stream.close()
+
+class SynthesisWorker(threading.Thread):
+    '''
+    Thread that synthesizes speech for all channels in the process so the
+    main loop keeps servicing the socket and mixer. Jobs run one at a time
+    in the order submitted. Finished jobs are handed back to their channel
+    on the main loop with ChannelBase.processNext.
+
+    @ivar jobs Queue of SynthesisJob instances waiting to run
+    '''
+    def __init__(self):
+        threading.Thread.__init__(self)
+        # don't hold the process open if the main loop exits without shutdown
+        self.setDaemon(True)
+        self.jobs = Queue.Queue()
+
+    def submit(self, job):
+        '''
+        Queues a job for synthesis.
+
+        @param job SynthesisJob instance
+        '''
+        self.jobs.put(job)
+
+    def shutdown(self):
+        '''Stops the worker after any jobs already queued.'''
+        self.jobs.put(None)
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            job.run()
+            # let the channel output the result on the main loop
+            ChannelBase.processNext(job.channel, '_onSynthesized', job)
@@ -16,21 +16,97 @@ ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 '''
 
+from array import array
+
 class Utterance(object):
     '''
+    Keeps samples in one growable buffer and word metadata in parallel
+    typed arrays rather than per-word tuples. Words are consumed in order by
+    advancing a cursor.
+
     @ivar text String utterance
-    @ivar samples Buffer of speech waveform samples
+    @ivar samples bytearray of speech waveform samples, or any other buffer
+        (e.g. a str or mmap) given at construction
     @ivar rate Integer waveform sampling rate in Hz
     @ivar depth Integer sample bit depth in bits
     @ivar channels Integer waveform channel count
-    @ivar words Array of (position, length, sample offset) tuples for words in
-        the utterance
+    @ivar positions array of word positions in the text
+    @ivar lengths array of word lengths in the text
+    @ivar offsets array of word sample offsets in the waveform
+    @ivar cursor Integer index of the next word to consume
     '''
-    def __init__(self, text, samples='', rate=44100, depth=16, channels=1, 
-    words=[]):
+    __slots__ = ('text', 'samples', 'rate', 'depth', 'channels', 'positions',
+        'lengths', 'offsets', 'cursor')
+
+    def __init__(self, text, samples=None, rate=44100, depth=16, channels=1, 
+    words=()):
         self.text = text
+        if samples is None:
+            samples = bytearray()
         self.samples = samples
         self.rate = rate
         self.depth = depth
         self.channels = channels
-        self.words = words
\ No newline at end of file
+        self.positions = array('i')
+        self.lengths = array('i')
+        self.offsets = array('l')
+        self.cursor = 0
+        for word in words:
+            self.addWord(word)
+
+    def addWord(self, word):
+        '''
+        @param word Tuple of (position, length, sample offset)
+        '''
+        self.positions.append(word[0])
+        self.lengths.append(word[1])
+        self.offsets.append(word[2])
+
+    def addWords(self, positions, lengths, offsets):
+        '''
+        @param positions Sequence of word positions
+        @param lengths Sequence of word lengths
+        @param offsets Sequence of word sample offsets
+        '''
+        self.positions.extend(positions)
+        self.lengths.extend(lengths)
+        self.offsets.extend(offsets)
+
+    def peekWord(self):
+        '''
+        @return Tuple of (position, length, sample offset) for the next word,
+            or None if all words are consumed
+        '''
+        i = self.cursor
+        if i >= len(self.offsets):
+            return None
+        return (self.positions[i], self.lengths[i], self.offsets[i])
+
+    def nextWord(self):
+        '''
+        Consumes the next word.
+
+        @return Tuple of (position, length, sample offset), or None if all
+            words are consumed
+        '''
+        word = self.peekWord()
+        if word is not None:
+            self.cursor += 1
+        return word
+
+    @property
+    def words(self):
+        '''List of (position, length, sample offset) tuples not yet consumed'''
+        return zip(self.positions[self.cursor:], self.lengths[self.cursor:],
+            self.offsets[self.cursor:])
+
+    def copy(self):
+        '''
+        @return Utterance sharing these samples and words with its own cursor
+        '''
+        utter = Utterance(self.text, self.samples, self.rate, self.depth, 
+            self.channels)
+        utter.positions = self.positions
+        utter.lengths = self.lengths
+        utter.offsets = self.offsets
+        return utter
@@ -0,0 +1,116 @@
+'''
+Bounded cache of synthesized speech utterances.
+
+Copyright (c) 2008, 2009 Carolina Computer Assistive Technology
+
+Permission to use, copy, modify, and distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+class UtteranceCache(object):
+    '''
+    Least recently used cache of Utterance objects bounded by the total size
+    of their samples. Keys are (text, voice, rate, engine) tuples. Misses
+    fall back to an optional persistent store, which also receives every
+    new utterance. Only used from the main loop.
+
+    @ivar store UtteranceStore backing this cache, or None
+    @ivar limit Integer maximum bytes of samples to hold
+    @ivar size Integer bytes of samples currently held
+    @ivar entries Dictionary mapping keys to Utterance instances
+    @ivar order Array of keys from least to most recently used
+    @ivar hits Integer count of lookups that found an utterance
+    @ivar misses Integer count of lookups that did not
+    '''
+    def __init__(self, limit=16*1024*1024, store=None):
+        self.store = store
+        self.limit = limit
+        self.size = 0
+        self.entries = {}
+        self.order = []
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.entries or (self.store is not None and 
+            key in self.store)
+
+    def get(self, key):
+        '''
+        Looks up a cached utterance and marks it most recently used.
+
+        @param key Tuple of (text, voice, rate, engine)
+        @return Utterance instance or None
+        '''
+        try:
+            utter = self.entries[key]
+        except KeyError:
+            utter = None
+            if self.store is not None:
+                utter = self.store.get(key)
+            if utter is None:
+                self.misses += 1
+                return None
+            # keep it in memory now that it is mapped
+            self.hits += 1
+            self._insert(key, utter)
+            return utter
+        self.hits += 1
+        self.order.remove(key)
+        self.order.append(key)
+        return utter
+
+    def put(self, key, utter):
+        '''
+        Stores an utterance, evicting the least recently used ones until the
+        cache fits its limit. Utterances larger than the limit are not kept.
+
+        @param key Tuple of (text, voice, rate, engine)
+        @param utter Utterance instance
+        '''
+        self._insert(key, utter)
+        if self.store is not None:
+            self.store.put(key, utter)
+
+    def _insert(self, key, utter):
+        size = len(utter.samples)
+        if size == 0 or size > self.limit:
+            return
+        if key in self.entries:
+            self._remove(key)
+        while self.size + size > self.limit:
+            self._remove(self.order[0])
+        self.entries[key] = utter
+        self.order.append(key)
+        self.size += size
+
+    def clear(self):
+        '''Drops all cached utterances. Statistics are kept.'''
+        self.size = 0
+        self.entries = {}
+        self.order = []
+
+    def getStats(self):
+        '''
+        @return Dictionary of cache statistics
+        '''
+        stats = dict(hits=self.hits, misses=self.misses, size=self.size,
+            limit=self.limit, count=len(self.entries))
+        if self.store is not None:
+            stats['loads'] = self.store.loads
+            stats['stored'] = len(self.store.index)
+        return stats
+
+    def _remove(self, key):
+        utter = self.entries.pop(key)
+        self.order.remove(key)
+        self.size -= len(utter.samples)
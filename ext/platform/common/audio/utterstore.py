@@ -0,0 +1,289 @@
+'''
+Persistent on-disk store of synthesized speech utterances.
+
+Copyright (c) 2008, 2009 Carolina Computer Assistive Technology
+
+Permission to use, copy, modify, and distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+import os
+import mmap
+import hashlib
+import threading
+import Queue
+import simplejson
+from utterance import Utterance
+
+INDEX_NAME = 'index'
+PCM_EXT = '.pcm'
+# utterances waiting to be written before new ones are skipped
+MAX_PENDING = 16
+
+class UtteranceStore(object):
+    '''
+    Pool of raw PCM files named by the SHA-1 of their samples plus an append
+    only index mapping utterance keys to a PCM file, its format, and its word
+    table. Samples are read back as copy-on-write memory maps so FMOD can
+    play them in place. Hashing and writing happen on a thread of their own
+    so the main loop never waits on the disk. Once the pool passes its limit
+    the least recently used entries are evicted. Several service processes
+    may share one store; each sees the entries that existed when it started
+    plus its own.
+
+    @ivar path String directory holding the pool and index
+    @ivar limit Integer maximum bytes of samples to keep in the pool
+    @ivar size Integer bytes of samples in the pool
+    @ivar index Dictionary mapping key digests to entry dictionaries
+    @ivar order List of key digests from least to most recently used
+    @ivar pcms Dictionary mapping PCM digests to [size, reference count]
+    @ivar pending Set of key digests waiting to be written
+    @ivar lock threading.Lock guarding the index and pool bookkeeping
+    @ivar writes Queue of (key digest, utterance) tuples to write
+    @ivar loads Integer count of utterances read from the pool
+    '''
+    def __init__(self, path, limit=256*1024*1024):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.limit = limit
+        self.size = 0
+        self.index = {}
+        self.order = []
+        self.pcms = {}
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.writes = Queue.Queue(MAX_PENDING)
+        self.loads = 0
+        self._loadIndex()
+        writer = threading.Thread(target=self._write)
+        # a torn write is skipped on the next load
+        writer.setDaemon(True)
+        writer.start()
+
+    def __contains__(self, key):
+        return self._digestKey(key) in self.index
+
+    def get(self, key):
+        '''
+        Maps a stored utterance into memory and marks it most recently used.
+
+        @param key Tuple of (text, voice, rate, engine)
+        @return Utterance instance with mmap samples, or None
+        '''
+        digest = self._digestKey(key)
+        self.lock.acquire()
+        try:
+            entry = self.index.get(digest)
+            if entry is not None:
+                self.order.remove(digest)
+                self.order.append(digest)
+        finally:
+            self.lock.release()
+        if entry is None:
+            return None
+        try:
+            f = open(self._pcmPath(entry['pcm']), 'rb')
+            try:
+                samples = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            finally:
+                f.close()
+        except (EnvironmentError, ValueError):
+            # pool file is missing or empty; forget the entry
+            self.lock.acquire()
+            try:
+                if self.index.get(digest) is entry:
+                    self._forget(digest)
+            finally:
+                self.lock.release()
+            return None
+        self.loads += 1
+        words = [tuple(word) for word in entry['words']]
+        return Utterance(key[0], samples, entry['rate'], entry['depth'],
+            entry['channels'], words)
+
+    def put(self, key, utter):
+        '''
+        Queues an utterance to be written to the pool and index. Utterances
+        that were read from a store, that are larger than the limit, or that
+        arrive while the writer is backed up are skipped.
+
+        @param key Tuple of (text, voice, rate, engine)
+        @param utter Utterance instance
+        '''
+        if (isinstance(utter.samples, mmap.mmap) or not len(utter.samples) 
+            or len(utter.samples) > self.limit):
+            return
+        digest = self._digestKey(key)
+        self.lock.acquire()
+        try:
+            if digest in self.index or digest in self.pending:
+                return
+            try:
+                self.writes.put_nowait((digest, utter))
+            except Queue.Full:
+                # persistence can wait for another time
+                return
+            self.pending.add(digest)
+        finally:
+            self.lock.release()
+
+    def flush(self):
+        '''Waits until every queued utterance is written.'''
+        self.writes.join()
+
+    def _write(self):
+        while True:
+            digest, utter = self.writes.get()
+            try:
+                entry = self._writeEntry(digest, utter)
+            except EnvironmentError:
+                # a full or read-only disk only costs us persistence
+                entry = None
+            self.lock.acquire()
+            try:
+                self.pending.discard(digest)
+                evicted = []
+                if entry is not None:
+                    self.index[digest] = entry
+                    self.order.append(digest)
+                    self._addPCM(entry['pcm'], len(utter.samples))
+                    evicted = self._trim()
+            finally:
+                self.lock.release()
+            self._removePCMs(evicted)
+            self.writes.task_done()
+
+    def _writeEntry(self, digest, utter):
+        pcm = hashlib.sha1(utter.samples).hexdigest()
+        path = self._pcmPath(pcm)
+        self.lock.acquire()
+        try:
+            known = pcm in self.pcms
+        finally:
+            self.lock.release()
+        if not known and not os.path.exists(path):
+            # write then rename so readers never map a partial file
+            tmp = '%s.%d' % (path, os.getpid())
+            f = open(tmp, 'wb')
+            try:
+                f.write(utter.samples)
+            finally:
+                f.close()
+            os.rename(tmp, path)
+        entry = dict(key=digest, pcm=pcm, rate=utter.rate,
+            depth=utter.depth, channels=utter.channels,
+            words=[list(word) for word in utter.words])
+        f = open(os.path.join(self.path, INDEX_NAME), 'a')
+        try:
+            f.write(simplejson.dumps(entry) + '\n')
+        finally:
+            f.close()
+        return entry
+
+    def _addPCM(self, pcm, size):
+        try:
+            self.pcms[pcm][1] += 1
+        except KeyError:
+            self.pcms[pcm] = [size, 1]
+            self.size += size
+
+    def _forget(self, digest):
+        # drops an entry; returns its PCM digest if no other entry uses it
+        entry = self.index.pop(digest)
+        self.order.remove(digest)
+        pcm = entry['pcm']
+        counts = self.pcms.get(pcm)
+        if counts is None:
+            return None
+        counts[1] -= 1
+        if counts[1] > 0:
+            return None
+        del self.pcms[pcm]
+        self.size -= counts[0]
+        return pcm
+
+    def _trim(self):
+        # evicts least recently used entries until the pool fits its limit
+        evicted = []
+        while self.size > self.limit and self.order:
+            pcm = self._forget(self.order[0])
+            if pcm is not None:
+                evicted.append(pcm)
+        return evicted
+
+    def _removePCMs(self, pcms):
+        for pcm in pcms:
+            try:
+                os.remove(self._pcmPath(pcm))
+            except EnvironmentError:
+                # still mapped on a platform that won't allow removal
+                pass
+
+    def _loadIndex(self):
+        try:
+            f = open(os.path.join(self.path, INDEX_NAME), 'r')
+        except EnvironmentError:
+            return
+        lines = 0
+        try:
+            for line in f:
+                lines += 1
+                try:
+                    entry = simplejson.loads(line)
+                    digest = entry['key']
+                except Exception:
+                    # skip lines torn by a crash mid-write
+                    continue
+                if digest in self.index:
+                    self.order.remove(digest)
+                # later lines were written more recently
+                self.index[digest] = entry
+                self.order.append(digest)
+        finally:
+            f.close()
+        sizes = {}
+        for name in os.listdir(self.path):
+            if name.endswith(PCM_EXT):
+                sizes[name[:-len(PCM_EXT)]] = os.path.getsize(
+                    os.path.join(self.path, name))
+        for digest in list(self.order):
+            pcm = self.index[digest]['pcm']
+            if pcm in sizes:
+                self._addPCM(pcm, sizes[pcm])
+            else:
+                # evicted by this or another process
+                del self.index[digest]
+                self.order.remove(digest)
+        self._removePCMs(self._trim())
+        if lines > 2 * len(self.index):
+            # mostly evicted entries; start the index afresh
+            self._rewriteIndex()
+
+    def _rewriteIndex(self):
+        path = os.path.join(self.path, INDEX_NAME)
+        tmp = '%s.%d' % (path, os.getpid())
+        try:
+            f = open(tmp, 'w')
+            try:
+                for digest in self.order:
+                    f.write(simplejson.dumps(self.index[digest]) + '\n')
+            finally:
+                f.close()
+            os.rename(tmp, path)
+        except EnvironmentError:
+            pass
+
+    def _pcmPath(self, digest):
+        return os.path.join(self.path, digest + PCM_EXT)
+
+    def _digestKey(self, key):
+        return hashlib.sha1(simplejson.dumps(list(key))).hexdigest()
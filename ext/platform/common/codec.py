@@ -0,0 +1,176 @@
+'''
+JSON codec for the wire protocol.
+
+Copyright (c) 2008, 2009 Carolina Computer Assistive Technology
+
+Permission to use, copy, modify, and distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+import os
+
+# backends in order of preference; OUTFOX_JSON names one to force it
+BACKENDS = ('json', 'simplejson')
+# no whitespace on the wire
+SEPARATORS = (',', ':')
+
+class Codec(object):
+    '''
+    Encoder and decoder pair from one JSON backend.
+
+    @ivar name String backend name
+    @ivar accelerated Boolean True if the backend runs compiled code
+    @ivar dumps Callable encoding an object to a JSON string
+    @ivar loads Callable decoding a JSON string to an object
+    @ivar encodeString Callable encoding a string to a JSON string literal
+    '''
+    def __init__(self, name, module, accelerated):
+        self.name = name
+        self.accelerated = accelerated
+        self.dumps = module.JSONEncoder(separators=SEPARATORS).encode
+        self.loads = module.JSONDecoder().decode
+        self.encodeString = module.encoder.encode_basestring_ascii
+
+def loadCodec(name):
+    '''
+    Builds a codec for a named backend.
+
+    @param name String 'json' for the standard library module or 
+        'simplejson' for the bundled one
+    @return Codec instance
+    @raise ImportError If the backend is not available
+    '''
+    if name == 'json':
+        # the standard library module, a descendant of simplejson
+        import json.scanner
+        import json.encoder
+        fast = (getattr(json.scanner, 'c_make_scanner', None) is not None and
+            getattr(json.encoder, 'c_make_encoder', None) is not None)
+        return Codec(name, json, fast)
+    elif name == 'simplejson':
+        # the bundled module; simplejson._speedups supplies its compiled
+        # parts when the platform has them
+        import simplejson
+        import simplejson.encoder
+        fast = (simplejson.encoder.encode_basestring_ascii is not 
+            simplejson.encoder.py_encode_basestring_ascii)
+        return Codec(name, simplejson, fast)
+    raise ImportError('unknown JSON backend: %s' % name)
+
+def getCodec():
+    '''
+    @return Codec for the backend named by OUTFOX_JSON, else the first
+        accelerated backend, else the first available one
+    '''
+    forced = os.environ.get('OUTFOX_JSON')
+    if forced:
+        try:
+            return loadCodec(forced)
+        except ImportError:
+            pass
+    codecs = []
+    for name in BACKENDS:
+        try:
+            codec = loadCodec(name)
+        except ImportError:
+            continue
+        if codec.accelerated:
+            return codec
+        codecs.append(codec)
+    return codecs[0]
+
+CODEC = getCodec()
+dumps = CODEC.dumps
+loads = CODEC.loads
+encodeString = CODEC.encodeString
+
+_INFINITY = float('inf')
+
+def _encodeNumber(value):
+    value = float(value)
+    if value != value or value in (_INFINITY, -_INFINITY):
+        # JSON has no literal for these
+        raise ValueError('cannot encode %r in JSON' % value)
+    return repr(value)
+
+# template placeholders and value converters by field kind; ints format 
+# straight into the template
+_PLACEHOLDERS = {'int' : '%d', 'number' : '%s', 'string' : '%s', 'json' : '%s'}
+_CONVERTERS = {'number' : _encodeNumber, 'string' : encodeString, 
+    'json' : dumps}
+
+class ResponseTemplate(object):
+    '''
+    Fixed-shape response encoded by formatting its values straight into a
+    precompiled JSON string, skipping the dictionary copies and generic 
+    encode of the usual response path. Used for the highest frequency 
+    responses.
+
+    @ivar action String response action
+    @ivar fields Tuple of (name, kind) pairs in the order values are given,
+        kind being 'int', 'number', 'string', or 'json'
+    @ivar optional Tuple of indices of fields left out when None
+    @ivar converters Tuple of (index, converter) pairs for fields that must
+        be encoded before formatting
+    @ivar formats Dictionary mapping (service, missing field bits) to 
+        precompiled format strings
+    '''
+    def __init__(self, action, fields, optional=()):
+        self.action = action
+        self.fields = tuple(fields)
+        self.optional = tuple([i for i, (name, kind) in enumerate(self.fields)
+            if name in optional])
+        self.converters = tuple([(i, _CONVERTERS[kind]) 
+            for i, (name, kind) in enumerate(self.fields) 
+            if kind in _CONVERTERS])
+        self.formats = {}
+
+    def encode(self, page_id, service, values):
+        '''
+        Encodes a response envelope.
+
+        @param page_id Page ID the response is for
+        @param service String service name
+        @param values Sequence of field values in template order
+        @return JSON string equivalent to encoding the envelope dictionary
+        '''
+        missing = 0
+        for i in self.optional:
+            if values[i] is None:
+                missing |= 1 << i
+        try:
+            fmt = self.formats[service, missing]
+        except KeyError:
+            fmt = self._compile(service, missing)
+        args = list(values)
+        for i, convert in self.converters:
+            if args[i] is not None:
+                args[i] = convert(args[i])
+        if missing:
+            args = [val for i, val in enumerate(args) 
+                if not missing & (1 << i)]
+        if type(page_id) is not int:
+            page_id = dumps(page_id)
+        return fmt % tuple([page_id] + args)
+
+    def _compile(self, service, missing):
+        parts = ['{"page_id":%s,"cmd":{"action":', 
+            encodeString(self.action).replace('%', '%%')]
+        for i, (name, kind) in enumerate(self.fields):
+            if missing & (1 << i):
+                continue
+            parts.append(',%s:%s' % (encodeString(name).replace('%', '%%'),
+                _PLACEHOLDERS[kind]))
+        parts.append(',"service":%s}}' % 
+            encodeString(service).replace('%', '%%'))
+        fmt = ''.join(parts)
+        self.formats[service, missing] = fmt
+        return fmt
@@ -67,6 +67,16 @@ class BasePageController(object):
         cmd.update(kwargs)
         self.observer.pushResponse(self.id, cmd)
 
+    def pushTemplate(self, template, *values):
+        '''
+        Sends a fixed-shape response to the observer without building a
+        dictionary for it.
+
+        @param template codec.ResponseTemplate instance
+        @param values Field values in template order
+        '''
+        self.observer.pushTemplate(self.id, template, values)
+
     def _onStart(self, cmd):
         '''
         Handles the start of this service.
@@ -0,0 +1,298 @@
+'''
+Event loop for service processes.
+
+Copyright (c) 2008, 2009 Carolina Computer Assistive Technology
+
+Permission to use, copy, modify, and distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+import asyncore
+import errno
+import fcntl
+import heapq
+import os
+import select
+import threading
+import time
+
+# poll(2) event bits, shared by epoll
+READ = 0x001
+PRIORITY = 0x002
+WRITE = 0x004
+HANGUP = 0x008 | 0x010 | 0x020
+
+class Timer(object):
+    '''
+    @ivar deadline Float time at which the timer fires next
+    @ivar interval Float seconds between firings, or None to fire once
+    @ivar func Callable to invoke
+    @ivar args Tuple of positional arguments for func
+    @ivar kwargs Dictionary of keyword arguments for func
+    @ivar active Boolean False once the timer is done or cancelled
+    '''
+    def __init__(self, deadline, interval, func, args, kwargs):
+        self.deadline = deadline
+        self.interval = interval
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.active = True
+
+    def cancel(self):
+        '''Keeps the timer from firing again.'''
+        self.active = False
+
+class Reactor(object):
+    '''
+    Sleeps until an asyncore socket, a watched file descriptor, or a timer is
+    ready, then handles everything that is. Uses epoll where the platform
+    has it and select elsewhere. Timers and readers belong to the main loop;
+    only wake() may be called from other threads.
+
+    @ivar map Dictionary asyncore socket map to serve
+    @ivar timers Array heap of (deadline, sequence, Timer) tuples
+    @ivar sequence Integer count of timers pushed, to keep the heap stable
+    @ivar readers Dictionary mapping file descriptors to read callbacks
+    @ivar poller epoll object, or None when falling back to select
+    @ivar registered Dictionary mapping file descriptors to epoll masks
+    @ivar signaled Boolean True while a wake is waiting in the pipe
+    @ivar wake_lock threading.Lock keeping signaled in step with the pipe
+    '''
+    def __init__(self, map=None):
+        if map is None:
+            map = asyncore.socket_map
+        self.map = map
+        self.timers = []
+        self.sequence = 0
+        self.readers = {}
+        self.registered = {}
+        self.signaled = False
+        self.wake_lock = threading.Lock()
+        # pipe to ourselves so other threads can cut a wait short
+        self.wake_in, self.wake_out = os.pipe()
+        for fd in (self.wake_in, self.wake_out):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        try:
+            self.poller = select.epoll()
+        except AttributeError:
+            self.poller = None
+
+    def callLater(self, delay, func, *args, **kwargs):
+        '''
+        Invokes a function once after a delay.
+
+        @param delay Float seconds to wait
+        @param func Callable to invoke
+        @return Timer instance
+        '''
+        timer = Timer(time.time() + delay, None, func, args, kwargs)
+        self._pushTimer(timer)
+        return timer
+
+    def callEvery(self, interval, func, *args, **kwargs):
+        '''
+        Invokes a function repeatedly until the timer is cancelled or the
+        function returns False.
+
+        @param interval Float seconds between invocations
+        @param func Callable to invoke
+        @return Timer instance
+        '''
+        timer = Timer(time.time() + interval, interval, func, args, kwargs)
+        self._pushTimer(timer)
+        return timer
+
+    def addReader(self, fd, func):
+        '''
+        Invokes a function whenever a file descriptor is readable.
+
+        @param fd Integer file descriptor
+        @param func Callable taking no arguments
+        '''
+        self.readers[fd] = func
+
+    def removeReader(self, fd):
+        '''
+        Stops watching a file descriptor.
+
+        @param fd Integer file descriptor
+        '''
+        self.readers.pop(fd, None)
+
+    def wake(self):
+        '''Ends the current or next wait immediately. Safe from any thread.'''
+        self.wake_lock.acquire()
+        try:
+            if self.signaled:
+                return
+            self.signaled = True
+            try:
+                os.write(self.wake_out, 'x')
+            except OSError:
+                # pipe is full, so a wake is already pending
+                pass
+        finally:
+            self.wake_lock.release()
+
+    def iterate(self):
+        '''
+        Waits for the next event, then handles every ready socket, reader,
+        and timer.
+
+        @return Boolean True if a socket, reader, or wake was ready, False if
+            only timers fired
+        '''
+        timeout = self._getTimeout()
+        if self.poller is None:
+            events = self._select(timeout)
+        else:
+            events = self._epoll(timeout)
+        for fd, flags in events:
+            if fd == self.wake_in:
+                self._drainWake()
+            elif fd in self.readers:
+                self.readers[fd]()
+            else:
+                obj = self.map.get(fd)
+                if obj is not None:
+                    self._dispatch(fd, obj, flags)
+        self._runTimers()
+        return len(events) > 0
+
+    def close(self):
+        '''Releases the wake pipe and poller.'''
+        os.close(self.wake_in)
+        os.close(self.wake_out)
+        if self.poller is not None:
+            self.poller.close()
+
+    def _pushTimer(self, timer):
+        self.sequence += 1
+        heapq.heappush(self.timers, (timer.deadline, self.sequence, timer))
+
+    def _getTimeout(self):
+        # drop cancelled timers so they don't cut the wait short
+        while self.timers and not self.timers[0][2].active:
+            heapq.heappop(self.timers)
+        if not self.timers:
+            return None
+        return max(0.0, self.timers[0][0] - time.time())
+
+    def _runTimers(self):
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            timer = heapq.heappop(self.timers)[2]
+            if not timer.active:
+                continue
+            rv = timer.func(*timer.args, **timer.kwargs)
+            if timer.interval is None or rv is False:
+                timer.active = False
+            elif timer.active:
+                timer.deadline += timer.interval
+                if timer.deadline <= now:
+                    # hold the cadence, but don't burst to catch up after a
+                    # stall
+                    timer.deadline = now + timer.interval
+                self._pushTimer(timer)
+
+    def _drainWake(self):
+        # empty the pipe and clear the flag as one step, so a wake from 
+        # another thread lands either before the drain or after it
+        self.wake_lock.acquire()
+        try:
+            try:
+                while os.read(self.wake_in, 512):
+                    pass
+            except OSError:
+                # EAGAIN once empty
+                pass
+            self.signaled = False
+        finally:
+            self.wake_lock.release()
+
+    def _getInterest(self):
+        # same interest rules as asyncore.poll2
+        interest = {self.wake_in : READ}
+        for fd in self.readers:
+            interest[fd] = READ
+        for fd, obj in self.map.items():
+            flags = 0
+            if obj.readable():
+                flags |= READ | PRIORITY
+            if obj.writable() and not obj.accepting:
+                flags |= WRITE
+            if flags:
+                interest[fd] = flags | HANGUP
+        return interest
+
+    def _epoll(self, timeout):
+        interest = self._getInterest()
+        for fd in self.registered.keys():
+            if fd not in interest:
+                del self.registered[fd]
+                try:
+                    self.poller.unregister(fd)
+                except (IOError, OSError, ValueError):
+                    # closed descriptors leave epoll on their own
+                    pass
+        for fd, flags in interest.iteritems():
+            if self.registered.get(fd) == flags:
+                continue
+            try:
+                self.poller.modify(fd, flags)
+            except IOError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+                self.poller.register(fd, flags)
+            self.registered[fd] = flags
+        if timeout is None:
+            timeout = -1
+        try:
+            return self.poller.poll(timeout)
+        except IOError, e:
+            if e.errno != errno.EINTR:
+                raise
+            return []
+
+    def _select(self, timeout):
+        interest = self._getInterest()
+        r = [fd for fd, flags in interest.iteritems() if flags & READ]
+        w = [fd for fd, flags in interest.iteritems() if flags & WRITE]
+        e = [fd for fd, flags in interest.iteritems() if flags & PRIORITY]
+        try:
+            r, w, e = select.select(r, w, e, timeout)
+        except select.error, err:
+            if err.args[0] != errno.EINTR:
+                raise
+            return []
+        events = {}
+        for fds, flag in ((r, READ), (w, WRITE), (e, PRIORITY)):
+            for fd in fds:
+                events[fd] = events.get(fd, 0) | flag
+        return events.items()
+
+    def _dispatch(self, fd, obj, flags):
+        try:
+            if flags & READ:
+                obj.handle_read_event()
+            if flags & WRITE:
+                obj.handle_write_event()
+            if flags & PRIORITY:
+                obj.handle_expt_event()
+            # a read may already have noticed the hangup and closed
+            if flags & HANGUP and self.map.get(fd) is obj:
+                obj.handle_close()
+        except (KeyboardInterrupt, SystemExit, asyncore.ExitNow):
+            raise
+        except:
+            obj.handle_error()
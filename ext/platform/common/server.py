@@ -17,17 +17,131 @@ OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 '''
 import asynchat
 import asyncore
+import errno
 import socket
+import struct
 
 DELIMITER = '\3'
+# initial receive buffer size; doubles when one message fills it
+RECV_BUFFER_SIZE = 64*1024
+# framing names negotiated with the browser extension
+DELIMITED_FRAMING = 'delimited'
+LENGTH_FRAMING = 'length'
+# length prefixed frame header: bytes of JSON, bytes of binary attachment
+FRAME_HEADER = struct.Struct('!II')
 
-class JSONServer(asynchat.async_chat, object):
-    def __init__(self, port):
-        asynchat.async_chat.__init__(self)
+class JSONFraming(object):
+    '''
+    Splits received bytes into messages and frames outgoing ones. Both
+    directions start with messages ended by DELIMITER. Either direction may
+    switch to length prefixed frames, a FRAME_HEADER followed by the JSON
+    and an optional binary attachment, whose boundaries are found without
+    scanning. Received messages are sliced out of one reusable bytearray.
+
+    @ivar in_buff bytearray receive buffer
+    @ivar in_len Integer bytes of in_buff holding received data
+    @ivar in_scan Integer bytes at the front of in_buff known to hold no 
+        delimiter
+    @cvar framings Tuple of supported framing names
+    @ivar in_framing String framing of received messages
+    @ivar out_framing String framing of sent messages
+    '''
+    framings = (DELIMITED_FRAMING, LENGTH_FRAMING)
+
+    def _initializeFraming(self):
+        self.in_buff = bytearray(RECV_BUFFER_SIZE)
+        self.in_len = 0
+        self.in_scan = 0
+        self.in_framing = DELIMITED_FRAMING
+        self.out_framing = DELIMITED_FRAMING
+
+    def setFraming(self, incoming=None, outgoing=None):
+        '''
+        Switches the framing of one or both directions. Takes effect with 
+        the next message received or sent.
+
+        @param incoming String framing of received messages or None to keep
+        @param outgoing String framing of sent messages or None to keep
+        '''
+        for framing in (incoming, outgoing):
+            if framing is not None and framing not in self.framings:
+                raise ValueError('unknown framing: %s' % framing)
+        if incoming is not None:
+            self.in_framing = incoming
+        if outgoing is not None:
+            self.out_framing = outgoing
+
+    def _frameMessage(self, msg, data=None):
+        if self.out_framing == LENGTH_FRAMING:
+            data = data or ''
+            return FRAME_HEADER.pack(len(msg), len(data)) + msg + data
+        if data:
+            raise ValueError('attachments require length framing')
+        # add delimiter to message
+        return msg + DELIMITER
+
+    def _getReadBuffer(self):
+        if self.in_len == len(self.in_buff):
+            # a single message fills the buffer
+            self.in_buff.extend(bytearray(len(self.in_buff)))
+        return memoryview(self.in_buff)[self.in_len:]
+
+    def _dispatchFrames(self):
+        # dispatch every complete message; only the bytes handed to the 
+        # observer are copied
+        view = memoryview(self.in_buff)
+        start = 0
+        while True:
+            if self.in_framing == LENGTH_FRAMING:
+                if self.in_len - start < FRAME_HEADER.size:
+                    break
+                size, extra = FRAME_HEADER.unpack_from(self.in_buff, start)
+                begin = start + FRAME_HEADER.size
+                end = begin + size
+                if self.in_len < end + extra:
+                    break
+                msg = view[begin:end].tobytes()
+                data = view[end:end+extra].tobytes()
+                start = end + extra
+            else:
+                end = self.in_buff.find(DELIMITER, max(start, self.in_scan),
+                    self.in_len)
+                if end < 0:
+                    break
+                msg = view[start:end].tobytes()
+                data = None
+                start = end + 1
+            # the observer may switch framing before the next message
+            if data:
+                self.observer.pushRequest(msg, data)
+            else:
+                self.observer.pushRequest(msg)
+        del view
+
+        # move any partial message to the front for the next read
+        remain = self.in_len - start
+        if start and remain:
+            self.in_buff[:remain] = self.in_buff[start:self.in_len]
+        self.in_len = remain
+        if self.in_framing == DELIMITED_FRAMING:
+            self.in_scan = remain
+        else:
+            self.in_scan = 0
+
+class JSONServer(asynchat.async_chat, JSONFraming):
+    '''
+    Sends with asynchat, but receives into one reusable bytearray and
+    splits messages out of it in place rather than letting asynchat collect
+    and join string fragments.
+    '''
+    def __init__(self, port, sock=None):
+        # serves an already connected socket when given one
+        asynchat.async_chat.__init__(self, sock)
         self.observer = None
-        self.in_buff = []
-        self.set_terminator(DELIMITER)
+        self._initializeFraming()
         self.port = port
+        # whether the observer wants flushResponses called this tick
+        self.flush_requested = False
 
     def doConnect(self):
         self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -36,9 +150,23 @@ class JSONServer(asynchat.async_chat, object):
     def setObserver(self, ob):
         self.observer = ob
 
-    def sendMessage(self, msg):
-        # add delimiter to message
-        self.push(msg+DELIMITER)
+    def sendMessage(self, msg, data=None):
+        self.push(self._frameMessage(msg, data))
+
+    def requestFlush(self):
+        '''
+        Asks for the observer's flushResponses to be called once the current
+        main loop tick finishes, before the loop waits again.
+        '''
+        self.flush_requested = True
+
+    def writable(self):
+        # asyncore asks every channel this right before waiting, making it
+        # the end of the tick
+        if self.flush_requested:
+            self.flush_requested = False
+            self.observer.flushResponses()
+        return asynchat.async_chat.writable(self)
 
     def handle_connect(self):
         pass
@@ -60,10 +188,64 @@ class JSONServer(asynchat.async_chat, object):
         self.close()
         self.observer.shutdown()
 
+    def handle_read(self):
+        try:
+            count = self.socket.recv_into(self._getReadBuffer())
+        except socket.error, e:
+            if e.args[0] in (errno.EWOULDBLOCK, errno.EAGAIN, errno.EINTR):
+                return
+            if e.args[0] in asyncore._DISCONNECTED:
+                self.handle_close()
+                return
+            raise
+        if not count:
+            # peer closed the connection
+            self.handle_close()
+            return
+        self.in_len += count
+        self._dispatchFrames()
+
+class HandoffListener(asyncore.dispatcher):
+    '''
+    Listens on a well known port for newly launched Outfox processes that
+    want a running daemon to serve their browser windows. Each sends one 
+    delimited JSON message and gets one delimited JSON reply from the 
+    observer's pushHandoff.
+    '''
+    def __init__(self, port):
+        asyncore.dispatcher.__init__(self)
+        self.observer = None
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        try:
+            self.bind(('127.0.0.1', port))
+            self.listen(5)
+        except socket.error:
+            self.close()
+            raise
+
+    def setObserver(self, ob):
+        self.observer = ob
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            HandoffChannel(pair[0], self.observer)
+
+class HandoffChannel(asynchat.async_chat):
+    '''
+    Reads one handoff request, sends the reply, and closes.
+    '''
+    def __init__(self, sock, observer):
+        asynchat.async_chat.__init__(self, sock)
+        self.observer = observer
+        self.in_data = []
+        self.set_terminator(DELIMITER)
+
     def collect_incoming_data(self, data):
-        self.in_buff.append(data)
+        self.in_data.append(data)
 
     def found_terminator(self):
-        msg = ''.join(self.in_buff)
-        self.in_buff = []
-        self.observer.pushRequest(msg)
+        reply = self.observer.pushHandoff(''.join(self.in_data))
+        self.push(reply + DELIMITER)
+        self.close_when_done()
@@ -0,0 +1,293 @@
+'''
+Pool of worker processes running pages for a front Outfox process.
+
+Copyright (c) 2008, 2009 Carolina Computer Assistive Technology
+
+Permission to use, copy, modify, and distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+import asyncore
+import socket
+import subprocess
+import sys
+import codec
+from server import JSONServer, LENGTH_FRAMING
+
+# seconds a worker has to connect back before its pages are failed
+CONNECT_TIMEOUT = 10.0
+
+class Shard(object):
+    '''
+    One worker process. Observes the JSON server connected to it.
+
+    @ivar pool ShardPool instance owning the shard
+    @ivar process subprocess.Popen instance for the worker
+    @ivar server JSONServer connected to the worker, or None until it 
+        connects
+    @ivar pending List of (msg, data) tuples to send once the worker connects
+    '''
+    def __init__(self, pool, process):
+        self.pool = pool
+        self.process = process
+        self.server = None
+        self.pending = []
+
+    def setServer(self, server):
+        self.server = server
+        server.setObserver(self)
+        # both ends are ours, so skip negotiating framing
+        server.setFraming(LENGTH_FRAMING, LENGTH_FRAMING)
+        for msg, data in self.pending:
+            server.sendMessage(msg, data)
+        self.pending = []
+
+    def sendMessage(self, msg, data=None):
+        if self.server is None:
+            self.pending.append((msg, data))
+        else:
+            self.server.sendMessage(msg, data)
+
+    def pushRequest(self, json, data=None):
+        # a response from the worker
+        self.pool.pushResponse(self, json, data)
+
+    def flushResponses(self):
+        # the pool never asks the worker connection to batch
+        pass
+
+    def shutdown(self):
+        # the worker went away with its pages
+        self.server = None
+        self.pool.removeShard(self)
+
+    def close(self):
+        if self.server is not None:
+            # the worker quits when its connection closes
+            self.server.close()
+            self.server = None
+
+class ShardPage(object):
+    '''
+    One page running in a worker.
+
+    @ivar client Client instance the page belongs to
+    @ivar page_id Page ID assigned by the browser window
+    @ivar shard Shard instance running the page
+    @ivar services Set of service names the page has asked for and not yet
+        seen stop
+    @ivar started Set of service names the worker reported started
+    '''
+    def __init__(self, client, page_id, shard):
+        self.client = client
+        self.page_id = page_id
+        self.shard = shard
+        self.services = set()
+        self.started = set()
+
+    def fail(self, description):
+        # tell the page every service it uses is gone
+        for name in self.services:
+            self.client.pushResponse(self.page_id, {'action' : 
+                'failed-service', 'description' : description}, None, name)
+
+class ShardPool(asyncore.dispatcher):
+    '''
+    Runs the pages of a front Outfox process in worker processes. Each page
+    is assigned to one worker for its lifetime, round robin by arrival, and
+    given an ID unique across all of the front's clients. Workers are 
+    ordinary Outfox processes connecting back to the pool like a browser
+    window would. Their responses are mapped back to the client and page ID
+    they belong to and sent over the client's connection. A page is 
+    forgotten once all its services stop, and new pages skip workers that
+    quit or never connect.
+
+    @ivar observer Outfox instance owning the pool
+    @ivar shards List of Shard instances for live workers
+    @ivar ids Dictionary mapping (client, page ID) to worker page IDs
+    @ivar pages Dictionary mapping worker page IDs to ShardPage instances
+    @ivar next_id Integer next worker page ID to assign
+    '''
+    def __init__(self, observer, count):
+        asyncore.dispatcher.__init__(self)
+        self.observer = observer
+        self.shards = []
+        self.ids = {}
+        self.pages = {}
+        self.next_id = 0
+        # listen for workers on any free local port
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.bind(('127.0.0.1', 0))
+        self.listen(count)
+        port = self.socket.getsockname()[1]
+        # workers host the same services as the front
+        services = [name for name, module in observer.modules]
+        script = sys.argv[0]
+        for i in xrange(count):
+            args = [sys.executable, script, str(port), '--worker'] + services
+            self.shards.append(Shard(self, subprocess.Popen(args)))
+
+    def start(self, reactor):
+        '''
+        Gives up on workers that don't connect in time.
+
+        @param reactor Reactor running the front process
+        '''
+        reactor.callLater(CONNECT_TIMEOUT, self._checkConnected)
+
+    def _checkConnected(self):
+        for shard in list(self.shards):
+            if shard.server is None:
+                # never connected; don't leave its pages waiting
+                shard.pending = []
+                if shard.process.poll() is None:
+                    shard.process.kill()
+                self.removeShard(shard)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is None:
+            return
+        # workers are interchangeable until they have pages, so give the 
+        # connection to the first shard still waiting for one
+        for shard in self.shards:
+            if shard.server is None:
+                shard.setServer(JSONServer(None, pair[0]))
+                return
+        pair[0].close()
+
+    def route(self, client, page_id, cmd):
+        '''
+        Sends a command to the worker running the page.
+
+        @param client Client instance the page belongs to
+        @param page_id Page ID assigned by the browser window
+        @param cmd Dictionary command
+        '''
+        key = (client, page_id)
+        try:
+            wid = self.ids[key]
+        except KeyError:
+            if not self.shards:
+                # every worker quit
+                client.pushResponse(page_id, {'action' : 'failed-service',
+                    'description' : 'Worker process quit.'}, None, 
+                    cmd.get('service'))
+                return
+            wid = self.next_id
+            self.next_id += 1
+            self.ids[key] = wid
+            self.pages[wid] = ShardPage(client, page_id, 
+                self.shards[wid % len(self.shards)])
+        page = self.pages[wid]
+        page.services.add(cmd.get('service'))
+        data = cmd.pop('attachment', None)
+        msg = codec.dumps({'page_id' : wid, 'cmd' : cmd})
+        page.shard.sendMessage(msg, data)
+
+    def pushResponse(self, shard, json, data=None):
+        '''
+        Forwards responses from a worker to the clients they belong to.
+
+        @param shard Shard instance for the worker
+        @param json JSON encoded envelope or list of envelopes
+        @param data Binary attachment or None
+        '''
+        try:
+            dec = codec.loads(json)
+        except Exception:
+            return
+        if not isinstance(dec, list):
+            dec = [dec]
+        for env in dec:
+            try:
+                wid = env['page_id']
+                cmd = env['cmd']
+            except (KeyError, TypeError):
+                continue
+            service = cmd.get('service')
+            if wid == '*':
+                # the worker failed for all of its pages using the service
+                for wid, page in self.pages.items():
+                    if page.shard is shard and service in page.services:
+                        page.client.pushResponse(page.page_id, dict(cmd), 
+                            data, service)
+                        # the page gives up on the service, so the worker 
+                        # should too
+                        self._stopWorkerPage(wid, page, service)
+                        self._stopService(wid, service)
+                continue
+            try:
+                page = self.pages[wid]
+            except KeyError:
+                # page of a client that went away
+                continue
+            page.client.pushResponse(page.page_id, cmd, data, service)
+            action = cmd.get('action')
+            if action == 'started-service':
+                page.started.add(service)
+            elif action == 'stopped-service' or (action == 'failed-service'
+                and service not in page.started):
+                # stopped, or never got going; a failed repeat start leaves
+                # the running service alone
+                self._stopService(wid, service)
+
+    def _stopWorkerPage(self, wid, page, service):
+        msg = codec.dumps({'page_id' : wid, 
+            'cmd' : {'action' : 'stop-service', 'service' : service}})
+        page.shard.sendMessage(msg)
+
+    def _stopService(self, wid, service):
+        page = self.pages[wid]
+        page.services.discard(service)
+        page.started.discard(service)
+        if not page.services:
+            self._dropPage(wid)
+
+    def _dropPage(self, wid):
+        page = self.pages.pop(wid)
+        del self.ids[page.client, page.page_id]
+
+    def removeClient(self, client):
+        '''
+        Stops the worker pages of a disconnected client.
+
+        @param client Client instance
+        '''
+        for wid, page in self.pages.items():
+            if page.client is not client:
+                continue
+            self._dropPage(wid)
+            for name in page.services:
+                self._stopWorkerPage(wid, page, name)
+
+    def removeShard(self, shard):
+        '''
+        Tells the pages a worker ran that their services failed when it 
+        quits on its own, since the pages are gone, and sends new pages to
+        the other workers.
+
+        @param shard Shard instance
+        '''
+        if shard not in self.shards:
+            return
+        self.shards.remove(shard)
+        shard.process.poll()
+        for wid, page in self.pages.items():
+            if page.shard is shard:
+                self._dropPage(wid)
+                page.fail('Worker process quit.')
+
+    def close(self):
+        asyncore.dispatcher.close(self)
+        for shard in self.shards:
+            shard.close()
+        self.shards = []
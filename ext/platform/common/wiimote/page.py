@@ -25,6 +25,11 @@ import sys
 print 'in wiimote page.py'
 
 from ..page import BasePageController
+from ..codec import ResponseTemplate
+
+# sent up to every report period while accelerometer reports are on
+ACCEL_REPORT = ResponseTemplate('accel-report', [('t', 'number'), 
+    ('id', 'string'), ('accel', 'json'), ('nunchuck_accel', 'json')])
                 
 class WiimoteDriver(object):
     def __init__(self, addr):
@@ -61,8 +66,7 @@ class WiimoteDriver(object):
                     nacc = self.wiimote.extensionState.Accel
                 else:
                     nacc = []
-                self.postEvent('accel-report', t=t, id=self.addr, accel=wacc,
-                               nunchuck_accel=nacc)
+                self.postTemplate(ACCEL_REPORT, t, self.addr, wacc, nacc)
 
     def addPage(self, page):
         if page not in self.pages:
@@ -77,6 +81,10 @@ class WiimoteDriver(object):
         for page in self.pages:
             page.postEvent(event, **values)
 
+    def postTemplate(self, template, *values):
+        for page in self.pages:
+            page.postTemplate(template, *values)
+
     def enableAccel(self, on):
         if on:
             self.want_accel_reports += 1
@@ -93,6 +101,8 @@ class WiiManager(object):
     def __init__(self):
         self.drivers = {}
         self.motesFound = []
+        # input socket descriptors watched by a reactor, keyed by address
+        self.watched = {}
 
     def pageConnect(self, page, address):
         if address in self.drivers:
@@ -134,6 +144,19 @@ class WiiManager(object):
         for driver in self.drivers.itervalues():
             driver.step()
 
+    def watch(self, reactor):
+        for address, driver in self.drivers.iteritems():
+            fd = self.watched.get(address)
+            if not driver.wiimote.connected:
+                # socket is closed; stop waiting on it
+                if fd is not None:
+                    reactor.removeReader(fd)
+                    del self.watched[address]
+            elif fd is None:
+                fd = driver.wiimote.isocket.fileno()
+                reactor.addReader(fd, driver.step)
+                self.watched[address] = fd
+
     def removePage(self, page):
         for driver in self.drivers.itervalues():
             driver.removePage(page)
@@ -152,6 +175,13 @@ def PollPages():
     # so I can see my debugging prints
     sys.stdout.flush()
 
+def WatchPages(reactor):
+    '''Steps each wiimote from the reactor when its input has data.'''
+    Manager.watch(reactor)
+
+    # so I can see my debugging prints
+    sys.stdout.flush()
+
 class PageController(BasePageController):
     def __init__(self, page_id, module):
         BasePageController.__init__(self, page_id, module)
@@ -200,5 +230,11 @@ class PageController(BasePageController):
         else:
             print 'skipped', event
 
+    def postTemplate(self, template, *values):
+        if self.events_to_send.get(template.action, False):
+            self.pushTemplate(template, *values)
+        else:
+            print 'skipped', template.action
+
                     
     
@@ -15,4 +15,52 @@ WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
 ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 '''
-# nothing to do except exist ...
+from common.aioserver import LoopReactor
+from common.reactor import Reactor
+from common.server import HandoffListener
+from common.shards import ShardPool
+
+def buildReactor(module):
+    if module.USE_ASYNCIO:
+        return LoopReactor()
+    return Reactor()
+
+def buildListener(modules, port):
+    return HandoffListener(port)
+
+def buildPool(modules, outfox, count):
+    return ShardPool(outfox, count)
+
+def runFront(modules, pool):
+    '''
+    Runs the json servers of a front process whose pages run in worker
+    processes. The modules are loaded but never started. The loop ends when
+    any module shuts down.
+
+    @param modules List of service modules
+    @param pool ShardPool running the pages
+    '''
+    reactor = buildReactor(modules[0])
+    pool.start(reactor)
+    while all(module.RUNNING for module in modules):
+        reactor.iterate()
+    reactor.close()
+
+def runHost(modules):
+    '''
+    Runs one or more service modules on a shared main loop. Each module 
+    provides start(module, reactor), step(module, reactor, woken), and 
+    stop(module) hooks. The loop ends when any module shuts down.
+
+    @param modules List of service modules; the first picks the reactor
+    '''
+    reactor = buildReactor(modules[0])
+    for module in modules:
+        module.start(module, reactor)
+    while all(module.RUNNING for module in modules):
+        woken = reactor.iterate()
+        for module in modules:
+            module.step(module, reactor, woken)
+    for module in modules:
+        module.stop(module)
+    reactor.close()
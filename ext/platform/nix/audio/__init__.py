@@ -16,25 +16,48 @@ ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 '''
 from common.server import JSONServer
+from common.aioserver import AsyncJSONServer
 from common.audio.channel import ChannelBase
 from common.audio.page import PageController
+from common.audio.synthworker import SynthesisWorker
+from common.audio.synthpool import SynthesisPool
+from common.audio.uttercache import UtteranceCache
+from common.audio.soundcache import SoundCache
+from common.audio.utterstore import UtteranceStore
+from nix import runHost
 import channel
-import asyncore
+import multiprocessing
 import os
 from ctypes import *
 
 # audio specific resources
 FMOD_MODULE = None
 FMOD_SYSTEM = c_void_p()
+SYNTH_WORKER = None
+UTTERANCE_CACHE = None
+SOUND_CACHE = None
+# repeating mixer update timer while output is active
+FMOD_UPDATER = None
+UTTERANCE_STORE_PATH = os.path.expanduser('~/.outfox/speech')
 RUNNING = True
+# serve the extension on an asyncio loop instead of asyncore
+USE_ASYNCIO = False
 
 FMOD_OUTPUTTYPE_ALSA = 13
+# seconds between mixer updates while anything is playing
+FMOD_UPDATE_PERIOD = 0.02
+# processes synthesizing speech in parallel, each with its own espeak; 1 
+# synthesizes on a thread in this process instead
+SYNTH_PROCESSES = min(multiprocessing.cpu_count(), 4)
 
 def buildChannel(module, ch_id):
-    return channel.ChannelController(ch_id, FMOD_MODULE, FMOD_SYSTEM)
+    return channel.ChannelController(ch_id, FMOD_MODULE, FMOD_SYSTEM, 
+        SYNTH_WORKER, UTTERANCE_CACHE, SOUND_CACHE)
     
 # common service functions
 def buildServer(module, port):
+    if module.USE_ASYNCIO:
+        return AsyncJSONServer(port)
     return JSONServer(port)
 
 def buildPage(module, page_id):
@@ -43,7 +66,32 @@ def buildPage(module, page_id):
 def shutdown(module):
     module.RUNNING = False
 
-def run(module):
+def _updateFMOD(fmod):
+    try:
+        # poll FMOD
+        fmod.FMOD_System_Update(FMOD_SYSTEM)
+    except Exception:
+        pass
+    # keep updating while channels play; callbacks only fire during updates
+    count = c_int()
+    fmod.FMOD_System_GetChannelsPlaying(FMOD_SYSTEM, byref(count))
+    return count.value > 0 or bool(ChannelBase.toProcess)
+
+def _buildSynthWorker(module):
+    if module.SYNTH_PROCESSES > 1:
+        try:
+            return SynthesisPool(channel.synthesize, module.SYNTH_PROCESSES)
+        except (OSError, ImportError):
+            # no processes to spare; synthesize on a thread instead
+            pass
+    return SynthesisWorker()
+
+def start(module, reactor):
+    # synthesize speech off the main loop; pool processes fork before FMOD
+    # starts its threads
+    module.SYNTH_WORKER = _buildSynthWorker(module)
+    # ready espeak before any worker holds it, so channels never wait
+    channel.ENGINE.initialize()
     # load the FMOD dynamic lib
     lib = os.path.join(os.path.dirname(__file__), 'libfmodex-4.22.02.so')
     fmod = cdll.LoadLibrary(lib)
@@ -56,18 +104,36 @@ def run(module):
         raise RuntimeError
     # store FMOD globally for channels
     module.FMOD_MODULE = fmod
-    
-    # main event loop polls json server and FMOD
-    while module.RUNNING:
-        # poll asyncore
-        asyncore.poll(0.05)
-        try:
-            # poll FMOD
-            fmod.FMOD_System_Update(FMOD_SYSTEM)
-        except Exception:
-            pass
-        # pump channels that are idle
-        ChannelBase.processPending()
+    module.SYNTH_WORKER.start()
+    # keep synthesized speech across service restarts when possible
+    try:
+        store = UtteranceStore(UTTERANCE_STORE_PATH)
+    except EnvironmentError:
+        store = None
+    module.UTTERANCE_CACHE = UtteranceCache(store=store)
+    # decoded sounds are shared by every channel on every page
+    module.SOUND_CACHE = SoundCache(fmod)
+    # main event loop sleeps until the json server, a channel, or the mixer
+    # has work to do
+    ChannelBase.reactor = reactor
+
+def step(module, reactor, woken):
+    # pump channels that are idle
+    ChannelBase.processPending()
+    updater = module.FMOD_UPDATER
+    if woken and (updater is None or not updater.active):
+        # a command or result may have started output; service the mixer 
+        # until it goes quiet
+        module.FMOD_UPDATER = reactor.callEvery(FMOD_UPDATE_PERIOD, 
+            _updateFMOD, module.FMOD_MODULE)
+        _updateFMOD(module.FMOD_MODULE)
 
+def stop(module):
     # cleanup
-    fmod.FMOD_System_Release(FMOD_SYSTEM)
+    ChannelBase.reactor = None
+    module.FMOD_UPDATER = None
+    module.SYNTH_WORKER.shutdown()
+    module.FMOD_MODULE.FMOD_System_Release(FMOD_SYSTEM)
+
+def run(module):
+    runHost([module])
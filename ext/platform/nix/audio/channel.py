@@ -17,21 +17,28 @@ OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 '''
 import ctypes
 import espeak
+from engine import ENGINE
+from events import decodeWords
 from common.audio.utterance import Utterance
 from common.audio.fmodspeech import FMODSpeechBase
+from common.audio.fmodstream import SpeechStream
+
+# average characters per spoken word, for sizing sample buffers up front
+CHARS_PER_WORD = 6
 
 class ChannelController(FMODSpeechBase):
-    def __init__(self, ch_id, fmod, fsys):
+    engine = 'espeak'
+    # play speech as espeak produces it when synthesizing on a worker
+    streaming = True
+
+    def __init__(self, ch_id, fmod, fsys, worker=None, utterances=None,
+    sounds=None):
         self.tts = espeak
-        # init speech synth
-        self.sampling_rate = self.tts.Initialize(espeak.AUDIO_OUTPUT_SYNCHRONOUS, 500)
-        # get default voice
-        self.default_voice = self.tts.GetCurrentVoice().contents.name
+        # espeak initializes once for all channels
+        self.sampling_rate, self.default_voice = ENGINE.initialize()
         # initialize base class after default voice is known
-        FMODSpeechBase.__init__(self, ch_id, fmod, fsys)
-        # set tts defaults
-        self.tts.SetVoiceByName(self.default_voice)
-        self.tts.SetParameter(self.tts.RATE, self.config['rate'])
+        FMODSpeechBase.__init__(self, ch_id, fmod, fsys, worker, utterances,
+            sounds)
     
     def _initializeConfig(self):
         FMODSpeechBase._initializeConfig(self)
@@ -41,55 +48,82 @@ class ChannelController(FMODSpeechBase):
         FMODSpeechBase.shutdown(self, cmd)
         self.tts = None
 
-    def reset(self, cmd):
-        FMODSpeechBase.reset(self, cmd)
-        self.tts.SetVoiceByName(self.default_voice)
-        self.tts.SetParameter(self.tts.RATE, self.config['rate'])
-
     def _getVoices(self):
         FMODSpeechBase._getVoices(self)
-        return [v.name for v in self.tts.ListVoices()]
-
-    def _setRate(self, val):
-        FMODSpeechBase._setRate(self, val)
-        self.tts.SetParameter(self.tts.RATE, val)
-
-    def _setVoice(self, val):
-        FMODSpeechBase._setVoice(self, val)
-        self.tts.SetVoiceByName(val)
-
-    def _synthesizeUtterance(self, text):
-        # stores bytes
-        chunks = []
-        # stores 3-tuples of text position, text length, and sample position
-        meta = []
-
-        def synth_cb(wav, numsample, events):
-            if numsample > 0:
-                # always 16 bit samples
-                chunk = ctypes.string_at(wav, numsample*2)
-                chunks.append(chunk)
-            # store all events for later processing
-            i = 0
-            while True:
-                event = events[i]
-                if event.type == self.tts.EVENT_LIST_TERMINATED:
-                    break
-                elif event.type == self.tts.EVENT_WORD and event.length > 0:
-                    # ignore zero length words
-                    # position seems to be 1 based, not 0
-                    meta.append((event.text_position-1, event.length, event.sample))
-                i += 1
-            return 0
-
-        # register the callback and do the synthesis
-        self.tts.SetSynthCallback(synth_cb)
-        self.tts.Synth(text, flags=espeak.ENDPAUSE|espeak.CHARS_WCHAR)
-
-        #if len(meta) == 0:
-        #    # return an empty utterance if we didn't synth any words
-        #    return Utterance(text)
-
-        # populate an utterance object
-        samples = ''.join(chunks)
-        return Utterance(text, samples, self.sampling_rate, 16, 1, meta)
\ No newline at end of file
+        return ENGINE.getVoices()
+
+    def _createStream(self, text):
+        if not self.streaming:
+            return None
+        return SpeechStream(self, text, self.sampling_rate, 16, 1)
+
+    def _synthesizeUtterance(self, text, token=None):
+        return self._streamUtterance(text, None, token)
+
+    def _streamUtterance(self, text, stream, token=None):
+        # voice and rate are applied at synthesis time, not when set, because
+        # espeak is shared by all channels and may be busy in the worker; 
+        # the engine skips them when they are already in effect. a job 
+        # carries the profile it was keyed with
+        if token is None:
+            profile = self._getSynthesisProfile()
+        else:
+            profile = token.profile
+        return synthesize(text, profile, stream, token)
+
+def synthesize(text, profile, stream=None, token=None):
+    '''
+    Synthesizes text with the espeak engine of this process. Used by
+    channels and by synthesis pool processes.
+
+    @param text Unicode text to speak
+    @param profile Tuple of voice name and rate
+    @param stream Object taking samples with write() and words with 
+        addWord() as they are produced, or None
+    @param token Object whose cancelled attribute turns True when synthesis
+        should stop, or None
+    @return Utterance instance
+    '''
+    sampling_rate = ENGINE.initialize()[0]
+    voice, rate = profile
+    # size the buffer for the whole utterance at the requested rate so
+    # espeak's samples are copied once and rarely moved
+    words = len(text) / float(CHARS_PER_WORD)
+    estimate = int(words * 60 * sampling_rate / (rate or 200)) * 2
+    samples = bytearray(estimate)
+    # bytes of samples filled so far
+    filled = [0]
+    # samples and words are gathered straight into the utterance
+    utter = Utterance(text, samples, sampling_rate, 16, 1)
+
+    def synth_cb(wav, numsample, events):
+        if token is not None and token.cancelled:
+            # abort synthesis
+            return 1
+        if numsample > 0:
+            # always 16 bit samples
+            size = numsample*2
+            start = filled[0]
+            if start + size > len(samples):
+                # ran past the estimate; double so this stays rare
+                grow = max(start + size, len(samples) * 2) - len(samples)
+                samples.extend(bytearray(grow))
+            ctypes.memmove(ctypes.addressof(ctypes.c_char.from_buffer(
+                samples, start)), wav, size)
+            filled[0] = start + size
+            if stream is not None:
+                # start playback as soon as samples are available; the view
+                # shares the utterance's samples instead of copying them
+                stream.write(buffer(samples, start, size))
+        # store all word events for later processing
+        positions, lengths, offsets = decodeWords(events)
+        utter.addWords(positions, lengths, offsets)
+        if stream is not None:
+            [stream.addWord(word) for word in zip(positions, lengths, offsets)]
+        return 0
+
+    ENGINE.synthesize(text, voice, rate, synth_cb)
+    # drop the unused end of the estimate
+    del samples[filled[0]:]
+
+    return utter
@@ -0,0 +1,123 @@
+'''
+Shared espeak engine for *nix channels.
+
+Copyright (c) 2008, 2009 Carolina Computer Assistive Technology
+
+Permission to use, copy, modify, and distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+import threading
+import espeak
+
+# milliseconds of audio espeak synthesizes per callback
+BUFFER_MS = 500
+
+class EspeakEngine(object):
+    '''
+    espeak is process wide, so all channels share one engine. Initializes
+    espeak on first use, remembers the voice and rate last applied so 
+    channels only pay for a change, and serializes access between the main
+    loop and the synthesis worker.
+
+    @ivar lock threading.Lock held around every call into espeak
+    @ivar sampling_rate Integer sampling rate in Hz, or None until 
+        initialized
+    @ivar default_voice String name of the voice espeak starts with
+    @ivar voice String name of the voice applied, or None if unknown
+    @ivar rate Integer speech rate applied, or None if unknown
+    @ivar voices List of available voice names, or None until listed
+    @ivar sink Callable receiving synthesis callbacks for the current 
+        synthesis
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sampling_rate = None
+        self.default_voice = None
+        self.voice = None
+        self.rate = None
+        self.voices = None
+        self.sink = None
+
+    def initialize(self):
+        '''
+        Initializes espeak and lists its voices if not done yet. Called at
+        service start so channels created on the main loop never wait on
+        the lock a synthesizing worker holds.
+
+        @return Tuple of (sampling rate, default voice name)
+        '''
+        if self.sampling_rate is not None:
+            # set last, so everything else is ready
+            return self.sampling_rate, self.default_voice
+        self.lock.acquire()
+        try:
+            if self.sampling_rate is None:
+                rate = espeak.Initialize(espeak.AUDIO_OUTPUT_SYNCHRONOUS,
+                    BUFFER_MS)
+                self.default_voice = espeak.GetCurrentVoice().contents.name
+                self.voice = self.default_voice
+                self.voices = [v.name for v in espeak.ListVoices()]
+                # one callback for the life of the process
+                espeak.SetSynthCallback(self._onSynth)
+                self.sampling_rate = rate
+            return self.sampling_rate, self.default_voice
+        finally:
+            self.lock.release()
+
+    def getVoices(self):
+        '''@return List of available voice names'''
+        self.initialize()
+        return self.voices
+
+    def synthesize(self, text, voice, rate, sink):
+        '''
+        Synthesizes text with a voice and rate, applying them only if they
+        differ from the last ones applied.
+
+        @param text Unicode text to speak
+        @param voice String voice name
+        @param rate Integer speech rate
+        @param sink Callable taking the wav, sample count, and events of 
+            each espeak synthesis callback and returning 0 to continue or 1
+            to abort
+        '''
+        self.lock.acquire()
+        try:
+            self._apply(voice, rate)
+            self.sink = sink
+            try:
+                espeak.Synth(text, flags=espeak.ENDPAUSE|espeak.CHARS_WCHAR)
+            finally:
+                self.sink = None
+        finally:
+            self.lock.release()
+
+    def _apply(self, voice, rate):
+        if voice != self.voice:
+            # forget the voice if espeak refused it so the next call retries
+            if espeak.SetVoiceByName(voice) == espeak.EE_OK:
+                self.voice = voice
+            else:
+                self.voice = None
+            # a new voice resets the rate
+            self.rate = None
+        if rate != self.rate:
+            espeak.SetParameter(espeak.RATE, rate)
+            self.rate = rate
+
+    def _onSynth(self, wav, numsample, events):
+        if self.sink is None:
+            return 0
+        return self.sink(wav, numsample, events)
+
+# the one engine for this process
+ENGINE = EspeakEngine()
@@ -0,0 +1,116 @@
+'''
+Decodes the word events espeak passes to its synthesis callback.
+
+Copyright (c) 2008, 2009 Carolina Computer Assistive Technology
+
+Permission to use, copy, modify, and distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+import ctypes
+import espeak
+from engine import BUFFER_MS
+try:
+    import numpy
+except ImportError:
+    # fall back to reading events one at a time
+    numpy = None
+
+# entries espeak allocates for the event list passed to the callback, per
+# espeak_Initialize; reading this far is always in bounds
+EVENT_LIST_SIZE = (BUFFER_MS * 200) / 1000 + 20
+
+# events read one at a time before switching to a vectorized pass; below
+# this the fixed cost of the NumPy pass loses to a plain loop
+VECTOR_MIN_EVENTS = 20
+
+def _buildEventType():
+    # mirror the fields of espeak.EVENT we need at their native offsets
+    names = ['type', 'text_position', 'length', 'sample']
+    return numpy.dtype({'names' : names, 
+        'formats' : [numpy.intc] * len(names),
+        'offsets' : [getattr(espeak.EVENT, name).offset for name in names],
+        'itemsize' : ctypes.sizeof(espeak.EVENT)})
+
+if numpy is not None:
+    EVENT_TYPE = _buildEventType()
+    # view of the whole event list at an address
+    EVENT_LIST = espeak.EVENT * EVENT_LIST_SIZE
+
+class EventView(object):
+    '''
+    NumPy view of the espeak event list. espeak fills the same list for
+    every callback, so the view is only rebuilt if the list moves.
+
+    @ivar address Integer address of the viewed list, or None
+    @ivar types NumPy array of event types
+    @ivar positions NumPy array of event text positions
+    @ivar lengths NumPy array of event text lengths
+    @ivar samples NumPy array of event sample offsets
+    '''
+    def __init__(self):
+        self.address = None
+
+    def decodeWords(self, events):
+        '''
+        Pulls every word out of the event list in one vectorized pass.
+
+        @param events ctypes pointer to the espeak.EVENT list
+        @return Tuple of (positions, lengths, sample offsets) lists
+        '''
+        address = ctypes.addressof(events.contents)
+        if address != self.address:
+            rows = numpy.frombuffer(EVENT_LIST.from_address(address), 
+                EVENT_TYPE)
+            self.types = rows['type']
+            self.positions = rows['text_position']
+            self.lengths = rows['length']
+            self.samples = rows['sample']
+            self.address = address
+        # entries after the terminator are left over from earlier callbacks
+        ended = self.types == espeak.EVENT_LIST_TERMINATED
+        end = ended.argmax()
+        if not ended[end]:
+            end = len(ended)
+        # ignore zero length words
+        rows = numpy.flatnonzero((self.types[:end] == espeak.EVENT_WORD) & 
+            (self.lengths[:end] > 0))
+        # position seems to be 1 based, not 0
+        return ((self.positions[rows] - 1).tolist(), 
+            self.lengths[rows].tolist(), self.samples[rows].tolist())
+
+def decodeWords(events):
+    '''
+    Reads word events one at a time, switching to one vectorized pass over
+    the whole list if it turns out long enough for NumPy to pay off.
+
+    @param events ctypes pointer to the espeak.EVENT list
+    @return Tuple of (positions, lengths, sample offsets) lists
+    '''
+    positions = []
+    lengths = []
+    offsets = []
+    i = 0
+    while VIEW is None or i < VECTOR_MIN_EVENTS:
+        event = events[i]
+        if event.type == espeak.EVENT_LIST_TERMINATED:
+            return positions, lengths, offsets
+        elif event.type == espeak.EVENT_WORD and event.length > 0:
+            # ignore zero length words
+            # position seems to be 1 based, not 0
+            positions.append(event.text_position-1)
+            lengths.append(event.length)
+            offsets.append(event.sample)
+        i += 1
+    return VIEW.decodeWords(events)
+
+# decodes long event lists in bulk when NumPy is available
+VIEW = EventView() if numpy is not None else None
@@ -16,13 +16,18 @@ ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 '''
 from common.server import JSONServer
+from common.aioserver import AsyncJSONServer
 from common.echo.page import PageController
-import asyncore
+from nix import runHost
 import os
 
 RUNNING = True
+# serve the extension on an asyncio loop instead of asyncore
+USE_ASYNCIO = False
 
 def buildServer(module, port):
+    if module.USE_ASYNCIO:
+        return AsyncJSONServer(port)
     return JSONServer(port)
 
 def buildPage(module, page_id):
@@ -31,7 +36,15 @@ def buildPage(module, page_id):
 def shutdown(module):
     module.RUNNING = False
 
+def start(module, reactor):
+    pass
+
+def step(module, reactor, woken):
+    # nothing to do between json server requests
+    pass
+
+def stop(module):
+    pass
+
 def run(module):
-    while module.RUNNING:
-        # poll asyncore
-        asyncore.poll(0.05)
\ No newline at end of file
+    runHost([module])
@@ -16,13 +16,18 @@ ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 '''
 from common.server import JSONServer
-from common.wiimote.page import PageController, PollPages
-import asyncore
+from common.aioserver import AsyncJSONServer
+from common.wiimote.page import PageController, WatchPages
+from nix import runHost
 import os
 
 RUNNING = True
+# serve the extension on an asyncio loop instead of asyncore
+USE_ASYNCIO = False
 
 def buildServer(module, port):
+    if module.USE_ASYNCIO:
+        return AsyncJSONServer(port)
     return JSONServer(port)
 
 def buildPage(module, page_id):
@@ -31,12 +36,15 @@ def buildPage(module, page_id):
 def shutdown(module):
     module.RUNNING = False
 
-def run(module):
-    while module.RUNNING:
-        # poll asyncore
-        asyncore.poll(0.005)
-        
-        # poll the wiimote
-        PollPages()
+def start(module, reactor):
+    WatchPages(reactor)
+
+def step(module, reactor, woken):
+    # wait on every connected wiimote, including any just found
+    WatchPages(reactor)
 
+def stop(module):
+    pass
 
+def run(module):
+    runHost([module])
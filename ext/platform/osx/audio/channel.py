@@ -67,7 +67,11 @@ class ChannelController(NSObject, FMODChannelBase):
             # let parent class do what it normally does for sounds
             FMODChannelBase.stop(self, cmd)
     
-    def _outputUtterance(self, utterance):
+    def _getTimeline(self, cmd, utter):
+        # words are only known as the synthesizer speaks them
+        return None
+
+    def _outputUtterance(self, utterance, timeline=False):
         self._text = utterance.text
         if not self.tts:
             # build a new synthesizer
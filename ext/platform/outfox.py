@@ -16,85 +16,183 @@ WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
 ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 '''
-import simplejson
+from common import codec
+from common.server import LENGTH_FRAMING
+import hmac
+import os
 import socket
 import sys
 
 DELIMITER = '\3'
+# well known port on which a daemon takes over browser windows from newly
+# launched Outfox processes
+DAEMON_PORT = 61733
+# seconds a newly launched process waits for a daemon to answer
+HANDOFF_TIMEOUT = 2.0
+# secret a daemon shares with processes of the same user, which must send 
+# it to hand off a window; readable only by that user
+DAEMON_KEY_PATH = os.path.expanduser('~/.outfox/daemon.key')
 
-class Outfox(object):
-    def __init__(self, port, service):
-        # map page IDs to page controllers
+class HostedService(object):
+    '''
+    One service module serving the pages of one client connection. Observes
+    the pages and tags their responses with the service name.
+
+    @ivar client Client instance the pages belong to
+    @ivar name String service name
+    @ivar module Platform service module
+    @ivar pages Dictionary mapping page IDs to page controllers
+    '''
+    def __init__(self, client, name, module):
+        self.client = client
+        self.name = name
+        self.module = module
         self.pages = {}
-        self.port = port
-        self.service = service
-        self.module = None
-        self.server = None
 
-    def run(self):
-        # locate the proper module for this platform
-        self.module = self._findModule()
-        if self.module is None:
-            msg = 'Service not supported on this platform'
-            self._notify('*', action='failed-service', description=msg)
-            raise NotImplementedError(msg)
+    def getPage(self, page_id):
+        try:
+            return self.pages[page_id]
+        except KeyError:
+            # build a new page and register as a observer
+            page = self.module.buildPage(self.module, page_id)
+            page.setObserver(self)
+            self.pages[page_id] = page
+            return page
 
-        # launch the socket server
-        self.server = self.module.buildServer(self.module, self.port)
+    def stopPages(self):
+        '''Stops every started page, as if each had asked.'''
+        for page in self.pages.values():
+            if page.started:
+                page.pushRequest({'action' : 'stop-service', 
+                    'service' : self.name})
+        self.pages = {}
+
+    def pushResponse(self, page_id, cmd, data=None):
+        self.client.pushResponse(page_id, cmd, data, self.name)
+
+    def pushTemplate(self, page_id, template, values):
+        self.client.pushTemplate(page_id, template, values, self.name)
+
+class Client(object):
+    '''
+    One browser window connected to Outfox. Page IDs are only unique within
+    a window, so each client keeps its own pages for every service.
+
+    @ivar outfox Outfox instance serving the client
+    @ivar server JSON server connected to the browser window
+    @ivar hosted Dictionary mapping service names to HostedService instances
+    @ivar responses List of encoded responses waiting for the end of the
+        main loop tick
+    @ivar closed Boolean True once the connection is gone
+    '''
+    def __init__(self, outfox, server):
+        self.outfox = outfox
+        self.server = server
+        self.hosted = {}
+        for name, module in outfox.modules:
+            self.hosted[name] = HostedService(self, name, module)
+        self.responses = []
+        self.closed = False
         # observe socket server messages so we can dispatch
         self.server.setObserver(self)
-        # let the server connect
-        self.server.doConnect()
 
-        # let the module dictate what happens next
-        self.module.run(self.module)
-        
-    def _notify(self, page_id, cmd=None, **kwargs):
+    def _notify(self, page_id, cmd=None, service=None, **kwargs):
+        if self.closed:
+            return
         if cmd is None:
             cmd = {}
             cmd.update(kwargs)
-        cmd['service'] = self.service
-        json = simplejson.dumps({'page_id' : page_id, 'cmd' : cmd})
-        if self.server:
-            # use the json server
-            self.server.sendMessage(json+DELIMITER)            
-        else:
-            # open a new socket to report the failure
-            s = socket.socket()
-            s.connect(('127.0.0.1', self.port))
-            s.sendall(json+DELIMITER)            
+        cmd['service'] = service or self.outfox.services[0]
+        # keep order with any batched responses
+        self.flushResponses()
+        # the json server frames the message
+        self.server.sendMessage(codec.dumps({'page_id' : page_id, 
+            'cmd' : cmd}))
 
     def shutdown(self):
-        self.module.shutdown(self.module)
+        if self.closed:
+            return
+        self.closed = True
+        # release whatever the window's pages still hold in shared modules
+        for hosted in self.hosted.values():
+            hosted.stopPages()
+        self.responses = []
+        self.outfox.removeClient(self)
 
-    def pushRequest(self, json):
+    def pushRequest(self, json, data=None):
         try:
             # decode the json
-            dec = simplejson.loads(json)
-            page_id = dec['page_id']
+            dec = codec.loads(json)
         except Exception:
-            # just ignore bad json or missing page IDs; don't know what page
-            # sent it
+            # just ignore bad json
+            return
+
+        if isinstance(dec, list):
+            # batch of requests; attachments only come with single requests
+            for env in dec:
+                self._handleRequest(env)
+        else:
+            self._handleRequest(dec, data)
+    def _handleRequest(self, dec, data=None):
+        if not isinstance(dec, dict):
+            # not an envelope
             return
 
+        try:
+            framing = dec['framing']
+        except KeyError:
+            pass
+        else:
+            # the browser frames everything after this message anew
+            try:
+                self.server.setFraming(incoming=framing)
+            except ValueError:
+                pass
+            return
+
+        try:
+            page_id = dec['page_id']
+        except KeyError:
+            # don't know what page sent it
+            return
+
+        offer = dec.get('framing_offer')
+        if offer is not None:
+            self._acceptFraming(offer)
+
         try:
             # get the command
             cmd = dec['cmd']
+            if data:
+                # binary payload sent alongside the JSON
+                cmd['attachment'] = data
         except KeyError:
             # notify about missing commands
             self._notify(page_id, action='error', 
                 description='Missing command payload.')
             return
 
-        try:
-            # get the page matching the given id
-            page = self.pages[page_id]
-        except KeyError:
-            # build a new page and register as a observer
-            page = self.module.buildPage(self.module, page_id)
-            page.setObserver(self)
-            self.pages[page_id] = page
-            
+        if self.outfox.pool is not None:
+            # the page runs in a worker process
+            self.outfox.pool.route(self, page_id, cmd)
+            return
+
+        # get the service the command is for
+        service = cmd.get('service')
+        hosted = self.hosted.get(service)
+        if hosted is None:
+            if service in self.outfox.services or len(self.hosted) != 1:
+                # configured but not loaded on this platform, or unknown; 
+                # let the page give up on it instead of waiting
+                self._notify(page_id, service=service, 
+                    action='failed-service', 
+                    description='Service not supported on this platform')
+                return
+            # only one service to pick
+            hosted = self.hosted.values()[0]
+        # get the page matching the given id
+        page = hosted.getPage(page_id)
+
         try:
             # let the page controller dispatch the message
             page.pushRequest(cmd)
@@ -103,36 +201,372 @@ class Outfox(object):
             # happened so best that we notify that the entire service failed
             import traceback
             traceback.print_exc()
-            self._notify('*', action='failed-service', description=str(e))
+            self._notify('*', service=hosted.name, action='failed-service',
+                description=str(e))
             return
 
         # remove page reference if destroying, even if we just created
         if cmd.get('action') == 'stop-service':
-            del self.pages[page_id]
+            del hosted.pages[page_id]
 
-    def pushResponse(self, page_id, cmd):
+    def pushResponse(self, page_id, cmd, data=None, service=None):
+        if self.closed:
+            # nobody left to tell
+            return
         # add service name to the command
-        cmd['service'] = self.service
+        cmd['service'] = service or self.outfox.services[0]
         # encode as json
-        msg = simplejson.dumps({'page_id' : page_id, 'cmd' : cmd})
+        msg = codec.dumps({'page_id' : page_id, 'cmd' : cmd})
+        if data:
+            # binary attachments need length framing and a frame of their 
+            # own
+            self.flushResponses()
+            self.server.sendMessage(msg, data)
+            return
+        self._queueResponse(msg)
+
+    def pushTemplate(self, page_id, template, values, service=None):
+        '''
+        Sends a fixed-shape response encoded by a template.
+
+        @param page_id Page ID the response is for
+        @param template codec.ResponseTemplate instance
+        @param values Sequence of field values in template order
+        @param service String service name, or None for the default service
+        '''
+        service = service or self.outfox.services[0]
+        self._queueResponse(template.encode(page_id, service, values))
+
+    def _queueResponse(self, msg):
+        if self.closed:
+            return
+        self.responses.append(msg)
+        if len(self.responses) == 1:
+            try:
+                # send along with everything else from this main loop tick
+                self.server.requestFlush()
+            except AttributeError:
+                # server can't tell us when the tick ends; send now
+                self.flushResponses()
+
+    def flushResponses(self):
+        '''
+        Sends all batched responses in one message, as a JSON array of
+        envelopes if there is more than one.
+        '''
+        if not self.responses:
+            return
+        if len(self.responses) == 1:
+            msg = self.responses[0]
+        else:
+            # already encoded, so join rather than encode again
+            msg = '[' + ','.join(self.responses) + ']'
+        self.responses = []
         # send using the server
         self.server.sendMessage(msg)
 
-    def _findModule(self):
+    def _acceptFraming(self, framing):
+        '''
+        Switches responses to a framing offered by the browser if the server
+        supports it. The browser answers with its own switch once it reads 
+        ours.
+
+        @param framing String framing name
+        '''
+        if framing not in getattr(self.server, 'framings', ()):
+            # server only speaks delimited messages
+            return
+        if self.server.out_framing == framing:
+            return
+        # anything already batched goes out in the old framing
+        self.flushResponses()
+        # tell the browser everything after this message is framed anew
+        self.server.sendMessage(codec.dumps({'framing' : framing}))
+        self.server.setFraming(outgoing=framing)
+
+class Outfox(object):
+    '''
+    Hosts one or more services for one browser window or, as a daemon, for
+    every window that launches Outfox while it runs. Service modules and
+    whatever they share at module level, like the FMOD system and caches,
+    are loaded once for all windows.
+
+    @ivar port Integer port of the browser window that launched us
+    @ivar services List of service names to host, the first being the 
+        default
+    @ivar daemon Boolean True to serve other windows too
+    @ivar workers Integer number of worker processes to run pages in, or 0
+        to run them in this process
+    @ivar worker Boolean True if this process is a worker of a front process
+    @ivar modules List of (name, module) tuples for the hosted services
+    @ivar clients List of Client instances for connected windows
+    @ivar listener Server accepting windows handed off by other processes,
+        or None
+    @ivar pool ShardPool running pages in worker processes, or None
+    @ivar key String secret handoffs must carry, or None
+    '''
+    def __init__(self, port, services, daemon=False, workers=0, 
+    worker=False):
+        self.port = port
+        self.services = services
+        self.daemon = daemon
+        self.workers = workers
+        self.worker = worker
+        self.modules = []
+        self.clients = []
+        self.listener = None
+        self.pool = None
+        self.key = None
+
+    def run(self):
+        # locate the proper modules for this platform
+        for name in self.services:
+            module = self._findModule(name)
+            if module is not None:
+                self.modules.append((name, module))
+        if not self.modules:
+            msg = 'Service not supported on this platform'
+            self._notify('*', services=self.services, 
+                action='failed-service', description=msg)
+            raise NotImplementedError(msg)
+        modules = [module for name, module in self.modules]
+        host = self._findPlatformHook('runHost')
+        if len(modules) > 1 and host is None:
+            msg = 'Services cannot share a process on this platform'
+            self._notify('*', services=[name for name, module in 
+                self.modules], action='failed-service', description=msg)
+            raise NotImplementedError(msg)
+        if self.daemon:
+            self._listen(modules)
+        front = None
+        if self.workers:
+            front = self._startPool(modules)
+
+        # serve the window that launched us
+        self.addClient(self.port)
+
+        if front is not None:
+            # only relay between the clients and the workers
+            front(modules, self.pool)
+        elif host is None:
+            # let the module dictate what happens next
+            modules[0].run(modules[0])
+        else:
+            # let the platform run all the modules on one main loop
+            host(modules)
+
+    def _notify(self, page_id, cmd=None, services=None, **kwargs):
+        if cmd is None:
+            cmd = {}
+            cmd.update(kwargs)
+        # send a copy of the command for each service it concerns
+        envelopes = [{'page_id' : page_id, 'cmd' : dict(cmd, service=name)}
+            for name in services or self.services[:1]]
+        if len(envelopes) == 1:
+            json = codec.dumps(envelopes[0])
+        else:
+            # batched like responses from one main loop tick
+            json = codec.dumps(envelopes)
+        # open a new socket to report the failure
+        s = socket.socket()
+        s.connect(('127.0.0.1', self.port))
+        s.sendall(json+DELIMITER)            
+
+    def _listen(self, modules):
+        build = self._findPlatformHook('buildListener')
+        if build is not None:
+            try:
+                self.listener = build(modules, DAEMON_PORT)
+            except socket.error, e:
+                # another daemon got there first; it can't take our window 
+                # anymore, so serve it alone
+                print 'daemon listen failed', e
+        if self.listener is not None:
+            try:
+                self.key = writeDaemonKey()
+            except EnvironmentError, e:
+                # nobody could hand off to us
+                print 'daemon key failed', e
+                self.listener.close()
+                self.listener = None
+        if self.listener is None:
+            self.daemon = False
+        else:
+            self.listener.setObserver(self)
+
+    def _startPool(self, modules):
+        build = self._findPlatformHook('buildPool')
+        front = self._findPlatformHook('runFront')
+        if build is not None and front is not None:
+            self.pool = build(modules, self, self.workers)
+        if self.pool is None:
+            # run pages here instead
+            return None
+        return front
+
+    def addClient(self, port):
+        '''
+        Connects to a browser window and serves its pages.
+
+        @param port Integer port the browser window listens on
+        '''
+        module = self.modules[0][1]
+        # launch the socket server
+        server = module.buildServer(module, port)
+        self.clients.append(Client(self, server))
+        if self.worker:
+            # both ends are ours, so skip negotiating framing
+            server.setFraming(LENGTH_FRAMING, LENGTH_FRAMING)
+        # let the server connect
+        server.doConnect()
+
+    def removeClient(self, client):
+        '''
+        Forgets a disconnected browser window. Quits with the last one.
+
+        @param client Client instance
+        '''
+        try:
+            self.clients.remove(client)
+        except ValueError:
+            return
+        if self.pool is not None:
+            self.pool.removeClient(client)
+        if not self.clients:
+            self.shutdown()
+
+    def pushHandoff(self, json):
+        '''
+        Takes a browser window from a newly launched Outfox process if this
+        process hosts all the services it wants.
+
+        @param json JSON encoded dictionary with the window port, service
+            names, and daemon key
+        @return JSON encoded dictionary saying if the window was accepted
+        '''
+        try:
+            dec = codec.loads(json)
+            port = int(dec['port'])
+            wanted = dec['services']
+            key = str(dec['key'])
+        except Exception:
+            return codec.dumps({'accepted' : False})
+        if self.key is None or not hmac.compare_digest(key, self.key):
+            # only processes of the user running the daemon know the key
+            return codec.dumps({'accepted' : False})
+        hosted = [name for name, module in self.modules]
+        if not self.clients or [n for n in wanted if n not in hosted]:
+            # quitting, or missing a service
+            return codec.dumps({'accepted' : False})
+        self.addClient(port)
+        return codec.dumps({'accepted' : True})
+
+    def shutdown(self):
+        if self.listener is not None:
+            # new windows need a new daemon from now on
+            self.listener.close()
+            self.listener = None
+        if self.pool is not None:
+            # workers quit when their connections close
+            self.pool.close()
+            self.pool = None
+        for name, module in self.modules:
+            module.shutdown(module)
+
+    def _getPlatform(self):
         if sys.platform == 'darwin':
-            pkg = 'osx'
+            return 'osx'
         elif sys.platform == 'win32':
-            pkg = 'win32'
+            return 'win32'
         else:
-            pkg = 'nix'
+            return 'nix'
+
+    def _findModule(self, service):
+        pkg = self._getPlatform()
         module = None
         try:
-            name = '%s.%s' % (pkg, self.service)
-            module = __import__(name, globals(), locals(), [self.service])
+            name = '%s.%s' % (pkg, service)
+            module = __import__(name, globals(), locals(), [service])
         except Exception, e:
             print 'import failed', e
         return module
 
+    def _findPlatformHook(self, name):
+        '''
+        @param name String name of a function in the platform package
+        @return Function, or None if the platform package lacks it
+        '''
+        try:
+            pkg = __import__(self._getPlatform(), globals(), locals(), [])
+        except Exception, e:
+            print 'import failed', e
+            return None
+        return getattr(pkg, name, None)
+
+def writeDaemonKey():
+    '''
+    Makes a new secret for handoffs to this daemon.
+
+    @return String secret
+    @raise EnvironmentError If the secret can't be stored
+    '''
+    folder = os.path.dirname(DAEMON_KEY_PATH)
+    if not os.path.isdir(folder):
+        os.makedirs(folder, 0700)
+    key = os.urandom(16).encode('hex')
+    # replace any old key, readable by us alone
+    tmp = '%s.%d' % (DAEMON_KEY_PATH, os.getpid())
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+    try:
+        os.write(fd, key)
+    finally:
+        os.close(fd)
+    if os.path.exists(DAEMON_KEY_PATH) and sys.platform == 'win32':
+        # rename won't replace a file there
+        os.remove(DAEMON_KEY_PATH)
+    os.rename(tmp, DAEMON_KEY_PATH)
+    return key
+
+def handOff(port, services):
+    '''
+    Asks a running daemon to serve a browser window.
+
+    @param port Integer port the browser window listens on
+    @param services List of service names the window wants
+    @return True if the daemon took the window
+    '''
+    try:
+        f = open(DAEMON_KEY_PATH, 'r')
+        try:
+            key = f.read()
+        finally:
+            f.close()
+    except EnvironmentError:
+        # no daemon has run as this user
+        return False
+    s = socket.socket()
+    s.settimeout(HANDOFF_TIMEOUT)
+    reply = ''
+    try:
+        try:
+            s.connect(('127.0.0.1', DAEMON_PORT))
+            s.sendall(codec.dumps({'port' : port, 'services' : services,
+                'key' : key}) + DELIMITER)
+            while not reply.endswith(DELIMITER):
+                chunk = s.recv(4096)
+                if not chunk:
+                    return False
+                reply += chunk
+        except socket.error:
+            # no daemon
+            return False
+    finally:
+        s.close()
+    try:
+        return bool(codec.loads(reply[:-1])['accepted'])
+    except Exception:
+        return False
+
 def main():
     import sys
     pid = os.getpid()
@@ -140,12 +574,24 @@ def main():
     # not possible to tell the launcher that the port number is missing, so just
     # fail with an exception
     port = int(sys.argv[1])
-    service = sys.argv[2]
+    # one or more services to host in this process, optionally as a daemon 
+    # serving other browser windows too, optionally running pages in worker
+    # processes
+    services = [arg for arg in sys.argv[2:] if not arg.startswith('--')]
+    options = [arg for arg in sys.argv[2:] if arg.startswith('--')]
+    daemon = '--daemon' in options
+    worker = '--worker' in options
+    workers = 0
+    for opt in options:
+        if opt.startswith('--workers='):
+            workers = int(opt.split('=', 1)[1])
+    if daemon and handOff(port, services):
+        print 'Handed off to daemon:', pid
+        return
     # create the main controller
-    fs = Outfox(port, service)
+    fs = Outfox(port, services, daemon, workers, worker)
     fs.run()
     print 'Quitting Outfox:', pid
 
 if __name__ == "__main__":
-    import os
     main()
@@ -0,0 +1,5 @@
+"""
+C accelerators for simplejson, borrowed from the standard library's _json
+module, which is a port of the simplejson speedups extension.
+"""
+from _json import scanstring, encode_basestring_ascii
@@ -18,6 +18,9 @@ OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 from common.server import JSONServer
 from common.audio.channel import ChannelBase
 from common.audio.page import PageController
+from common.audio.uttercache import UtteranceCache
+from common.audio.soundcache import SoundCache
+from common.audio.utterstore import UtteranceStore
 import channel
 import asyncore
 import os
@@ -26,10 +29,15 @@ from ctypes import *
 # audio specific resources
 FMOD_MODULE = None
 FMOD_SYSTEM = c_void_p()
+UTTERANCE_CACHE = None
+SOUND_CACHE = None
+UTTERANCE_STORE_PATH = os.path.join(os.environ.get('APPDATA', 
+    os.path.expanduser('~')), 'Outfox', 'speech')
 RUNNING = True
 
 def buildChannel(module, ch_id):
-    return channel.ChannelController(ch_id, FMOD_MODULE, FMOD_SYSTEM)
+    return channel.ChannelController(ch_id, FMOD_MODULE, FMOD_SYSTEM, 
+        UTTERANCE_CACHE, SOUND_CACHE)
 
 # common service functions
 def buildServer(module, port):
@@ -54,6 +62,14 @@ def run(module):
         raise RuntimeError
     # store FMOD globally for channels
     module.FMOD_MODULE = fmod
+    # keep synthesized speech across service restarts when possible
+    try:
+        store = UtteranceStore(UTTERANCE_STORE_PATH)
+    except EnvironmentError:
+        store = None
+    module.UTTERANCE_CACHE = UtteranceCache(store=store)
+    # decoded sounds are shared by every channel on every page
+    module.SOUND_CACHE = SoundCache(fmod)
     
     # main event loop polls json server and FMOD
     i = 0
@@ -28,14 +28,17 @@ E_REG = {'MSSam' : (137.89, 1.11),
          'MSMike' : (154.37, 1.11)}
 
 class ChannelController(FMODSpeechBase):
-    def __init__(self, ch_id, fmod, fsys):
+    engine = 'sapi'
+
+    def __init__(self, ch_id, fmod, fsys, utterances=None, sounds=None):
         # build speech synth
         self.tts = tts.Create(output=False)
         self.tts.SetOutputFormat(22, 16, 1)
         # store default voice
         self.default_voice = self.tts.Voice
         # initialize base class after default voice is known
-        FMODSpeechBase.__init__(self, ch_id, fmod, fsys)
+        FMODSpeechBase.__init__(self, ch_id, fmod, fsys, None, utterances,
+            sounds)
         # set tts defaults
         self.tts.Voice = self.config['voice']
         a, b = E_REG.get(self.tts.Voice, E_REG['MSMary'])
@@ -68,7 +71,14 @@ class ChannelController(FMODSpeechBase):
         # adjust the rate based on the new voice
         self.tts.Rate = int(math.log(self.config['rate']/a, b))
 
-    def _synthesizeUtterance(self, text):
+    def _synthesizeUtterance(self, text, token=None):
+        if token is not None:
+            # speak with the voice and rate the job was keyed with, even if
+            # they changed while it waited
+            voice, rate = token.profile
+            self.tts.Voice = voice
+            a, b = E_REG.get(voice, E_REG['MSMary'])
+            self.tts.Rate = int(math.log(rate/a, b))
         # synthesize speech and events
         stream, events = self.tts.Speak(text)
         # return an empty utterance if we didn't synth any words
@@ -83,6 +93,6 @@ class ChannelController(FMODSpeechBase):
             for e in events if e.EventType == tts.tts_event_word]
         
         # populate an utterance object
-        samples = str(stream.GetData())
+        samples = bytearray(stream.GetData())
         return Utterance(text, samples, format.SamplesPerSec, 
             format.BitsPerSample, format.Channels, meta)
\ No newline at end of file
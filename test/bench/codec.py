@@ -0,0 +1,130 @@
+'''
+Compares the JSON backends available to Outfox on typical protocol
+messages.
+
+Usage: python test/bench/codec.py [iterations]
+
+Copyright (c) 2008, 2009 Carolina Computer Assistive Technology
+
+Permission to use, copy, modify, and distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+import os
+import sys
+import time
+
+# make the platform code importable from a checkout
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, 'ext', 'platform'))
+
+from common import codec
+
+def _envelope(cmd, page_id=1):
+    return {'page_id' : page_id, 'cmd' : cmd}
+
+# requests as the extension sends them
+REQUESTS = {
+    'say' : _envelope({'action' : 'say', 'channel' : 0, 'name' : 'intro',
+        'text' : u'The quick brown fox jumps over the lazy dog. ' * 4}),
+    'set-now' : _envelope({'action' : 'set-now', 'channel' : 0,
+        'name' : 'rate', 'value' : 220}),
+}
+
+# responses as services send them
+RESPONSES = {
+    'started-word' : _envelope({'action' : 'started-word', 'channel' : 0,
+        'name' : 'intro', 'location' : 16, 'length' : 5,
+        'service' : 'audio'}),
+    'accel-report' : _envelope({'action' : 'accel-report',
+        't' : 1234567890.123, 'id' : '00:19:1D:12:34:56',
+        'accel' : [0.02, -0.98, 0.13], 'nunchuck_accel' : [],
+        'service' : 'wiimote'}),
+}
+# one main loop tick of a say: start, output, a word per word, finish
+RESPONSES['batch'] = [RESPONSES['started-word']] * 12
+
+# compiled parts of the bundled simplejson, saved while pure ones stand in
+_COMPILED = {}
+
+def _setPure(pure):
+    '''
+    Swaps the bundled simplejson between its compiled parts and the pure
+    Python ones they replace, which it looks up on every call.
+
+    @param pure Boolean True to run pure Python
+    '''
+    import simplejson.encoder
+    import simplejson.decoder
+    if not _COMPILED:
+        _COMPILED['encode'] = simplejson.encoder.encode_basestring_ascii
+        _COMPILED['scan'] = simplejson.decoder.scanstring
+    if pure:
+        simplejson.encoder.encode_basestring_ascii = \
+            simplejson.encoder.py_encode_basestring_ascii
+        simplejson.decoder.scanstring = simplejson.decoder.py_scanstring
+    else:
+        simplejson.encoder.encode_basestring_ascii = _COMPILED['encode']
+        simplejson.decoder.scanstring = _COMPILED['scan']
+
+def _time(func, arg, iterations):
+    start = time.time()
+    for i in xrange(iterations):
+        func(arg)
+    return (time.time() - start) / iterations * 1e6
+
+def main():
+    try:
+        iterations = int(sys.argv[1])
+    except IndexError:
+        iterations = 20000
+    # (label, codec, pure) columns
+    columns = []
+    for name in codec.BACKENDS:
+        try:
+            c = codec.loadCodec(name)
+        except ImportError:
+            print '%s: not available' % name
+            continue
+        columns.append((c.name + ('' if c.accelerated else ' (pure)'), c, 
+            False))
+        if name == 'simplejson' and c.accelerated:
+            # the fallback used where the compiled parts are missing
+            columns.append((c.name + ' (pure)', c, True))
+    print 'default backend: %s' % codec.CODEC.name
+    print
+    print '%-16s %-8s' % ('message', 'op'),
+    for label, c, pure in columns:
+        print '%17s' % label,
+    print
+    for name, obj in sorted(REQUESTS.items()) + sorted(RESPONSES.items()):
+        for op in ('dumps', 'loads'):
+            print '%-16s %-8s' % (name, op),
+            for label, c, pure in columns:
+                _setPure(pure)
+                if op == 'dumps':
+                    usec = _time(c.dumps, obj, iterations)
+                else:
+                    usec = _time(c.loads, c.dumps(obj), iterations)
+                print '%14.2f us' % usec,
+            print
+    _setPure(False)
+
+    # fixed-shape responses through their precompiled templates
+    from common.audio.fmodspeech import STARTED_WORD
+    print
+    print '%-16s %-8s %13.2f us' % ('started-word', 'template', 
+        _time(lambda values: STARTED_WORD.encode(1, 'audio', values),
+            (0, 'intro', 16, 5), iterations))
+
+if __name__ == '__main__':
+    main()
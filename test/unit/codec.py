@@ -0,0 +1,61 @@
+'''
+Tests fixed-shape responses encode the same as the usual response path.
+
+Usage: python test/unit/codec.py
+
+Copyright (c) 2008, 2009 Carolina Computer Assistive Technology
+
+Permission to use, copy, modify, and distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+import os
+import sys
+import unittest
+
+# make the platform code importable from a checkout
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, 'ext', 'platform'))
+
+from common import codec
+
+WORD = codec.ResponseTemplate('started-word', [('channel', 'int'), 
+    ('name', 'json'), ('location', 'int'), ('length', 'int')], 
+    optional=['name'])
+REPORT = codec.ResponseTemplate('accel-report', [('t', 'number')])
+
+class TestResponseTemplate(unittest.TestCase):
+    def _decode(self, template, values):
+        return codec.loads(template.encode(1, 'audio', values))
+
+    def testNamesOfAnyKind(self):
+        for name in ('intro', u'caf\xe9', 7, ['a', 1]):
+            cmd = self._decode(WORD, (0, name, 16, 5))['cmd']
+            self.assertEqual(cmd['name'], name)
+
+    def testMissingName(self):
+        cmd = self._decode(WORD, (0, None, 16, 5))['cmd']
+        self.assertEqual(cmd, {'action' : 'started-word', 'channel' : 0, 
+            'location' : 16, 'length' : 5, 'service' : 'audio'})
+
+    def testNumbers(self):
+        for value in (123L, 1.5, 1e300, -2):
+            cmd = self._decode(REPORT, (value,))['cmd']
+            self.assertEqual(cmd['t'], value)
+
+    def testNonFiniteNumbers(self):
+        for value in (float('nan'), float('inf'), -float('inf')):
+            self.assertRaises(ValueError, REPORT.encode, 1, 'audio', 
+                (value,))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+'''
+Tests the shared decoded sound cache against a stand-in for FMOD.
+
+Usage: python test/unit/soundcache.py
+
+Copyright (c) 2008, 2009 Carolina Computer Assistive Technology
+
+Permission to use, copy, modify, and distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+import os
+import sys
+import unittest
+
+# make the platform code importable from a checkout
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, 'ext', 'platform'))
+
+from common.audio.soundcache import SoundCache
+
+class FakeFMOD(object):
+    '''Sounds are their own decoded sizes.'''
+    def __init__(self):
+        self.released = []
+
+    def FMOD_Sound_GetLength(self, snd, length, unit):
+        length._obj.value = snd
+        return 0
+
+    def FMOD_Sound_Release(self, snd):
+        self.released.append(snd)
+        return 0
+
+class SoundCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.fmod = FakeFMOD()
+        self.cache = SoundCache(self.fmod, limit=32)
+
+    def testEvictsLeastRecentlyUsed(self):
+        self.assertTrue(self.cache.put('a', 10))
+        self.assertTrue(self.cache.put('b', 11))
+        self.cache.get('a')
+        self.assertTrue(self.cache.put('c', 12))
+        self.assertFalse('b' in self.cache)
+        self.assertEqual(self.fmod.released, [11])
+        self.assertEqual(self.cache.getStats()['evictions'], 1)
+
+    def testKeepsSoundsInUse(self):
+        self.cache.put('a', 20)
+        self.cache.acquire('a')
+        self.cache.put('b', 10)
+        self.cache.get('b')
+        self.assertTrue(self.cache.put('c', 12))
+        self.assertTrue('a' in self.cache)
+        self.assertFalse('b' in self.cache)
+
+    def testNewSoundThatDoesNotFitBesideSoundsInUse(self):
+        self.cache.put('a', 20)
+        self.cache.acquire('a')
+        # the caller keeps ownership; nothing is released behind its back
+        self.assertFalse(self.cache.put('b', 20))
+        self.assertFalse('b' in self.cache)
+        self.assertEqual(self.fmod.released, [])
+        self.assertEqual(self.cache.size, 20)
+
+    def testReleaseTrimsOverBudget(self):
+        self.cache.put('a', 20)
+        self.cache.acquire('a')
+        self.cache.put('b', 12)
+        self.cache.acquire('b')
+        self.cache.release('a')
+        self.assertTrue(self.cache.put('c', 15))
+        self.assertFalse('a' in self.cache)
+        self.assertTrue(self.cache.size <= self.cache.limit)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+'''
+Tests the synthesis process pool with a stand-in for the speech engine.
+
+Usage: python test/unit/synthpool.py
+
+Copyright (c) 2008, 2009 Carolina Computer Assistive Technology
+
+Permission to use, copy, modify, and distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+import os
+import sys
+import time
+import unittest
+
+# make the platform code importable from a checkout
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, 'ext', 'platform'))
+
+from common.audio.channel import ChannelBase
+from common.audio.synthpool import SynthesisPool
+from common.audio.synthworker import SynthesisJob
+from common.audio.utterance import Utterance
+
+# longest a test waits for the pool
+TIMEOUT = 10
+
+def synthesize(text, profile, stream, token):
+    '''
+    Dies on "die", else makes one word and sample per character, slowly,
+    writing views of the samples like the espeak channel does.
+    '''
+    if text == 'die':
+        os._exit(1)
+    samples = bytearray(2*len(text))
+    for i in xrange(len(text)):
+        if token.cancelled:
+            break
+        samples[2*i:2*i+2] = text[i] * 2
+        stream.write(buffer(samples, 2*i, 2))
+        time.sleep(0.01)
+    return Utterance(text, samples, 22050, 16, 1, 
+        [(j, 1, 2*j) for j in xrange(i)])
+
+class FakeChannel(object):
+    '''Collects finished jobs.'''
+    def __init__(self):
+        self.finished = []
+
+    def _getSynthesisProfile(self):
+        return ('default', 200)
+
+    def _onSynthesized(self, job):
+        self.finished.append(job)
+
+class TestSynthesisPool(unittest.TestCase):
+    def setUp(self):
+        self.channel = FakeChannel()
+        self.pool = SynthesisPool(synthesize, 2)
+        self.pool.start()
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def _submit(self, text):
+        job = SynthesisJob(self.channel, {'text' : text})
+        self.pool.submit(job)
+        return job
+
+    def _wait(self, count):
+        end = time.time() + TIMEOUT
+        while len(self.channel.finished) < count and time.time() < end:
+            ChannelBase.processPending()
+            time.sleep(0.01)
+        return self.channel.finished
+
+    def testDeadProcessIsRetired(self):
+        self._submit('die')
+        self.assertTrue(self._wait(1)[0].error)
+        jobs = [self._submit('word %d' % i) for i in xrange(4)]
+        finished = self._wait(5)
+        self.assertEqual(len(self.pool.processes), 1)
+        for job in jobs:
+            self.assertTrue(job in finished)
+            self.assertEqual(job.error, None)
+
+    def testCancelStopsOnlyItsJob(self):
+        text = 'x' * 200
+        job = self._submit(text)
+        time.sleep(0.2)
+        job.cancel()
+        self._wait(1)
+        self.assertTrue(len(job.utterance.words) < len(text) - 1)
+        # cancelling again after the process moved on has no effect
+        job.cancel()
+        jobs = [self._submit('y' * 20) for i in xrange(2)]
+        self._wait(3)
+        for job in jobs:
+            self.assertEqual(len(job.utterance.words), 19)
+
+    def testSamplesReachUtterance(self):
+        job = self._submit('abcd')
+        self._wait(1)
+        self.assertEqual(str(job.utterance.samples), 'aabbccdd')
+
+    def testNoProcessLeft(self):
+        self._submit('die')
+        self._wait(1)
+        self._submit('die')
+        self._wait(2)
+        job = self._submit('late')
+        self._wait(3)
+        self.assertEqual(self.pool.processes, [])
+        self.assertTrue(job.error)
+
+if __name__ == '__main__':
+    unittest.main()
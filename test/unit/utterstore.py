@@ -0,0 +1,96 @@
+'''
+Tests the persistent utterance store in a scratch directory.
+
+Usage: python test/unit/utterstore.py
+
+Copyright (c) 2008, 2009 Carolina Computer Assistive Technology
+
+Permission to use, copy, modify, and distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+# make the platform code importable from a checkout
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, 'ext', 'platform'))
+
+from common.audio.utterance import Utterance
+from common.audio.utterstore import UtteranceStore, PCM_EXT
+
+def _key(text):
+    return (text, 'default', 200, 'espeak')
+
+def _utter(text, size):
+    return Utterance(text, bytearray(text[0] * size), 22050, 16, 1, 
+        [(0, len(text), 0)])
+
+class TestUtteranceStore(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _pcms(self):
+        return len([name for name in os.listdir(self.path) 
+            if name.endswith(PCM_EXT)])
+
+    def testRoundTrip(self):
+        store = UtteranceStore(self.path)
+        store.put(_key('hello'), _utter('hello', 100))
+        store.flush()
+        utter = UtteranceStore(self.path).get(_key('hello'))
+        self.assertEqual(utter.samples[:], 'h' * 100)
+        self.assertEqual(utter.words, [(0, 5, 0)])
+
+    def testEvictsLeastRecentlyUsed(self):
+        store = UtteranceStore(self.path, 250)
+        store.put(_key('a'), _utter('a', 100))
+        store.put(_key('b'), _utter('b', 100))
+        store.flush()
+        # use a so b is older
+        self.assertNotEqual(store.get(_key('a')), None)
+        store.put(_key('c'), _utter('c', 100))
+        store.flush()
+        self.assertTrue(_key('a') in store)
+        self.assertFalse(_key('b') in store)
+        self.assertTrue(_key('c') in store)
+        self.assertEqual(store.size, 200)
+        self.assertEqual(self._pcms(), 2)
+        # a new process sees the same entries
+        store = UtteranceStore(self.path, 250)
+        self.assertEqual(sorted([entry['pcm'] for entry in 
+            store.index.values()]), sorted(store.pcms.keys()))
+        self.assertEqual(store.get(_key('b')), None)
+
+    def testSharedSamples(self):
+        store = UtteranceStore(self.path, 150)
+        store.put(_key('a'), _utter('a', 100))
+        store.put(('a', 'other', 200, 'espeak'), _utter('a', 100))
+        store.flush()
+        self.assertEqual(store.size, 100)
+        self.assertEqual(len(store.index), 2)
+        self.assertEqual(self._pcms(), 1)
+
+    def testSkipsTooLarge(self):
+        store = UtteranceStore(self.path, 50)
+        store.put(_key('a'), _utter('a', 100))
+        store.flush()
+        self.assertFalse(_key('a') in store)
+
+if __name__ == '__main__':
+    unittest.main()